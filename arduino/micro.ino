@@ -36,8 +36,9 @@ Serial.print(currentPWM##PIN, DEC);
 // FAN speed from tachometer is measured by counting the number
 // of interrupts (pulses) for a small period of time `MEASUREMENT_TIME_MS`.
 //
-// Between the periods the current status (a JSON) is reported and
-// an incoming command is read (if any) from the Serial port.
+// Between the periods the current status (a JSON or a binary frame)
+// is reported. The incoming commands are read from the Serial port
+// during the periods.
 //
 // The number of pulses for each time period is written to a ring buffer,
 // which allows to compute the RPM on a larger time interval than a single
@@ -74,14 +75,36 @@ int pulsesBufferPosition = 0;
 // interrupts, which should be treated as a valid Tachometer pulse.
 #define PULSES_ACCEPT_MIN_DURATION_MS 3
 
+// The RPM computed from the pulses count lags behind by up to
+// `PULSES_BUFFER_LEN` * `MEASUREMENT_TIME_MS` (1.5s), so a jammed fan
+// would be reported as stopped only after that time.
+//
+// So the interval between the last two accepted pulses is recorded too,
+// which gives an instantaneous RPM. When there were no pulses for longer
+// than that interval, the time since the last pulse is used instead, so
+// a slowing fan is reported right away. Below `MIN_INSTANT_RPM` the fan
+// is reported as stopped. It equals the resolution of the RPM computed
+// from the pulses count (a single pulse in the whole ring buffer),
+// so the slow fans which are still measurable aren't reported as stopped.
+// A jammed fan is detected sooner by the host, which considers the fan
+// stopped when this RPM falls to 60 (0.5s without pulses).
+#define MIN_INSTANT_RPM (PULSES_MULTIPLIER / 2)
+// 2 pulses per revolution, see the note below.
+#define INSTANT_RPM_TIMEOUT_US (60L * 1000 * 1000 / 2 / MIN_INSTANT_RPM)
+
 #define TACHO_PULSES_INT_FUNCTION(PIN) \
 volatile int tachoPulses##PIN [PULSES_BUFFER_LEN]; \
 volatile unsigned long lastPulse##PIN; \
+volatile unsigned long lastAcceptedPulseUs##PIN; \
+volatile unsigned long pulseIntervalUs##PIN; \
 void incTachoPulses##PIN () { \
   unsigned long now = millis(); \
   if (now - lastPulse##PIN < PULSES_ACCEPT_MIN_DURATION_MS) { lastPulse##PIN = now; return; } \
   lastPulse##PIN = now; \
   tachoPulses##PIN [pulsesBufferPosition] ++; \
+  unsigned long nowUs = micros(); \
+  pulseIntervalUs##PIN = nowUs - lastAcceptedPulseUs##PIN; \
+  lastAcceptedPulseUs##PIN = nowUs; \
 }
 
 #define TACHO_PULSES_ATTACH_INT(PIN) \
@@ -90,6 +113,8 @@ attachInterrupt(digitalPinToInterrupt(PIN), incTachoPulses##PIN, RISING); \
 { \
   for (int i = 0; i < PULSES_BUFFER_LEN; i++) tachoPulses##PIN[i] = 0; \
   lastPulse##PIN = 0; \
+  lastAcceptedPulseUs##PIN = 0; \
+  pulseIntervalUs##PIN = 0; \
 }
 
 #define TACHO_PULSES_NEXT_BUCKET \
@@ -114,6 +139,18 @@ int sumPulses(volatile int tachoPulses [PULSES_BUFFER_LEN]) {
     return sum;
 }
 
+unsigned int instantRpm(unsigned long lastAcceptedPulseUs, unsigned long pulseIntervalUs) {
+    unsigned long sinceLastPulseUs = micros() - lastAcceptedPulseUs;
+    if (pulseIntervalUs == 0 || sinceLastPulseUs > INSTANT_RPM_TIMEOUT_US) {
+        return 0;
+    }
+    if (sinceLastPulseUs > pulseIntervalUs) {
+        pulseIntervalUs = sinceLastPulseUs;
+    }
+    // 2 pulses per revolution, see the note above.
+    return 60L * 1000 * 1000 / 2 / pulseIntervalUs;
+}
+
 // These are the pins on Arduino Micro which support interrupts.
 // See https://www.arduino.cc/reference/en/language/functions/external-interrupts/attachinterrupt/
 TACHO_PULSES_INT_FUNCTION(0);
@@ -123,12 +160,156 @@ TACHO_PULSES_INT_FUNCTION(3);
 TACHO_PULSES_INT_FUNCTION(7);
 
 
+/////////////////////////
+// Binary status frames:
+
+// By default the status is printed as a JSON line (protocol version 0).
+// The host might ask to switch to the compact binary frames with
+// the `SET_PROTOCOL_COMMAND`.
+//
+// A binary frame has the following layout:
+//   [0xA5 0x5A][version][frame type][payload length][payload][crc16 LE]
+//
+// The CRC is CRC-16/XMODEM computed over everything between
+// the sync bytes and the CRC itself.
+//
+// The status frame payload:
+//   [tacho pins count] count * [pin][rpm (2 bytes LE)]
+//   [pwm pins count] count * [pin][pwm]
+// Since version 5 it is followed by:
+//   [tacho pins count] count * [pin][instantaneous rpm (2 bytes LE)]
+//
+// Versions history:
+// 1 -- binary status frames;
+// 2 -- `SET_SPEED_BATCH_COMMAND`;
+// 3 -- `SET_STATUS_MODE_COMMAND` and `POLL_STATUS_COMMAND`;
+// 4 -- `ACK_COMMAND` and the ack frames;
+// 5 -- instantaneous RPM in the status frames;
+// 6 -- the capabilities frame.
+#define PROTOCOL_VERSION 6
+byte protocolVersion = 0;
+
+// By default the status is printed after each measurement period.
+// The host might disable that with the `SET_STATUS_MODE_COMMAND` and
+// request the status explicitly with the `POLL_STATUS_COMMAND` instead.
+bool statusStreaming = true;
+bool statusRequested = false;
+
+#define FRAME_TYPE_STATUS 'S'
+
+// The ack frame payload:
+//   [sequence number][errors count]
+//
+// Sent in reply to the `ACK_COMMAND`. The commands are processed in order,
+// so the ack confirms that all of the preceding commands have been applied.
+// The errors count is the number of the commands rejected since
+// the previous ack.
+#define FRAME_TYPE_ACK 'A'
+byte commandErrors = 0;
+
+// The capabilities frame payload:
+//   [firmware version (2 bytes LE)][max batch length]
+//   [pwm pins count] count * [pin]
+//   [tacho pins count] count * [pin]
+//
+// Sent in reply to the `SET_PROTOCOL_COMMAND` (when the version is
+// at least 6), so the host could validate the pins it is configured with.
+// A firmware for a different board should list its own pins here.
+#define FRAME_TYPE_CAPABILITIES 'C'
+
+// Incremented on each change of this program.
+#define FIRMWARE_VERSION 1
+const byte PWM_PINS[] = {5, 9, 10, 11};
+const byte TACHO_PINS[] = {0, 1, 2, 3, 7};
+
+#define TACHO_PINS_COUNT sizeof(TACHO_PINS)
+#define PWM_PINS_COUNT sizeof(PWM_PINS)
+#define STATUS_FRAME_PAYLOAD_LEN (1 + TACHO_PINS_COUNT * 3 + 1 + PWM_PINS_COUNT * 2)
+#define STATUS_FRAME_INSTANT_RPM_LEN (1 + TACHO_PINS_COUNT * 3)
+
+uint16_t frameCrc;
+
+void frameWrite(byte b) {
+  Serial.write(b);
+  frameCrc ^= (uint16_t)b << 8;
+  for (int i = 0; i < 8; i++) {
+    frameCrc = (frameCrc & 0x8000) ? (frameCrc << 1) ^ 0x1021 : (frameCrc << 1);
+  }
+}
+
+void frameBegin(byte frameType, byte payloadLength) {
+  Serial.write(0xA5);
+  Serial.write(0x5A);
+  frameCrc = 0;
+  frameWrite(protocolVersion);
+  frameWrite(frameType);
+  frameWrite(payloadLength);
+}
+
+void frameEnd() {
+  Serial.write(frameCrc & 0xFF);
+  Serial.write(frameCrc >> 8);
+}
+
+#define FRAME_WRITE_RPM(PIN) \
+{ \
+  unsigned int rpm = PULSES_MULTIPLIER * sumPulses(tachoPulses##PIN) / 2; \
+  frameWrite(PIN); \
+  frameWrite(rpm & 0xFF); \
+  frameWrite(rpm >> 8); \
+}
+
+#define FRAME_WRITE_PWM(PIN) \
+frameWrite(PIN); \
+frameWrite(currentPWM##PIN);
+
+// The 32-bit values are written by the interrupt handler, so they
+// must be copied with the interrupts disabled to not be torn.
+// The status is printed with the interrupts already disabled (see `loop`),
+// so their previous state is restored instead of enabling them.
+#define FRAME_WRITE_INSTANT_RPM(PIN) \
+{ \
+  uint8_t oldSREG = SREG; \
+  noInterrupts(); \
+  unsigned long lastAcceptedPulseUs = lastAcceptedPulseUs##PIN; \
+  unsigned long pulseIntervalUs = pulseIntervalUs##PIN; \
+  SREG = oldSREG; \
+  unsigned int rpm = instantRpm(lastAcceptedPulseUs, pulseIntervalUs); \
+  frameWrite(PIN); \
+  frameWrite(rpm & 0xFF); \
+  frameWrite(rpm >> 8); \
+}
+
+
 /////////////////////////
 // Serial commands:
 
-char setSpeedCommand = '\xf1'; // The only supported command currently.
-char commandBuffer[3];  // Buffer for the incoming command: [command; pin; speed].
+#define SET_SPEED_COMMAND '\xf1'  // [command; pin; speed]
+#define SET_PROTOCOL_COMMAND '\xf2'  // [command; version]
+#define SET_SPEED_BATCH_COMMAND '\xf3'  // [command; n; n * [pin; speed]]
+#define SET_STATUS_MODE_COMMAND '\xf4'  // [command; streaming]
+#define POLL_STATUS_COMMAND '\xf5'  // [command]
+#define ACK_COMMAND '\xf6'  // [command; sequence number]
+
+#define MAX_BATCH_LEN 16
+
+// Buffer for the incoming command.
+char commandBuffer[2 + 2 * MAX_BATCH_LEN];
 int commandPosition = 0;  // The current position in the `commandBuffer`
+int commandLength = 0;  // The expected length of the current command
+
+int expectedCommandLength(char command) {
+  switch (command) {
+    case SET_SPEED_COMMAND: return 3;
+    case SET_PROTOCOL_COMMAND: return 2;
+    // The actual length is known once the second byte is received.
+    case SET_SPEED_BATCH_COMMAND: return 2;
+    case SET_STATUS_MODE_COMMAND: return 2;
+    case POLL_STATUS_COMMAND: return 1;
+    case ACK_COMMAND: return 2;
+    default: return 0;
+  }
+}
 
 /////////////////////////
 
@@ -151,12 +332,16 @@ void setup() {
   Serial.begin(115200);
 }
 
-void loop () {
-
+void applyPWM() {
   Timer3.pwm(5, PWM_255_TO_1023(currentPWM5));
   Timer1.pwm(9, PWM_255_TO_1023(currentPWM9));
   Timer1.pwm(10, PWM_255_TO_1023(currentPWM10));
   Timer1.pwm(11, PWM_255_TO_1023(currentPWM11));
+}
+
+void loop () {
+
+  applyPWM();
 
   // Measure RPM from tachometers:
   TACHO_PULSES_RESET_CURRENT_BUCKET(0);
@@ -165,14 +350,61 @@ void loop () {
   TACHO_PULSES_RESET_CURRENT_BUCKET(3);
   TACHO_PULSES_RESET_CURRENT_BUCKET(7);
   interrupts();
-  delay (MEASUREMENT_TIME_MS);
+  // Keep processing the commands while the pulses are being counted,
+  // so the new PWM values and the acks aren't delayed until the end
+  // of the measurement period.
+  unsigned long measurementStart = millis();
+  while (millis() - measurementStart < MEASUREMENT_TIME_MS) {
+    readSerialCommand();
+  }
   noInterrupts();
   TACHO_PULSES_NEXT_BUCKET;
 
   readSerialCommand();
 
-  // Print the status (in JSON):
+  if (statusStreaming || statusRequested) {
+    statusRequested = false;
+    if (protocolVersion >= 1) {
+      printStatusFrame();
+    } else {
+      printStatusJson();
+    }
+  }
+}
+
+void printStatusFrame() {
+  frameBegin(
+    FRAME_TYPE_STATUS,
+    STATUS_FRAME_PAYLOAD_LEN
+    + (protocolVersion >= 5 ? STATUS_FRAME_INSTANT_RPM_LEN : 0)
+  );
+
+  frameWrite(TACHO_PINS_COUNT);
+  FRAME_WRITE_RPM(0);
+  FRAME_WRITE_RPM(1);
+  FRAME_WRITE_RPM(2);
+  FRAME_WRITE_RPM(3);
+  FRAME_WRITE_RPM(7);
+
+  frameWrite(PWM_PINS_COUNT);
+  FRAME_WRITE_PWM(5);
+  FRAME_WRITE_PWM(9);
+  FRAME_WRITE_PWM(10);
+  FRAME_WRITE_PWM(11);
+
+  if (protocolVersion >= 5) {
+    frameWrite(TACHO_PINS_COUNT);
+    FRAME_WRITE_INSTANT_RPM(0);
+    FRAME_WRITE_INSTANT_RPM(1);
+    FRAME_WRITE_INSTANT_RPM(2);
+    FRAME_WRITE_INSTANT_RPM(3);
+    FRAME_WRITE_INSTANT_RPM(7);
+  }
+
+  frameEnd();
+}
 
+void printStatusJson() {
   Serial.print("{");
 
   Serial.print("\"fan_inputs\": {");
@@ -203,15 +435,33 @@ void loop () {
 void readSerialCommand() {
   while (Serial.available()) {
     char c = Serial.read();
-    if (commandPosition == 0 && c != setSpeedCommand) {
-      Serial.print("{\"error\": \"Unknown command ");
-      Serial.print(c, HEX);
-      Serial.print("\"}\n");
-      continue;
+    if (commandPosition == 0) {
+      commandLength = expectedCommandLength(c);
+      if (commandLength == 0) {
+        commandErrors++;
+        Serial.print("{\"error\": \"Unknown command ");
+        Serial.print(c, HEX);
+        Serial.print("\"}\n");
+        continue;
+      }
     }
     commandBuffer[commandPosition] = c;
     commandPosition++;
-    if (commandPosition >= 3) {
+    if (commandPosition == 2 && commandBuffer[0] == SET_SPEED_BATCH_COMMAND) {
+      byte batchLen = (byte)commandBuffer[1];
+      if (batchLen > MAX_BATCH_LEN) {
+        commandErrors++;
+        Serial.print("{\"error\": \"Too many pins in the batch command: ");
+        Serial.print(batchLen, DEC);
+        Serial.print("\"}\n");
+        // The following pin values would be reported as unknown commands
+        // until the stream is in sync again.
+        commandPosition = 0;
+        continue;
+      }
+      commandLength = 2 + 2 * batchLen;
+    }
+    if (commandPosition >= commandLength) {
       // The command buffer is now complete, process it:
       processSerialCommand();
 
@@ -221,17 +471,72 @@ void readSerialCommand() {
 }
 
 void processSerialCommand() {
-  // assert (commandBuffer[0] == setSpeedCommand);
+  switch (commandBuffer[0]) {
+    case SET_SPEED_COMMAND: processSetSpeedCommand(); break;
+    case SET_PROTOCOL_COMMAND: processSetProtocolCommand(); break;
+    case SET_SPEED_BATCH_COMMAND: processSetSpeedBatchCommand(); break;
+    case SET_STATUS_MODE_COMMAND:
+      statusStreaming = commandBuffer[1] != 0;
+      // Reply with a status, so the host would know that the command
+      // is supported.
+      statusRequested = true;
+      break;
+    case POLL_STATUS_COMMAND: statusRequested = true; break;
+    case ACK_COMMAND: printAckFrame((byte)commandBuffer[1]); break;
+  }
+}
+
+void printAckFrame(byte sequenceNumber) {
+  frameBegin(FRAME_TYPE_ACK, 2);
+  frameWrite(sequenceNumber);
+  frameWrite(commandErrors);
+  frameEnd();
+  commandErrors = 0;
+}
+
+void processSetSpeedBatchCommand() {
+  byte batchLen = (byte)commandBuffer[1];
+  for (int i = 0; i < batchLen; i++) {
+    setSpeed(commandBuffer[2 + 2 * i], (byte)commandBuffer[3 + 2 * i]);
+  }
+  applyPWM();
+}
+
+void processSetProtocolCommand() {
+  byte version = (byte)commandBuffer[1];
+  protocolVersion = (version < PROTOCOL_VERSION) ? version : PROTOCOL_VERSION;
+  if (protocolVersion >= 6) {
+    printCapabilitiesFrame();
+  }
+}
+
+void printCapabilitiesFrame() {
+  frameBegin(FRAME_TYPE_CAPABILITIES, 3 + 1 + PWM_PINS_COUNT + 1 + TACHO_PINS_COUNT);
+  frameWrite(FIRMWARE_VERSION & 0xFF);
+  frameWrite(FIRMWARE_VERSION >> 8);
+  frameWrite(MAX_BATCH_LEN);
+  frameWrite(PWM_PINS_COUNT);
+  for (unsigned int i = 0; i < PWM_PINS_COUNT; i++) frameWrite(PWM_PINS[i]);
+  frameWrite(TACHO_PINS_COUNT);
+  for (unsigned int i = 0; i < TACHO_PINS_COUNT; i++) frameWrite(TACHO_PINS[i]);
+  frameEnd();
+}
+
+void processSetSpeedCommand() {
+  setSpeed(commandBuffer[1], (byte)commandBuffer[2]);
+  applyPWM();
+}
 
-  byte pwm = (byte)commandBuffer[2];
-  switch (commandBuffer[1]) {
+void setSpeed(char pin, byte pwm) {
+  switch (pin) {
     case 5:  SET_PWM(5,  pwm); break;
     case 9:  SET_PWM(9,  pwm); break;
     case 10: SET_PWM(10, pwm); break;
     case 11: SET_PWM(11, pwm); break;
     default:
+      commandErrors++;
       Serial.print("{\"error\": \"Unknown pin ");
-      Serial.print((int)commandBuffer[1], DEC);
+      Serial.print((int)pin, DEC);
       Serial.print(" for the set speed command\"}\n");
   }
 }
@@ -0,0 +1,180 @@
+"""Benchmarks of `ArduinoConnection` against the emulated board.
+
+Usage: python benchmarks/bench_arduino.py [all|throughput|modes|reconnect|shutdown]
+
+Note that pyserial sleeps for 0.3s when a `socket://` connection
+is closed, which is included in the `reconnect` and `shutdown` timings.
+"""
+
+import statistics
+import time
+from timeit import default_timer
+
+import click
+
+from afancontrol.arduino import (
+    STATUS_MODE_POLL,
+    STATUS_MODE_STREAM,
+    ArduinoConnection,
+    ArduinoName,
+    ArduinoPin,
+)
+from afancontrol.arduino_emulator import ArduinoEmulator
+from afancontrol.pwmfan import PWMValue
+
+emulator_options = [
+    click.option("--latency", default=0.0, show_default=True, help="Seconds"),
+    click.option("--drop-rate", default=0.0, show_default=True),
+    click.option("--corrupt-rate", default=0.0, show_default=True),
+    click.option("--seed", default=0, show_default=True),
+]
+
+
+def with_emulator_options(func):
+    for option in reversed(emulator_options):
+        func = option(func)
+    return func
+
+
+def make_emulator(status_interval, latency, drop_rate, corrupt_rate, seed):
+    return ArduinoEmulator(
+        status_interval=status_interval,
+        latency=latency,
+        drop_rate=drop_rate,
+        corrupt_rate=corrupt_rate,
+        seed=seed,
+    )
+
+
+def make_connection(emulator, **kwargs):
+    return ArduinoConnection(ArduinoName("bench"), emulator.url, **kwargs)
+
+
+def print_timings(name, timings):
+    timings = sorted(timings)
+    click.echo(
+        "%s: n=%s median=%.3fms p95=%.3fms max=%.3fms"
+        % (
+            name,
+            len(timings),
+            statistics.median(timings) * 1000,
+            timings[int(len(timings) * 0.95) - 1] * 1000,
+            timings[-1] * 1000,
+        )
+    )
+
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def main(ctx):
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(all_benchmarks)
+
+
+@main.command("throughput")
+@click.option("--duration", default=3.0, show_default=True, help="Seconds")
+@click.option("--status-interval", default=0.001, show_default=True, help="Seconds")
+@with_emulator_options
+def throughput(duration, status_interval, **emulator_kwargs):
+    """Statuses received and get/set calls served per second."""
+    with make_emulator(status_interval, **emulator_kwargs) as emulator:
+        with make_connection(emulator) as conn:
+            conn.wait_for_status()
+            received = conn.statuses_received
+            sent = emulator.statuses_sent
+            calls = 0
+            start = default_timer()
+            while default_timer() - start < duration:
+                conn.get_rpm(ArduinoPin(3))
+                conn.set_pwm(ArduinoPin(9), PWMValue(calls % 256))
+                calls += 1
+            elapsed = default_timer() - start
+            received = conn.statuses_received - received
+            sent = emulator.statuses_sent - sent
+    click.echo(
+        "throughput: %.0f statuses/s received (%.0f/s sent), "
+        "%.0f get_rpm+set_pwm calls/s"
+        % (received / elapsed, sent / elapsed, calls / elapsed)
+    )
+
+
+@main.command("modes")
+@click.option("--ticks", default=20, show_default=True)
+@click.option("--tick-interval", default=0.5, show_default=True, help="Seconds")
+@click.option("--status-interval", default=0.05, show_default=True, help="Seconds")
+@with_emulator_options
+def modes(ticks, tick_interval, status_interval, **emulator_kwargs):
+    """Reader wakeups in the `stream` and `poll` status modes."""
+    for status_mode in (STATUS_MODE_STREAM, STATUS_MODE_POLL):
+        with make_emulator(status_interval, **emulator_kwargs) as emulator:
+            with make_connection(emulator, status_mode=status_mode) as conn:
+                conn.wait_for_status()
+                received = conn.statuses_received
+                for _ in range(ticks):
+                    conn.poll_status()
+                    conn.get_rpm(ArduinoPin(3))
+                    conn.get_pwm(ArduinoPin(9))
+                    time.sleep(tick_interval)
+                received = conn.statuses_received - received
+        click.echo(
+            "modes: %s: %s statuses (reader wakeups) in %s ticks"
+            % (status_mode, received, ticks)
+        )
+
+
+@main.command("reconnect")
+@click.option("--repeat", default=5, show_default=True)
+@click.option("--status-interval", default=0.05, show_default=True, help="Seconds")
+@with_emulator_options
+def reconnect(repeat, status_interval, **emulator_kwargs):
+    """Time from the board being unplugged until the statuses are served again."""
+    timings = []
+    with make_emulator(status_interval, **emulator_kwargs) as emulator:
+        with make_connection(emulator, status_ttl=1) as conn:
+            conn.wait_for_status()
+            for _ in range(repeat):
+                accepted = emulator.connections_accepted
+                start = default_timer()
+                emulator.disconnect()
+                while True:
+                    try:
+                        conn.get_rpm(ArduinoPin(3))
+                        conn.set_pwm(ArduinoPin(9), PWMValue(255))
+                    except Exception:
+                        pass
+                    else:
+                        if emulator.connections_accepted > accepted:
+                            break
+                    time.sleep(0.001)
+                timings.append(default_timer() - start)
+    print_timings("reconnect", timings)
+
+
+@main.command("shutdown")
+@click.option("--repeat", default=10, show_default=True)
+@click.option("--status-interval", default=0.25, show_default=True, help="Seconds")
+@with_emulator_options
+def shutdown(repeat, status_interval, **emulator_kwargs):
+    """Time spent in `ArduinoConnection.__exit__`."""
+    timings = []
+    with make_emulator(status_interval, **emulator_kwargs) as emulator:
+        for _ in range(repeat):
+            conn = make_connection(emulator)
+            conn.__enter__()
+            conn.wait_for_status()
+            start = default_timer()
+            conn.__exit__(None, None, None)
+            timings.append(default_timer() - start)
+    print_timings("shutdown", timings)
+
+
+@main.command("all")
+@click.pass_context
+def all_benchmarks(ctx):
+    """Run all of the benchmarks with the default options."""
+    for command in (throughput, modes, reconnect, shutdown):
+        ctx.invoke(command)
+
+
+if __name__ == "__main__":
+    main()
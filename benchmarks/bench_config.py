@@ -0,0 +1,126 @@
+"""Benchmarks of `parse_config` on large configs.
+
+Usage: python benchmarks/bench_config.py [all|sections|templates]
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from timeit import default_timer
+
+import click
+
+from afancontrol.config import DaemonCLIConfig, parse_config
+
+HEADER = """
+[daemon]
+
+[actions]
+"""
+
+DAEMON_CLI_CONFIG = DaemonCLIConfig(
+    pidfile=None, logfile=None, exporter_listen_host=None
+)
+
+
+def time_parse(config_path, repeat):
+    start = default_timer()
+    for _ in range(repeat):
+        parsed = parse_config(config_path, DAEMON_CLI_CONFIG)
+    return (default_timer() - start) / repeat, parsed
+
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def main(ctx):
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(all_benchmarks)
+
+
+@main.command("sections")
+@click.option("--disks", default=1000, show_default=True)
+@click.option("--repeat", default=5, show_default=True)
+def sections(disks, repeat):
+    """A section per each disk and a mapping per each 10 disks."""
+    parts = [HEADER]
+    for i in range(disks):
+        parts.append(
+            "[temp:disk-%s]\ntype = hdd\npath = /dev/sd%s\nmin = 30\nmax = 50\n"
+            % (i, i)
+        )
+        parts.append(
+            "[fan:bay-%s]\npwm = /sys/pwm%s\nfan_input = /sys/fan%s_input\n" % (i, i, i)
+        )
+    for i in range(0, disks, 10):
+        parts.append(
+            "[mapping:%s]\nfans = %s\ntemps = %s\n"
+            % (
+                i,
+                ", ".join("bay-%s" % j for j in range(i, i + 10)),
+                ", ".join("disk-%s" % j for j in range(i, i + 10)),
+            )
+        )
+    with TemporaryDirectory() as tmpdirname:
+        config_path = Path(tmpdirname) / "afancontrol.conf"
+        config_path.write_text("\n".join(parts))
+        elapsed, parsed = time_parse(config_path, repeat)
+    click.echo(
+        "sections: %s temps, %s fans, %s mappings: %.1fms per parse"
+        % (
+            len(parsed.temps),
+            len(parsed.fans),
+            len(parsed.mappings),
+            elapsed * 1000,
+        )
+    )
+
+
+@main.command("templates")
+@click.option("--disks", default=1000, show_default=True)
+@click.option("--repeat", default=5, show_default=True)
+def templates(disks, repeat):
+    """The same disks declared with the template sections."""
+    with TemporaryDirectory() as tmpdirname:
+        devices = Path(tmpdirname) / "by-path"
+        devices.mkdir()
+        for i in range(disks):
+            (devices / ("ata-%s" % i)).write_text("")
+        config_path = Path(tmpdirname) / "afancontrol.conf"
+        config_path.write_text(HEADER + """
+[temp:disk-{name}]
+foreach_glob = %(devices)s/ata-*
+type = hdd
+path = {path}
+min = 30
+max = 50
+
+[fan:bay-{n}]
+foreach_range = 0-%(last)s
+pwm = /sys/pwm{n}
+fan_input = /sys/fan{n}_input
+
+[mapping:disks]
+fans = bay-*
+temps = disk-*
+""" % dict(devices=devices, last=disks - 1))
+        elapsed, parsed = time_parse(config_path, repeat)
+    click.echo(
+        "templates: %s temps, %s fans, %s mappings: %.1fms per parse"
+        % (
+            len(parsed.temps),
+            len(parsed.fans),
+            len(parsed.mappings),
+            elapsed * 1000,
+        )
+    )
+
+
+@main.command("all")
+@click.pass_context
+def all_benchmarks(ctx):
+    """Run all of the benchmarks with the default options."""
+    for command in (sections, templates):
+        ctx.invoke(command)
+
+
+if __name__ == "__main__":
+    main()
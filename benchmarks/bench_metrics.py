@@ -0,0 +1,282 @@
+"""Benchmarks of `PrometheusMetrics`.
+
+Usage: python benchmarks/bench_metrics.py [all|tick|scrape|footprint|load]
+"""
+
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from timeit import default_timer
+
+import click
+
+from afancontrol.config import (
+    Actions,
+    AlertCommands,
+    FanName,
+    TempName,
+    TriggerConfig,
+)
+from afancontrol.fans import Fans
+from afancontrol.metrics import BuiltinMetrics, PrometheusMetrics
+from afancontrol.pwmfan import BasePWMFan, FanValue, PWMFanNorm, PWMValue
+from afancontrol.report import Report
+from afancontrol.temp import TempCelsius, TempStatus
+from afancontrol.trigger import Triggers
+
+EXPORTERS = {"builtin": BuiltinMetrics, "prometheus_client": PrometheusMetrics}
+
+
+class StaticPWMFan(BasePWMFan):
+    def get(self) -> PWMValue:
+        return PWMValue(142)
+
+    def _set_raw(self, pwm: PWMValue) -> None:
+        pass
+
+    def get_speed(self) -> FanValue:
+        return FanValue(999)
+
+    def _enable_pwm(self) -> None:
+        pass
+
+    def _disable_pwm(self) -> None:
+        pass
+
+
+def make_tick_args(temps_count, fans_count):
+    report = Report(report_command="true")
+    temps = {
+        TempName("temp%s" % i): TempStatus(
+            temp=TempCelsius(45.0),
+            min=TempCelsius(40.0),
+            max=TempCelsius(50.0),
+            panic=TempCelsius(60.0),
+            threshold=None,
+            is_panic=False,
+            is_threshold=False,
+        )
+        for i in range(temps_count)
+    }
+    # Every 10th sensor is failing, so the NaN path is measured too.
+    for temp_name in list(temps)[::10]:
+        temps[temp_name] = None
+    fans = Fans(
+        {
+            FanName("fan%s" % i): PWMFanNorm(
+                StaticPWMFan(),
+                pwm_line_start=PWMValue(100),
+                pwm_line_end=PWMValue(240),
+            )
+            for i in range(fans_count)
+        },
+        report=report,
+    )
+    no_commands = AlertCommands(enter_cmd=None, leave_cmd=None)
+    triggers = Triggers(
+        TriggerConfig(
+            global_commands=Actions(panic=no_commands, threshold=no_commands),
+            temp_commands={
+                temp_name: Actions(panic=no_commands, threshold=no_commands)
+                for temp_name in temps
+            },
+            command_parallelism=4,
+            command_timeout=5,
+        ),
+        report,
+    )
+    return dict(temps=temps, fans=fans, triggers=triggers)
+
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def main(ctx):
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(all_benchmarks)
+
+
+@main.command("tick")
+@click.option("--temps", "temps_count", default=100, show_default=True)
+@click.option("--fans", "fans_count", default=30, show_default=True)
+@click.option("--repeat", default=1000, show_default=True)
+def tick(temps_count, fans_count, repeat):
+    """Time spent in `Metrics.tick`."""
+    tick_args = make_tick_args(temps_count, fans_count)
+    for exporter_type, metrics_cls in EXPORTERS.items():
+        metrics = metrics_cls("127.0.0.1:0")
+        metrics.tick(**tick_args)
+        start = default_timer()
+        for _ in range(repeat):
+            metrics.tick(**tick_args)
+        elapsed = default_timer() - start
+        click.echo(
+            "tick: %s: %s temps, %s fans: %.3fms per tick"
+            % (exporter_type, temps_count, fans_count, elapsed / repeat * 1000)
+        )
+
+
+@main.command("scrape")
+@click.option("--temps", "temps_count", default=100, show_default=True)
+@click.option("--fans", "fans_count", default=30, show_default=True)
+@click.option("--repeat", default=200, show_default=True)
+def scrape(temps_count, fans_count, repeat):
+    """Time spent rendering the exposition output."""
+    tick_args = make_tick_args(temps_count, fans_count)
+    for exporter_type, metrics_cls in EXPORTERS.items():
+        metrics = metrics_cls("127.0.0.1:0")
+        metrics.tick(**tick_args)
+        start = default_timer()
+        for _ in range(repeat):
+            metrics._render()
+        elapsed = default_timer() - start
+
+        # Served from the cache of the exposition output between the ticks:
+        cache = metrics._exposition_cache
+        cache.get(gzipped=True)
+        start = default_timer()
+        for _ in range(repeat):
+            cache.get(gzipped=True)
+        elapsed_cached = default_timer() - start
+        click.echo(
+            "scrape: %s: %s temps, %s fans: "
+            "%.3fms per render, %.3fms per cached scrape"
+            % (
+                exporter_type,
+                temps_count,
+                fans_count,
+                elapsed / repeat * 1000,
+                elapsed_cached / repeat * 1000,
+            )
+        )
+
+
+FOOTPRINT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import afancontrol.metrics
+metrics = getattr(afancontrol.metrics, sys.argv[1])("127.0.0.1:0")
+elapsed = time.perf_counter() - start
+with open("/proc/self/status") as f:
+    rss_kb = [line.split()[1] for line in f if line.startswith("VmRSS:")][0]
+print("%.3f %s" % (elapsed * 1000, rss_kb))
+"""
+
+
+@main.command("footprint")
+@click.option("--repeat", default=10, show_default=True)
+def footprint(repeat):
+    """Import+init time and RSS of a fresh process with the metrics."""
+    for exporter_type, metrics_cls in EXPORTERS.items():
+        timings = []
+        rss = []
+        for _ in range(repeat):
+            output = subprocess.check_output(
+                [sys.executable, "-c", FOOTPRINT_SCRIPT, metrics_cls.__name__]
+            )
+            elapsed_ms, rss_kb = output.split()
+            timings.append(float(elapsed_ms))
+            rss.append(int(rss_kb))
+        click.echo(
+            "footprint: %s: import+init median=%.1fms, RSS median=%.1fMiB"
+            % (
+                exporter_type,
+                statistics.median(timings),
+                statistics.median(rss) / 1024,
+            )
+        )
+
+
+LOAD_CLIENT_SCRIPT = """
+import socket, sys, time
+host, port = sys.argv[1], int(sys.argv[2])
+rate, duration, idle = map(float, sys.argv[3:])
+request = b"GET /metrics HTTP/1.1\\r\\nAccept-Encoding: gzip\\r\\n\\r\\n"
+idle_socks = []
+start = time.perf_counter()
+sent = 0
+while time.perf_counter() - start < duration:
+    # Port scanners and stuck scrapers: connect and never send a request.
+    if sent % 10 == 0 and len(idle_socks) < idle:
+        idle_socks.append(socket.create_connection((host, port)))
+    with socket.create_connection((host, port)) as sock:
+        sock.sendall(request)
+        while sock.recv(65536):
+            pass
+    sent += 1
+    time.sleep(max(0, start + sent / rate - time.perf_counter()))
+print(sent)
+"""
+
+
+@main.command("load")
+@click.option("--temps", "temps_count", default=100, show_default=True)
+@click.option("--fans", "fans_count", default=30, show_default=True)
+@click.option("--rate", default=100, show_default=True, help="Requests per second")
+@click.option("--idle", default=50, show_default=True, help="Idle connections")
+@click.option("--duration", default=10, show_default=True, help="Seconds")
+@click.option("--interval", default=0.1, show_default=True, help="Tick interval")
+def load(temps_count, fans_count, rate, idle, duration, interval):
+    """Thread count and tick latency while being scraped.
+
+    The scrapes are issued from a separate process, so the threads
+    counted are the exporter's ones only.
+    """
+    tick_args = make_tick_args(temps_count, fans_count)
+    for server in ("threads", "event_loop"):
+        metrics = BuiltinMetrics("127.0.0.1:0", server=server)
+        with metrics:
+            host, port = metrics._http_server.server_address[:2]
+            threads_before = threading.active_count()
+            client = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-c",
+                    LOAD_CLIENT_SCRIPT,
+                    host,
+                    str(port),
+                    str(rate),
+                    str(duration),
+                    str(idle),
+                ],
+                stdout=subprocess.PIPE,
+            )
+            ticks = []
+            max_threads = threads_before
+            while client.poll() is None:
+                start = default_timer()
+                with metrics.measure_tick():
+                    metrics.tick(**tick_args)
+                ticks.append(default_timer() - start)
+                max_threads = max(max_threads, threading.active_count())
+                time.sleep(interval)
+            requests_sent = int(client.communicate()[0])
+
+        ticks.sort()
+        click.echo(
+            "load: %s: %.0f req/s, %s idle conns: threads %s -> max %s, "
+            "tick median=%.3fms p95=%.3fms max=%.3fms"
+            % (
+                server,
+                requests_sent / duration,
+                idle,
+                threads_before,
+                max_threads,
+                statistics.median(ticks) * 1000,
+                ticks[int(len(ticks) * 0.95)] * 1000,
+                ticks[-1] * 1000,
+            )
+        )
+
+
+@main.command("all")
+@click.pass_context
+def all_benchmarks(ctx):
+    """Run all of the benchmarks with the default options."""
+    for command in (tick, scrape, footprint, load):
+        ctx.invoke(command)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,35 @@
+import binascii
 import json
-import queue
+import random
+import selectors
+import socket
 import struct
 import threading
 from timeit import default_timer
-from typing import Any, Dict, NewType, Optional
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    NewType,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 from afancontrol.logger import logger
 from afancontrol.pwmfan import BasePWMFan, FanValue, PWMFanNorm, PWMValue
 
 try:
     from serial import serial_for_url
-    from serial.threaded import LineReader, ReaderThread
+    from serial.threaded import Protocol
 
     pyserial_available = True
 except ImportError:
-    LineReader = object
-    ReaderThread = object
+    Protocol = object
 
     pyserial_available = False
 
@@ -25,6 +39,99 @@ ArduinoPin = NewType("ArduinoPin", int)
 DEFAULT_BAUDRATE = 115200
 DEFAULT_STATUS_TTL = 5
 
+# In the `stream` mode the board sends the status periodically
+# (4 times per second), in the `poll` mode the status is sent only
+# when it is requested by the host (once per tick).
+STATUS_MODE_STREAM = "stream"
+STATUS_MODE_POLL = "poll"
+STATUS_MODES = (STATUS_MODE_STREAM, STATUS_MODE_POLL)
+DEFAULT_STATUS_MODE = STATUS_MODE_STREAM
+
+# The latest version of the binary protocol supported by this module.
+# Version 0 means the legacy JSON-only protocol.
+#
+# Versions history:
+# 1 -- binary status frames;
+# 2 -- `SetPWMBatchCommand`;
+# 3 -- `SetStatusModeCommand` and `PollStatusCommand`;
+# 4 -- `AckCommand` and `AckFrame`;
+# 5 -- instantaneous RPM in the `StatusFrame`;
+# 6 -- `CapabilitiesFrame`.
+PROTOCOL_VERSION = 6
+
+# How long to wait for the `AckFrame` of a confirmed command.
+ACK_TIMEOUT = 0.5
+
+# The max number of pins in a `SetPWMBatchCommand` for the boards
+# which don't report their `CapabilitiesFrame` (the `micro.ino` limit).
+_DEFAULT_MAX_BATCH_LEN = 16
+
+# The instantaneous RPM reported by the firmware keeps falling after
+# the last tacho pulse (see `instantRpm` in `micro.ino`), so the slow fans
+# are still reported as spinning. For a jammed fan it falls to this value
+# 0.5s after the last pulse, which is when the fan is considered stopped.
+ARDUINO_STALL_RPM = 60
+
+# How long `check_pins` waits for the first frame after connecting.
+# The boards supporting the `CapabilitiesFrame` send it right away,
+# the older binary ones send a status frame within 0.25s. The JSON
+# lines don't count: they might have been sent before the board has
+# received the `SetProtocolCommand`.
+_HANDSHAKE_TIMEOUT = 0.5
+
+# The binary frames sent by the board have the following layout:
+#
+#   [sync: 2 bytes][version: u8][frame type: u8][payload length: u8]
+#   [payload: `payload length` bytes][crc: u16 LE]
+#
+# The CRC is CRC-16/XMODEM computed over everything between
+# the sync bytes and the CRC itself. The sync bytes are never seen
+# in the JSON lines (which are ASCII-only), so both kinds of messages
+# might be safely mixed in a single stream.
+FRAME_SYNC = b"\xa5\x5a"
+_FRAME_HEADER = struct.Struct("<2sBBB")
+_FRAME_CRC = struct.Struct("<H")
+_MAX_BUFFER_SIZE = 4096
+_READ_SIZE = 4096
+
+# A lost Serial connection is reopened right away. The failed attempts
+# are retried with an exponential backoff between these delays (in seconds).
+_RECONNECT_DELAY_MIN = 0.1
+_RECONNECT_DELAY_MAX = 10.0
+# The Serial connections without a file descriptor to wait on (like
+# the `loop://` and some of the `socket://` pyserial URLs) are polled
+# with this interval (in seconds) instead.
+_POLL_INTERVAL = 0.05
+
+FanInputs = Mapping[ArduinoPin, int]
+FanPWMs = Mapping[ArduinoPin, int]
+
+# Values indexed by the pin number, `None` for the pins missing
+# in the status.
+_PinValues = Tuple[Optional[int], ...]
+
+_StatusSnapshot = NamedTuple(
+    "_StatusSnapshot",
+    [
+        ("fan_inputs", _PinValues),
+        ("fan_inputs_instant", _PinValues),
+        ("fan_pwm", _PinValues),
+        ("clock", float),
+    ],
+)
+
+
+def arduino_connections_from_pwmfan_norms(
+    pwmfan_norms: Iterable[PWMFanNorm],
+) -> List["ArduinoConnection"]:
+    # Used in fans
+    connections = []  # type: List[ArduinoConnection]
+    for pwmfan_norm in pwmfan_norms:
+        connection = arduino_connection_from_pwmfan_norm(pwmfan_norm)
+        if connection is not None and connection not in connections:
+            connections.append(connection)
+    return connections
+
 
 def arduino_connection_from_pwmfan_norm(
     pwmfan_norm: PWMFanNorm,
@@ -36,6 +143,25 @@ def arduino_connection_from_pwmfan_norm(
     return None
 
 
+def reuse_arduino_connections(
+    pwmfan_norms: Iterable[PWMFanNorm], connections: Iterable["ArduinoConnection"]
+) -> None:
+    # Used in fans on a config reload: the boards which are already
+    # connected are not reconnected.
+    connections = list(connections)
+    for pwmfan_norm in pwmfan_norms:
+        pwmfan = pwmfan_norm.pwmfan
+        if isinstance(pwmfan, ArduinoPWMFan) and pwmfan._conn in connections:
+            pwmfan._conn = connections[connections.index(pwmfan._conn)]
+
+
+def _pin_indexed(values: Mapping[ArduinoPin, int]) -> _PinValues:
+    indexed = [None] * (max(values, default=-1) + 1)  # type: List[Optional[int]]
+    for pin, value in values.items():
+        indexed[pin] = value
+    return tuple(indexed)
+
+
 class ArduinoPWMFan(BasePWMFan):
     def __init__(
         self,
@@ -58,6 +184,13 @@ class ArduinoPWMFan(BasePWMFan):
     def get_speed(self) -> FanValue:
         return FanValue(self._conn.get_rpm(self._tacho_pin))
 
+    def get_speed_instant(self) -> FanValue:
+        return FanValue(self._conn.get_rpm_instant(self._tacho_pin))
+
+    @staticmethod
+    def is_speed_stalled(speed: FanValue) -> bool:
+        return speed <= ARDUINO_STALL_RPM
+
     def __enter__(self):  # reusable
         self._conn.__enter__()
         super().__enter__()
@@ -70,9 +203,14 @@ class ArduinoPWMFan(BasePWMFan):
             self._conn.__exit__(exc_type, exc_value, exc_tb)
 
     def _enable_pwm(self) -> None:
+        self._conn.check_pins(pwm_pin=self._pwm_pin, tacho_pin=self._tacho_pin)
         self.set_full_speed()
 
     def _disable_pwm(self) -> None:
+        if self._conn.supports_ack:
+            self._conn.set_pwm(self._pwm_pin, type(self).max_pwm, confirm=True)
+            return
+
         self.set_full_speed()
         self._conn.wait_for_status()
 
@@ -110,25 +248,39 @@ class ArduinoConnection:
         serial_url: str,
         *,
         baudrate: int = DEFAULT_BAUDRATE,
-        status_ttl: int = DEFAULT_STATUS_TTL
+        status_ttl: int = DEFAULT_STATUS_TTL,
+        status_mode: str = DEFAULT_STATUS_MODE
     ) -> None:
         if not pyserial_available:
             raise RuntimeError(
                 "`pyserial` is not installed. "
                 "Run `pip install 'afancontrol[arduino]'`."
             )
+        if status_mode not in STATUS_MODES:
+            raise ValueError(
+                "Unsupported status mode '%s'. Supported ones are: %s"
+                % (status_mode, ", ".join(STATUS_MODES))
+            )
         self.name = name
         self.url = serial_url
         self.baudrate = baudrate
         self.status_ttl = status_ttl
-        self._reader_thread = _AutoRetriedReaderThread(
+        self.status_mode = status_mode
+        self._channel = _SerialChannel(
             lambda: _StatusProtocol(self), url=serial_url, baudrate=baudrate
         )
         self._context_manager_depth = 0
-        self._status = None  # type: Optional[Dict[str, Dict[str, int]]]
-        self._status_clock = None  # type: Optional[float]
-        self._status_lock = threading.Lock()
+        self._snapshot = None  # type: Optional[_StatusSnapshot]
+        self.protocol_version = 0
+        self.capabilities = None  # type: Optional[CapabilitiesFrame]
+        self._handshake_event = threading.Event()
         self._status_event = threading.Event()
+        self._poll_pending = False
+        self._pending_pwms = None  # type: Optional[Dict[ArduinoPin, PWMValue]]
+        self.statuses_received = 0
+        self._ack_seq = 0
+        self._acks = {}  # type: Dict[int, int]
+        self._ack_condition = threading.Condition()
 
     def __eq__(self, other):
         if isinstance(other, type(self)):
@@ -137,6 +289,7 @@ class ArduinoConnection:
                 and self.url == other.url
                 and self.baudrate == other.baudrate
                 and self.status_ttl == other.status_ttl
+                and self.status_mode == other.status_mode
             )
 
         return NotImplemented
@@ -145,24 +298,25 @@ class ArduinoConnection:
         return not (self == other)
 
     def __repr__(self):
-        return "%s(%r, %r, baudrate=%r, status_ttl=%r)" % (
+        return "%s(%r, %r, baudrate=%r, status_ttl=%r, status_mode=%r)" % (
             type(self).__name__,
             self.name,
             self.url,
             self.baudrate,
             self.status_ttl,
+            self.status_mode,
         )
 
     def __enter__(self):  # reentrant
         if self._context_manager_depth == 0:
-            self._reader_thread.__enter__()
+            self._channel.__enter__()
         self._context_manager_depth += 1
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
         self._context_manager_depth -= 1
         if self._context_manager_depth == 0:
-            return self._reader_thread.__exit__(exc_type, exc_value, exc_tb)
+            return self._channel.__exit__(exc_type, exc_value, exc_tb)
         return None
 
     def _clock(self):
@@ -173,71 +327,312 @@ class ArduinoConnection:
         if "error" in message:
             logger.warning("Received an error from Arduino %s: %r", self.url, message)
         else:
-            self._update_status(message)
+            fan_inputs = {
+                ArduinoPin(int(pin)): int(rpm)
+                for pin, rpm in message["fan_inputs"].items()
+            }
+            fan_pwm = {
+                ArduinoPin(int(pin)): int(pwm)
+                for pin, pwm in message["fan_pwm"].items()
+            }
+            self._update_status(fan_inputs, fan_pwm)
+
+    def _incoming_frame(self, version: int, frame_type: int, payload: bytes) -> None:
+        # Called by the pyserial Protocol `_StatusProtocol`.
+        try:
+            self._handle_frame(version, frame_type, payload)
+        finally:
+            # The `CapabilitiesFrame` is sent before anything else, so
+            # once any frame is received, the `capabilities` are known.
+            self._handshake_event.set()
 
-    def _update_status(self, status: Dict[str, Dict[str, int]]) -> None:
-        with self._status_lock:
-            self._status = status
-            self._status_clock = self._clock()
+    def _handle_frame(self, version: int, frame_type: int, payload: bytes) -> None:
+        if frame_type == StatusFrame.frame_type:
+            frame = StatusFrame.parse_payload(payload, version=version)
+            self.protocol_version = version
+            self._update_status(
+                frame.fan_inputs, frame.fan_pwm, frame.fan_inputs_instant
+            )
+        elif frame_type == CapabilitiesFrame.frame_type:
+            self.capabilities = CapabilitiesFrame.parse_payload(payload)
+        elif frame_type == AckFrame.frame_type:
+            ack = AckFrame.parse_payload(payload)
+            with self._ack_condition:
+                self._acks[ack.seq] = ack.errors
+                self._ack_condition.notify_all()
+        else:
+            logger.warning(
+                "Received an unknown frame type %r from Arduino %s",
+                frame_type,
+                self.url,
+            )
+
+    def _connection_made(self, transport) -> None:
+        # Called by the pyserial Protocol `_StatusProtocol`.
+        #
+        # Ask the board to switch to the binary status frames. The boards
+        # flashed with an older firmware would respond with an error
+        # and keep sending JSON, which is still understood.
+        self.protocol_version = 0
+        # The status received before a reconnection is not relevant anymore.
+        self._snapshot = None
+        # The board replies with a `CapabilitiesFrame` if it supports that.
+        self.capabilities = None
+        self._handshake_event.clear()
+        command = SetProtocolCommand(version=PROTOCOL_VERSION).to_bytes()
+        if self.status_mode == STATUS_MODE_POLL:
+            # The board replies with a status, which also tells
+            # whether it supports the polling mode (see `_is_polling`).
+            # Older boards would just keep streaming the statuses.
+            command += SetStatusModeCommand(streaming=False).to_bytes()
+        transport.write(command)
+
+    def _update_status(
+        self,
+        fan_inputs: FanInputs,
+        fan_pwm: FanPWMs,
+        fan_inputs_instant: Optional[FanInputs] = None,
+    ) -> None:
+        # The snapshot is immutable and is replaced with a single reference
+        # assignment, so the readers don't need to synchronize with
+        # the I/O thread.
+        self._snapshot = _StatusSnapshot(
+            fan_inputs=_pin_indexed(fan_inputs),
+            fan_inputs_instant=_pin_indexed(fan_inputs_instant or {}),
+            fan_pwm=_pin_indexed(fan_pwm),
+            clock=self._clock(),
+        )
+        self.statuses_received += 1
         self._status_event.set()
 
+    @property
+    def supports_ack(self) -> bool:
+        return self.protocol_version >= 4
+
+    @property
+    def _is_polling(self) -> bool:
+        return self.status_mode == STATUS_MODE_POLL and self.protocol_version >= 3
+
     @property
     def is_connected(self) -> bool:
         try:
-            with self._status_lock:
-                self._ensure_status_is_valid()
+            self._valid_snapshot()
         except Exception:
             return False
         else:
             return True
 
     def get_rpm(self, pin: ArduinoPin) -> int:
-        if self._status is None:
-            self.wait_for_status()
-        with self._status_lock:
-            self._ensure_status_is_valid()
-            assert self._status is not None
-            return int(self._status["fan_inputs"][str(pin)])
+        self._wait_for_fresh_status()
+        return self._pin_value(self._valid_snapshot().fan_inputs, pin)
+
+    def get_rpm_instant(self, pin: ArduinoPin) -> int:
+        """The RPM measured from the last pulse intervals.
+
+        Unlike `get_rpm`, which is averaged over 1.5s, this reacts to
+        a jammed fan within a few hundred milliseconds. Falls back to
+        `get_rpm` when the firmware doesn't report it (protocol version < 5).
+        """
+        self._wait_for_fresh_status()
+        snapshot = self._valid_snapshot()
+        if not snapshot.fan_inputs_instant:
+            return self._pin_value(snapshot.fan_inputs, pin)
+        return self._pin_value(snapshot.fan_inputs_instant, pin)
 
     def get_pwm(self, pin: ArduinoPin) -> int:
-        if self._status is None:
+        self._wait_for_fresh_status()
+        return self._pin_value(self._valid_snapshot().fan_pwm, pin)
+
+    def _wait_for_fresh_status(self) -> None:
+        if self._snapshot is None:
             self.wait_for_status()
-        with self._status_lock:
-            self._ensure_status_is_valid()
-            assert self._status is not None
-            return int(self._status["fan_pwm"][str(pin)])
+        elif self._poll_pending:
+            self._poll_pending = False
+            # A stale status would be rejected by `_valid_snapshot`
+            # if the reply doesn't arrive in time.
+            self._status_event.wait(self.status_ttl)
 
-    def _ensure_status_is_valid(self):
-        if self._status is None:
+    def _valid_snapshot(self) -> "_StatusSnapshot":
+        self._ensure_is_open()
+        snapshot = self._snapshot
+        if snapshot is None:
             raise RuntimeError("No status from the Arduino board at %s" % self.url)
-        assert self._status_clock is not None
-        status_age = self._clock() - self._status_clock
+        status_age = self._clock() - snapshot.clock
         if status_age > self.status_ttl:
-            self._reader_thread.check_connection()
+            self._channel.check_connection()
             raise RuntimeError(
                 "The last received status from the Arduino board "
                 "at %s was too long ago: %s seconds" % (self.url, status_age)
             )
+        return snapshot
+
+    def _ensure_is_open(self) -> None:
+        # The fans are considered failing as soon as the connection is lost,
+        # without waiting for the status to expire.
+        if not self._channel.is_open:
+            self._channel.check_connection()
+            raise RuntimeError(
+                "Serial connection to the Arduino board at %s is lost" % self.url
+            )
+
+    def check_pins(self, *, pwm_pin: ArduinoPin, tacho_pin: ArduinoPin) -> None:
+        """Ensure that the board has the given pins.
+
+        The boards which don't report their `capabilities` (protocol
+        version < 6) are not checked.
+        """
+        if not self._handshake_event.wait(_HANDSHAKE_TIMEOUT):
+            # No frames: the board runs the JSON-only firmware (or isn't
+            # responding). Don't wait again for the rest of its fans.
+            self._handshake_event.set()
+        capabilities = self.capabilities
+        if capabilities is None:
+            logger.warning(
+                "Arduino board '%s' doesn't report its pins (protocol version %s), "
+                "the PWM pin %s and the tacho pin %s are not checked",
+                self.name,
+                self.protocol_version,
+                pwm_pin,
+                tacho_pin,
+            )
+            return
+        for pin, pins, kind in (
+            (pwm_pin, capabilities.pwm_pins, "PWM"),
+            (tacho_pin, capabilities.tacho_pins, "tacho"),
+        ):
+            if pin not in pins:
+                raise ValueError(
+                    "Arduino board '%s' doesn't have the %s pin %s. "
+                    "Available %s pins: %s"
+                    % (self.name, kind, pin, kind, ", ".join(map(str, pins)))
+                )
+
+    @property
+    def reconnects(self) -> int:
+        return self._channel.reconnects
+
+    @property
+    def failed_reconnects(self) -> int:
+        return self._channel.failed_reconnects
+
+    @property
+    def last_reconnect_duration_seconds(self) -> float:
+        return self._channel.last_reconnect_duration
+
+    def _pin_value(self, values: "_PinValues", pin: ArduinoPin) -> int:
+        value = values[pin] if pin < len(values) else None
+        if value is None:
+            raise RuntimeError(
+                "Pin %s is missing in the status from the Arduino board at %s"
+                % (pin, self.url)
+            )
+        return value
 
     @property
     def status_age_seconds(self) -> float:
-        with self._status_lock:
-            if self._status_clock is None:
-                return float("nan")
-            return self._clock() - self._status_clock
-
-    def set_pwm(self, pin: ArduinoPin, pwm: PWMValue) -> None:
-        command = SetPWMCommand(pwm_pin=pin, pwm=pwm).to_bytes()
-        transport = self._reader_thread.transport
+        snapshot = self._snapshot
+        if snapshot is None:
+            return float("nan")
+        return self._clock() - snapshot.clock
+
+    def set_pwm(self, pin: ArduinoPin, pwm: PWMValue, *, confirm: bool = False) -> None:
+        if self._pending_pwms is not None and not confirm:
+            self._pending_pwms[pin] = pwm
+            return
+        self.set_pwms({pin: pwm}, confirm=confirm)
+
+    def set_pwms(
+        self, pwms: Mapping[ArduinoPin, PWMValue], *, confirm: bool = False
+    ) -> None:
+        """Set the PWM values of the pins with a single write.
+
+        With `confirm` this blocks until the board acknowledges that
+        the values have been applied. The boards which don't support
+        the acks (see `supports_ack`) are not waited for.
+        """
+        if not pwms:
+            return
+        if self.protocol_version >= 2:
+            max_batch_len = (
+                self.capabilities.max_batch_len
+                if self.capabilities is not None
+                else _DEFAULT_MAX_BATCH_LEN
+            )
+            items = list(pwms.items())
+            command = b"".join(
+                SetPWMBatchCommand(pwms=dict(items[i : i + max_batch_len])).to_bytes()
+                for i in range(0, len(items), max_batch_len)
+            )
+        else:
+            # An older firmware doesn't support the batch command, but
+            # the separate commands still could be sent with a single write.
+            command = b"".join(
+                SetPWMCommand(pwm_pin=pin, pwm=pwm).to_bytes()
+                for pin, pwm in pwms.items()
+            )
+        if confirm and self.supports_ack:
+            seq = self._next_ack_seq()
+            self._write(command + AckCommand(seq=seq).to_bytes())
+            self._wait_for_ack(seq)
+        else:
+            self._write(command)
+
+    def _next_ack_seq(self) -> int:
+        with self._ack_condition:
+            self._ack_seq = (self._ack_seq + 1) % 256
+            self._acks.pop(self._ack_seq, None)
+            return self._ack_seq
+
+    def _wait_for_ack(self, seq: int) -> None:
+        with self._ack_condition:
+            if not self._ack_condition.wait_for(lambda: seq in self._acks, ACK_TIMEOUT):
+                raise RuntimeError(
+                    "The Arduino board at %s hasn't acknowledged the command "
+                    "within %s seconds" % (self.url, ACK_TIMEOUT)
+                )
+            errors = self._acks.pop(seq)
+        if errors:
+            raise RuntimeError(
+                "The Arduino board at %s has rejected %s command(s)"
+                % (self.url, errors)
+            )
+
+    def _write(self, command: bytes) -> None:
         try:
-            transport.write(command)
-            transport.flush()
+            self._channel.write(command)
+            self._channel.flush()
         except Exception:
-            self._reader_thread.check_connection()
+            self._channel.check_connection()
             raise
 
+    def begin_batch(self) -> None:
+        """Defer the subsequent `set_pwm` calls until `commit_batch`."""
+        self._pending_pwms = {}
+
+    def commit_batch(self, *, confirm: bool = False) -> None:
+        """Send all PWM values deferred since `begin_batch` at once."""
+        pwms = self._pending_pwms
+        self._pending_pwms = None
+        if pwms:
+            self.set_pwms(pwms, confirm=confirm)
+
+    def poll_status(self) -> None:
+        """Request a fresh status from the board in the `poll` status mode.
+
+        This doesn't wait for the reply: it is awaited by the subsequent
+        `get_rpm`/`get_pwm` calls. In the `stream` mode this is a no-op.
+        """
+        if not self._is_polling:
+            return
+        self._status_event.clear()
+        self._poll_pending = True
+        self._write(PollStatusCommand().to_bytes())
+
     def wait_for_status(self) -> None:
+        self._ensure_is_open()
         self._status_event.clear()
+        if self._is_polling:
+            self._write(PollStatusCommand().to_bytes())
         if self._status_event.wait(self.status_ttl) is not True:
             raise RuntimeError(
                 "Timed out waiting for the status from Arduino board at %s" % self.url
@@ -267,14 +662,392 @@ class SetPWMCommand:
         return cls(pwm_pin=ArduinoPin(pwm_pin), pwm=PWMValue(pwm))
 
 
-class _StatusProtocol(LineReader):
+class SetPWMBatchCommand:
+    command = b"\xf3"
+
+    # [command][n] n * [pwm pin][pwm]
+    _header = struct.Struct("sB")
+    _pwm = struct.Struct("BB")
+
+    def __init__(self, *, pwms: Mapping[ArduinoPin, PWMValue]) -> None:
+        self.pwms = pwms
+
+    def __repr__(self):
+        return "%s(pwms=%r)" % (type(self).__name__, self.pwms)
+
+    def to_bytes(self):
+        return self._header.pack(self.command, len(self.pwms)) + b"".join(
+            self._pwm.pack(pwm_pin, pwm) for pwm_pin, pwm in self.pwms.items()
+        )
+
+    @classmethod
+    def parse(cls, b: bytes) -> "SetPWMBatchCommand":
+        command, count = cls._header.unpack_from(b)
+        if command != cls.command:
+            raise ValueError(
+                "Invalid command marker. Expected %r, got %r" % (cls.command, command)
+            )
+        if len(b) != cls._header.size + count * cls._pwm.size:
+            raise ValueError("Invalid command length for %s pins: %r" % (count, b))
+        pwms = {}
+        for offset in range(cls._header.size, len(b), cls._pwm.size):
+            pwm_pin, pwm = cls._pwm.unpack_from(b, offset)
+            pwms[ArduinoPin(pwm_pin)] = PWMValue(pwm)
+        return cls(pwms=pwms)
+
+
+class SetStatusModeCommand:
+    command = b"\xf4"
+
+    def __init__(self, *, streaming: bool) -> None:
+        self.streaming = streaming
+
+    def __repr__(self):
+        return "%s(streaming=%r)" % (type(self).__name__, self.streaming)
+
+    def to_bytes(self):
+        return struct.pack("s?", self.command, self.streaming)
+
+    @classmethod
+    def parse(cls, b: bytes) -> "SetStatusModeCommand":
+        command, streaming = struct.unpack("s?", b)
+        if command != cls.command:
+            raise ValueError(
+                "Invalid command marker. Expected %r, got %r" % (cls.command, command)
+            )
+        return cls(streaming=streaming)
+
+
+class PollStatusCommand:
+    command = b"\xf5"
+
+    def __repr__(self):
+        return "%s()" % (type(self).__name__,)
+
+    def to_bytes(self):
+        return self.command
+
+    @classmethod
+    def parse(cls, b: bytes) -> "PollStatusCommand":
+        if b != cls.command:
+            raise ValueError(
+                "Invalid command marker. Expected %r, got %r" % (cls.command, b)
+            )
+        return cls()
+
+
+class AckCommand:
+    command = b"\xf6"
+
+    def __init__(self, *, seq: int) -> None:
+        self.seq = seq
+
+    def __repr__(self):
+        return "%s(seq=%r)" % (type(self).__name__, self.seq)
+
+    def to_bytes(self):
+        return struct.pack("sB", self.command, self.seq)
+
+    @classmethod
+    def parse(cls, b: bytes) -> "AckCommand":
+        command, seq = struct.unpack("sB", b)
+        if command != cls.command:
+            raise ValueError(
+                "Invalid command marker. Expected %r, got %r" % (cls.command, command)
+            )
+        return cls(seq=seq)
+
+
+class SetProtocolCommand:
+    command = b"\xf2"
+
+    def __init__(self, *, version: int) -> None:
+        self.version = version
+
+    def __repr__(self):
+        return "%s(version=%r)" % (type(self).__name__, self.version)
+
+    def to_bytes(self):
+        return struct.pack("sB", self.command, self.version)
+
+    @classmethod
+    def parse(cls, b: bytes) -> "SetProtocolCommand":
+        command, version = struct.unpack("sB", b)
+        if command != cls.command:
+            raise ValueError(
+                "Invalid command marker. Expected %r, got %r" % (cls.command, command)
+            )
+        return cls(version=version)
+
+
+def pack_frame(
+    frame_type: int, payload: bytes, version: int = PROTOCOL_VERSION
+) -> bytes:
+    body = _FRAME_HEADER.pack(FRAME_SYNC, version, frame_type, len(payload)) + payload
+    crc = binascii.crc_hqx(body[len(FRAME_SYNC) :], 0)
+    return body + _FRAME_CRC.pack(crc)
+
+
+class StatusFrame:
+    frame_type = ord("S")
+
+    # Payload:
+    #   [n: u8] n * [tacho pin: u8][rpm: u16 LE]
+    #   [m: u8] m * [pwm pin: u8][pwm: u8]
+    # Since version 5:
+    #   [k: u8] k * [tacho pin: u8][instantaneous rpm: u16 LE]
+    _count = struct.Struct("<B")
+    _fan_input = struct.Struct("<BH")
+    _fan_pwm = struct.Struct("<BB")
+
+    def __init__(
+        self,
+        *,
+        fan_inputs: FanInputs,
+        fan_pwm: FanPWMs,
+        fan_inputs_instant: Optional[FanInputs] = None
+    ) -> None:
+        self.fan_inputs = fan_inputs
+        self.fan_pwm = fan_pwm
+        self.fan_inputs_instant = fan_inputs_instant or {}
+
+    def __repr__(self):
+        return "%s(fan_inputs=%r, fan_pwm=%r, fan_inputs_instant=%r)" % (
+            type(self).__name__,
+            self.fan_inputs,
+            self.fan_pwm,
+            self.fan_inputs_instant,
+        )
+
+    def to_bytes(self, version: int = PROTOCOL_VERSION) -> bytes:
+        parts = [self._pack_items(self._fan_input, self.fan_inputs)]
+        parts.append(self._pack_items(self._fan_pwm, self.fan_pwm))
+        if version >= 5:
+            parts.append(self._pack_items(self._fan_input, self.fan_inputs_instant))
+        return pack_frame(self.frame_type, b"".join(parts), version=version)
+
+    @classmethod
+    def parse_payload(
+        cls, payload: bytes, version: int = PROTOCOL_VERSION
+    ) -> "StatusFrame":
+        offset = 0
+        fan_inputs, offset = cls._unpack_items(cls._fan_input, payload, offset)
+        fan_pwm, offset = cls._unpack_items(cls._fan_pwm, payload, offset)
+        fan_inputs_instant = {}  # type: Dict[ArduinoPin, int]
+        if version >= 5:
+            fan_inputs_instant, offset = cls._unpack_items(
+                cls._fan_input, payload, offset
+            )
+
+        if offset != len(payload):
+            raise ValueError(
+                "Unexpected trailing data in the status frame: %r" % payload[offset:]
+            )
+        return cls(
+            fan_inputs=fan_inputs,
+            fan_pwm=fan_pwm,
+            fan_inputs_instant=fan_inputs_instant,
+        )
+
+    @classmethod
+    def _pack_items(cls, item: struct.Struct, values: Mapping[ArduinoPin, int]):
+        return cls._count.pack(len(values)) + b"".join(
+            item.pack(pin, value) for pin, value in values.items()
+        )
+
+    @classmethod
+    def _unpack_items(
+        cls, item: struct.Struct, payload: bytes, offset: int
+    ) -> Tuple[Dict[ArduinoPin, int], int]:
+        (count,) = cls._count.unpack_from(payload, offset)
+        offset += cls._count.size
+        values = {}
+        for _ in range(count):
+            pin, value = item.unpack_from(payload, offset)
+            offset += item.size
+            values[ArduinoPin(pin)] = value
+        return values, offset
+
+
+class AckFrame:
+    frame_type = ord("A")
+
+    # Payload: [seq: u8][errors: u8]
+    _payload = struct.Struct("<BB")
+
+    def __init__(self, *, seq: int, errors: int = 0) -> None:
+        self.seq = seq
+        self.errors = errors
+
+    def __repr__(self):
+        return "%s(seq=%r, errors=%r)" % (type(self).__name__, self.seq, self.errors)
+
+    def to_bytes(self, version: int = PROTOCOL_VERSION) -> bytes:
+        payload = self._payload.pack(self.seq, self.errors)
+        return pack_frame(self.frame_type, payload, version=version)
+
+    @classmethod
+    def parse_payload(cls, payload: bytes) -> "AckFrame":
+        seq, errors = cls._payload.unpack(payload)
+        return cls(seq=seq, errors=errors)
+
+
+class CapabilitiesFrame:
+    frame_type = ord("C")
+
+    # Payload:
+    #   [firmware version: u16 LE][max batch len: u8]
+    #   [n: u8] n * [pwm pin: u8]
+    #   [m: u8] m * [tacho pin: u8]
+    _header = struct.Struct("<HB")
+    _count = struct.Struct("<B")
+
+    def __init__(
+        self,
+        *,
+        firmware_version: int,
+        max_batch_len: int,
+        pwm_pins: Sequence[ArduinoPin],
+        tacho_pins: Sequence[ArduinoPin]
+    ) -> None:
+        self.firmware_version = firmware_version
+        self.max_batch_len = max_batch_len
+        self.pwm_pins = pwm_pins
+        self.tacho_pins = tacho_pins
+
+    def __repr__(self):
+        return (
+            "%s(firmware_version=%r, max_batch_len=%r, pwm_pins=%r, tacho_pins=%r)"
+            % (
+                type(self).__name__,
+                self.firmware_version,
+                self.max_batch_len,
+                self.pwm_pins,
+                self.tacho_pins,
+            )
+        )
+
+    def to_bytes(self, version: int = PROTOCOL_VERSION) -> bytes:
+        payload = b"".join(
+            [
+                self._header.pack(self.firmware_version, self.max_batch_len),
+                self._count.pack(len(self.pwm_pins)),
+                bytes(self.pwm_pins),
+                self._count.pack(len(self.tacho_pins)),
+                bytes(self.tacho_pins),
+            ]
+        )
+        return pack_frame(self.frame_type, payload, version=version)
+
+    @classmethod
+    def parse_payload(cls, payload: bytes) -> "CapabilitiesFrame":
+        firmware_version, max_batch_len = cls._header.unpack_from(payload)
+        offset = cls._header.size
+        pin_lists = []
+        for _ in range(2):
+            (count,) = cls._count.unpack_from(payload, offset)
+            offset += cls._count.size
+            pins = payload[offset : offset + count]
+            if len(pins) != count:
+                raise ValueError("Truncated capabilities frame: %r" % payload)
+            pin_lists.append([ArduinoPin(pin) for pin in pins])
+            offset += count
+        if offset != len(payload):
+            raise ValueError(
+                "Unexpected trailing data in the capabilities frame: %r"
+                % payload[offset:]
+            )
+        pwm_pins, tacho_pins = pin_lists
+        return cls(
+            firmware_version=firmware_version,
+            max_batch_len=max_batch_len,
+            pwm_pins=pwm_pins,
+            tacho_pins=tacho_pins,
+        )
+
+
+class _StatusProtocol(Protocol):
+    """Splits the incoming stream to the JSON lines and the binary frames."""
+
     TERMINATOR = b"\n"
 
     def __init__(self, arduino_connection: ArduinoConnection) -> None:
         super().__init__()
         self._arduino_connection = arduino_connection
+        self._buffer = bytearray()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._buffer.clear()
+        self._arduino_connection._connection_made(transport)
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+    def data_received(self, data: bytes) -> None:
+        buffer = self._buffer
+        buffer.extend(data)
+        while buffer:
+            if buffer[0] == FRAME_SYNC[0]:
+                if len(buffer) < _FRAME_HEADER.size:
+                    break
+                if buffer[1] != FRAME_SYNC[1]:
+                    del buffer[:1]
+                    continue
+                payload_length = buffer[_FRAME_HEADER.size - 1]
+                frame_length = _FRAME_HEADER.size + payload_length + _FRAME_CRC.size
+                if len(buffer) < frame_length:
+                    break
+                frame = bytes(buffer[:frame_length])
+                if not self._handle_frame(frame):
+                    # Perhaps the sync bytes were a part of a damaged frame,
+                    # so drop just them and try to find the next frame.
+                    del buffer[: len(FRAME_SYNC)]
+                    continue
+                del buffer[:frame_length]
+            else:
+                terminator_pos = buffer.find(self.TERMINATOR)
+                sync_pos = buffer.find(FRAME_SYNC[:1])
+                if sync_pos != -1 and (
+                    terminator_pos == -1 or sync_pos < terminator_pos
+                ):
+                    # Garbage before the frame start (e.g. a partial line
+                    # received right after the connection has been opened).
+                    del buffer[:sync_pos]
+                    continue
+                if terminator_pos == -1:
+                    break
+                line = bytes(buffer[:terminator_pos])
+                del buffer[: terminator_pos + len(self.TERMINATOR)]
+                self.handle_line(line.decode("ascii", errors="replace"))
+
+        if len(buffer) > _MAX_BUFFER_SIZE:
+            logger.error(
+                "Discarding %s bytes of unparseable data from Arduino", len(buffer)
+            )
+            buffer.clear()
+
+    def _handle_frame(self, frame: bytes) -> bool:
+        crc_pos = len(frame) - _FRAME_CRC.size
+        (crc,) = _FRAME_CRC.unpack_from(frame, crc_pos)
+        if binascii.crc_hqx(frame[len(FRAME_SYNC) : crc_pos], 0) != crc:
+            logger.warning("Received a frame with invalid CRC from Arduino: %r", frame)
+            return False
+        _, version, frame_type, _ = _FRAME_HEADER.unpack_from(frame)
+        try:
+            self._arduino_connection._incoming_frame(
+                version, frame_type, frame[_FRAME_HEADER.size : crc_pos]
+            )
+        except Exception:  # `data_received` should not raise exceptions
+            logger.error(
+                "Unable to parse the frame from Arduino: %r", frame, exc_info=True
+            )
+        return True
 
     def handle_line(self, line: str) -> None:
+        if not line.strip():
+            return
         try:
             message = json.loads(line)
             self._arduino_connection._incoming_message(message)
@@ -286,86 +1059,313 @@ class _StatusProtocol(LineReader):
             )
 
 
-class _AutoRetriedReaderThread:
-    _QUEUE_STOP = object()
-    _QUEUE_CHECK = object()
+class _SerialChannel:
+    """A Serial connection to a single board.
+
+    The incoming data is read by the shared `_SerialIOLoop` thread, which
+    passes it to the protocol. The writes are done in the caller's thread.
+    """
 
     def __init__(self, protocol_factory, **serial_for_url_kwargs) -> None:
         self.protocol_factory = protocol_factory
         self.serial_for_url_kwargs = serial_for_url_kwargs
-        self._reader_thread = None  # type: Optional[ReaderThread]
-        self._transport = None  # type: Optional[ReaderThread]
-        self._watchdog_thread = None  # type: Optional[threading.Thread]
-        self._watchdog_queue = queue.Queue()  # type: queue.Queue[Any]
+        self._serial = None  # type: Optional[Any]
+        self._protocol = None  # type: Optional[Any]
+        self._lock = threading.Lock()
+        self._removed_event = threading.Event()
+        # The reconnection state, managed by the `_SerialIOLoop` thread:
+        self._reconnect_at = None  # type: Optional[float]
+        self._reconnect_attempts = 0
+        self._disconnected_at = None  # type: Optional[float]
+        self.reconnects = 0
+        self.failed_reconnects = 0
+        self.last_reconnect_duration = float("nan")
 
     def __enter__(self):  # reusable
-        # TODO ?? maybe clean the _watchdog_queue?
-        self._reader_thread, self._transport = self._new_reader_thread()
-        self._watchdog_thread = threading.Thread(target=self._thread_run, daemon=True)
-        self._watchdog_thread.start()
+        self._reconnect_at = None
+        self._reconnect_attempts = 0
+        self._disconnected_at = None
+        self._open()
+        _io_loop.add(self)
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        assert self._reader_thread is not None
-        assert self._watchdog_thread is not None
-        self._watchdog_queue.put(self._QUEUE_STOP)
-        self._watchdog_thread.join()
-        self._reader_thread.close()
-        self._reader_thread = None
-        self._transport = None
+        # The channel is closed by the I/O loop thread.
+        _io_loop.remove(self)
 
     @property
-    def transport(self):
-        return self._transport
+    def url(self) -> str:
+        return self.serial_for_url_kwargs["url"]
+
+    @property
+    def is_open(self) -> bool:
+        return self._serial is not None
+
+    def fileno(self) -> int:
+        # Used by the selector of the `_SerialIOLoop`.
+        assert self._serial is not None
+        return self._serial.fileno()
+
+    def write(self, data: bytes) -> None:
+        with self._lock:
+            if self._serial is None:
+                raise RuntimeError("Serial connection to %s is closed" % self.url)
+            self._serial.write(data)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._serial is None:
+                raise RuntimeError("Serial connection to %s is closed" % self.url)
+            self._serial.flush()
 
-    def check_connection(self):
-        self._watchdog_queue.put(self._QUEUE_CHECK)
+    def check_connection(self) -> None:
+        """Reconnect the channel if it has been closed due to an error."""
+        if self._serial is None and self._reconnect_at is None:
+            self._schedule_reconnect()
+            _io_loop.wakeup()
 
-    def _new_reader_thread(self):
+    def _schedule_reconnect(self) -> None:
+        now = default_timer()
+        if self._disconnected_at is None:
+            self._disconnected_at = now
+        if self._reconnect_attempts == 0:
+            self._reconnect_at = now
+        else:
+            # Exponential backoff with jitter, so the boards which have
+            # been lost at once wouldn't be retried in lockstep.
+            delay = min(
+                _RECONNECT_DELAY_MAX,
+                _RECONNECT_DELAY_MIN * 2 ** (self._reconnect_attempts - 1),
+            )
+            self._reconnect_at = now + random.uniform(delay / 2, delay)
+
+    def _open(self) -> None:
         ser = serial_for_url(**self.serial_for_url_kwargs)
-        thread = _ReaderThreadWithFlush(ser, self.protocol_factory)
-        thread.start()
-        transport, _ = thread.connect()
-        return thread, transport
-
-    def _thread_run(self):
-        while True:
-            item = self._watchdog_queue.get()
+        # The reads must not block the I/O loop, which serves other boards too.
+        ser.timeout = 0
+        with self._lock:
+            self._serial = ser
+        self._protocol = self.protocol_factory()
+        try:
+            self._protocol.connection_made(self)
+        except Exception as e:
+            self._close(e)
+            raise
+
+    def _reconnect(self) -> None:
+        # Called by the `_SerialIOLoop` thread.
+        try:
+            self._open()
+        except Exception as e:
+            self.failed_reconnects += 1
+            self._reconnect_attempts += 1
+            self._schedule_reconnect()
+            assert self._reconnect_at is not None
+            logger.warning(
+                "Unable to reconnect to the Arduino board at %s, "
+                "retrying in %.1f seconds: %s",
+                self.url,
+                self._reconnect_at - default_timer(),
+                e,
+            )
+        else:
+            self.reconnects += 1
+            if self._disconnected_at is not None:
+                self.last_reconnect_duration = default_timer() - self._disconnected_at
+            logger.info(
+                "Reconnected to the Arduino board at %s in %.3f seconds",
+                self.url,
+                self.last_reconnect_duration,
+            )
+            self._reconnect_at = None
+            self._reconnect_attempts = 0
+            self._disconnected_at = None
+
+    def _read(self) -> None:
+        # Called by the `_SerialIOLoop` thread.
+        assert self._serial is not None
+        assert self._protocol is not None
+        data = self._serial.read(_READ_SIZE)
+        if data:
+            self._protocol.data_received(data)
+
+    def _close(self, exc: Optional[Exception]) -> None:
+        # Called by the `_SerialIOLoop` thread (or by `_open`).
+        with self._lock:
+            ser = self._serial
+            self._serial = None
+        if ser is not None:
             try:
-                if self._reader_thread is None:
-                    break
-                if item is self._QUEUE_STOP:
-                    break
-                elif item is self._QUEUE_CHECK:
-                    if self._reader_thread.alive:
-                        continue
-                    try:
-                        self._reader_thread.close()
-                    except Exception:
-                        logger.error(
-                            "Unable to cleanly close the Serial connection",
-                            exc_info=True,
-                        )
-                    self._reader_thread, self._transport = self._new_reader_thread()
-            except Exception:  # `_thread_run` should not raise
+                ser.close()
+            except Exception:
                 logger.error(
-                    "Error in the Arduino connection watchdog thread", exc_info=True
+                    "Unable to cleanly close the Serial connection", exc_info=True
                 )
-            finally:
-                self._watchdog_queue.task_done()
+        protocol = self._protocol
+        self._protocol = None
+        if protocol is not None:
+            protocol.connection_lost(exc)
+
 
+class _SerialIOLoop:
+    """A single thread which reads the Serial connections of all boards.
 
-class _ReaderThreadWithFlush(ReaderThread):
-    def flush(self):
+    The thread is started when the first channel is added and exits
+    when the last one is removed, so the amount of threads doesn't depend
+    on the number of the connected boards.
+
+    The channels which cannot be watched by the selector are polled
+    every `_POLL_INTERVAL` seconds instead.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._channels = []  # type: List[_SerialChannel]
+        self._pending_removals = []  # type: List[_SerialChannel]
+        self._thread = None  # type: Optional[threading.Thread]
+        self._wakeup_w = None  # type: Optional[socket.socket]
+
+    @property
+    def thread(self) -> Optional[threading.Thread]:
+        return self._thread
+
+    def add(self, channel: _SerialChannel) -> None:
+        channel._removed_event.clear()
         with self._lock:
-            self.serial.flush()
+            self._channels.append(channel)
+            if self._thread is None:
+                wakeup_r, self._wakeup_w = socket.socketpair()
+                wakeup_r.setblocking(False)
+                self._wakeup_w.setblocking(False)
+                self._thread = threading.Thread(
+                    target=self._thread_run,
+                    args=(wakeup_r,),
+                    name="afancontrol-arduino-io",
+                    daemon=True,
+                )
+                self._thread.start()
+        self.wakeup()
+
+    def remove(self, channel: _SerialChannel) -> None:
+        """Remove and close the channel. Blocks until that is done."""
+        with self._lock:
+            self._pending_removals.append(channel)
+        self.wakeup()
+        channel._removed_event.wait()
 
-    def close(self):
+    def wakeup(self) -> None:
+        with self._lock:
+            if self._wakeup_w is None:
+                return
+            try:
+                self._wakeup_w.send(b"\0")
+            except BlockingIOError:
+                pass  # The loop is going to wake up anyway
+
+    def _thread_run(self, wakeup_r: socket.socket) -> None:
+        selector = selectors.DefaultSelector()
+        selector.register(wakeup_r, selectors.EVENT_READ)
+        registered = set()  # type: Set[_SerialChannel]
+        polled = set()  # type: Set[_SerialChannel]
         try:
-            super().close()
-        except Exception:
-            # `super().close()` also calls `self.stop()` which might raise
-            # and prevent `self.serial.close()` from being called.
+            while self._iteration(selector, registered, polled):
+                pass
+        finally:
+            selector.close()
+            wakeup_r.close()
+
+    def _iteration(self, selector, registered, polled) -> bool:
+        with self._lock:
+            removals = self._pending_removals[:]
+            del self._pending_removals[:]
+
+        for channel in removals:
+            self._unregister(selector, registered, polled, channel)
+            channel._close(None)
             with self._lock:
-                self.serial.close()
-            raise
+                self._channels.remove(channel)
+            channel._removed_event.set()
+
+        with self._lock:
+            if not self._channels and not self._pending_removals:
+                # Exit the thread. The next `add` would start a new one.
+                assert self._wakeup_w is not None
+                self._wakeup_w.close()
+                self._wakeup_w = None
+                self._thread = None
+                return False
+            channels = self._channels[:]
+
+        timeout = self._reconnect(channels)
+        for channel in channels:
+            if channel.is_open and channel not in registered | polled:
+                self._register(selector, registered, polled, channel)
+        if polled:
+            timeout = (
+                _POLL_INTERVAL if timeout is None else min(timeout, _POLL_INTERVAL)
+            )
+
+        readable = []  # type: List[_SerialChannel]
+        for key, _ in selector.select(timeout):
+            if key.data is None:
+                try:
+                    key.fileobj.recv(1024)  # drain the wakeup socket
+                except BlockingIOError:
+                    pass
+                continue
+            readable.append(key.data)
+        readable.extend(channel for channel in polled if channel.is_open)
+
+        for channel in readable:
+            try:
+                channel._read()
+            except Exception as e:
+                logger.warning(
+                    "Serial connection to the Arduino board at %s is lost: %s",
+                    channel.url,
+                    e,
+                )
+                self._unregister(selector, registered, polled, channel)
+                channel._close(e)
+                channel._schedule_reconnect()
+        return True
+
+    def _reconnect(self, channels: List[_SerialChannel]) -> Optional[float]:
+        # Returns the time until the next scheduled reconnection attempt.
+        timeout = None  # type: Optional[float]
+        now = default_timer()
+        for channel in channels:
+            if channel.is_open or channel._reconnect_at is None:
+                continue
+            if channel._reconnect_at <= now:
+                channel._reconnect()
+            if channel._reconnect_at is not None:
+                delay = max(0.0, channel._reconnect_at - now)
+                timeout = delay if timeout is None else min(timeout, delay)
+        return timeout
+
+    def _register(self, selector, registered, polled, channel: _SerialChannel) -> None:
+        try:
+            selector.register(channel, selectors.EVENT_READ, channel)
+        except Exception as e:
+            # E.g. `io.UnsupportedOperation` from `fileno()`, or
+            # a ValueError "Invalid file object" from the selector.
+            logger.info(
+                "Polling the Serial connection to %s, it cannot be watched: %r",
+                channel.url,
+                e,
+            )
+            polled.add(channel)
+        else:
+            registered.add(channel)
+
+    def _unregister(
+        self, selector, registered, polled, channel: _SerialChannel
+    ) -> None:
+        polled.discard(channel)
+        if channel in registered:
+            registered.discard(channel)
+            selector.unregister(channel)
+
+
+_io_loop = _SerialIOLoop()
@@ -0,0 +1,500 @@
+"""An emulator of the `micro.ino` Arduino program.
+
+The emulated board listens on a local TCP port, which pyserial can open
+with a `socket://` URL, so `ArduinoConnection` might be tested and
+benchmarked without a board attached.
+"""
+
+import json
+import random
+import selectors
+import socket
+import threading
+from collections import deque
+from timeit import default_timer
+from typing import Deque, Dict, Mapping, Optional, Sequence, Tuple
+
+from afancontrol.arduino import (
+    PROTOCOL_VERSION,
+    AckCommand,
+    AckFrame,
+    ArduinoPin,
+    CapabilitiesFrame,
+    PollStatusCommand,
+    SetProtocolCommand,
+    SetPWMBatchCommand,
+    SetPWMCommand,
+    SetStatusModeCommand,
+    StatusFrame,
+)
+from afancontrol.logger import logger
+
+# The pins of Arduino Micro used by the `micro.ino` program.
+TACHO_PINS = (0, 1, 2, 3, 7)
+PWM_PINS = (5, 9, 10, 11)
+MAX_BATCH_LEN = 16
+FIRMWARE_VERSION = 1
+
+# The `MEASUREMENT_TIME_MS` of the `micro.ino` program.
+DEFAULT_STATUS_INTERVAL = 0.25
+
+# The `INSTANT_RPM_TIMEOUT_US` of the `micro.ino` program (in seconds).
+_INSTANT_RPM_TIMEOUT = 1.5
+
+_READ_SIZE = 4096
+
+
+class ArduinoEmulator:
+    """Emulate an Arduino board running the `micro.ino` program.
+
+    A single host connection is served at a time. When the host
+    disconnects, the emulator waits for the next one, just like a board
+    which stays powered between the Serial sessions.
+
+    The link imperfections might be emulated with:
+
+    - `status_interval` -- the period between the streamed statuses;
+    - `latency` -- a delay applied to the data in both directions;
+    - `drop_rate` -- a probability of a status not being sent;
+    - `corrupt_rate` -- a probability of a single byte of a status
+      being damaged;
+    - `protocol_version` -- the latest protocol version supported by
+      the emulated firmware, 0 emulates the JSON-only firmware.
+
+    A different board might be emulated with the `pwm_pins`, `tacho_pins`
+    and `max_batch_len` arguments.
+    """
+
+    def __init__(
+        self,
+        *,
+        status_interval: float = DEFAULT_STATUS_INTERVAL,
+        latency: float = 0.0,
+        drop_rate: float = 0.0,
+        corrupt_rate: float = 0.0,
+        protocol_version: int = PROTOCOL_VERSION,
+        pwm_pins: Sequence[int] = PWM_PINS,
+        tacho_pins: Sequence[int] = TACHO_PINS,
+        max_batch_len: int = MAX_BATCH_LEN,
+        seed: Optional[int] = None,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ) -> None:
+        self.status_interval = status_interval
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.max_protocol_version = protocol_version
+        self.pwm_pins = tuple(pwm_pins)
+        self.tacho_pins = tuple(tacho_pins)
+        self.max_batch_len = max_batch_len
+        self._random = random.Random(seed)
+        self._listen_address = (host, port)
+        self._lock = threading.Lock()
+        self._fan_inputs = {pin: 0 for pin in tacho_pins}  # type: Dict[int, int]
+        # The instantaneous RPM equals to the smoothed one unless overridden.
+        self._fan_inputs_instant = {}  # type: Dict[int, int]
+        # The time of the last tacho pulse of the jammed fans.
+        self._fan_inputs_stalled_at = {}  # type: Dict[int, float]
+        self._fan_pwm = {pin: 255 for pin in pwm_pins}  # type: Dict[int, int]
+        self._server = None  # type: Optional[socket.socket]
+        self._client = None  # type: Optional[socket.socket]
+        self._thread = None  # type: Optional[threading.Thread]
+        self._wakeup_r = None  # type: Optional[socket.socket]
+        self._wakeup_w = None  # type: Optional[socket.socket]
+        self._stopping = False
+        self._disconnect_requested = False
+        self._connected = threading.Condition(self._lock)
+        self.connections_accepted = 0
+        self.commands_received = 0
+        self.statuses_sent = 0
+        self.statuses_dropped = 0
+        self.statuses_corrupted = 0
+
+    def __repr__(self):
+        return (
+            "%s(status_interval=%r, latency=%r, drop_rate=%r, "
+            "corrupt_rate=%r, protocol_version=%r)"
+            % (
+                type(self).__name__,
+                self.status_interval,
+                self.latency,
+                self.drop_rate,
+                self.corrupt_rate,
+                self.max_protocol_version,
+            )
+        )
+
+    @property
+    def url(self) -> str:
+        if self._server is None:
+            raise RuntimeError("The emulator is not started")
+        host, port = self._server.getsockname()[:2]
+        return "socket://%s:%s" % (host, port)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.stop()
+        return None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            raise RuntimeError("The emulator is already started")
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(self._listen_address)
+        server.listen(1)
+        server.setblocking(False)
+        self._server = server
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._thread_run, name="afancontrol-arduino-emulator", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        with self._lock:
+            self._stopping = True
+        self._wakeup()
+        self._thread.join()
+        self._thread = None
+        for sock in (self._server, self._wakeup_r, self._wakeup_w):
+            if sock is not None:
+                sock.close()
+        self._server = self._wakeup_r = self._wakeup_w = None
+
+    def disconnect(self) -> None:
+        """Drop the current host connection, like a board being unplugged."""
+        with self._lock:
+            self._disconnect_requested = True
+        self._wakeup()
+
+    @property
+    def is_connected(self) -> bool:
+        with self._lock:
+            return self._client is not None
+
+    def wait_for_connection(self, timeout: Optional[float] = None) -> bool:
+        with self._connected:
+            return self._connected.wait_for(lambda: self._client is not None, timeout)
+
+    @property
+    def fan_inputs(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._fan_inputs)
+
+    @property
+    def fan_pwm(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._fan_pwm)
+
+    def set_fan_inputs(self, fan_inputs: Mapping[int, int]) -> None:
+        with self._lock:
+            for pin, rpm in fan_inputs.items():
+                if pin not in self._fan_inputs:
+                    raise ValueError("Unknown tacho pin %s" % pin)
+                self._fan_inputs[pin] = rpm
+                self._fan_inputs_stalled_at.pop(pin, None)
+
+    def set_fan_inputs_instant(self, fan_inputs: Mapping[int, int]) -> None:
+        with self._lock:
+            for pin, rpm in fan_inputs.items():
+                if pin not in self._fan_inputs:
+                    raise ValueError("Unknown tacho pin %s" % pin)
+                self._fan_inputs_instant[pin] = rpm
+                self._fan_inputs_stalled_at.pop(pin, None)
+
+    def stall_fan_inputs(self, pins: Sequence[int]) -> None:
+        """Stop the tacho pulses of the fans, like a jammed fan would.
+
+        The smoothed RPM is left intact, while the instantaneous one
+        falls just like it does in the `micro.ino` program.
+        """
+        now = default_timer()
+        with self._lock:
+            for pin in pins:
+                if pin not in self._fan_inputs:
+                    raise ValueError("Unknown tacho pin %s" % pin)
+                self._fan_inputs_stalled_at[pin] = now
+
+    def _stalled_rpm(self, pin: int, now: float) -> int:
+        # Mirrors `instantRpm` of the `micro.ino` program.
+        rpm = self._fan_inputs_instant.get(pin, self._fan_inputs[pin])
+        since_last_pulse = now - self._fan_inputs_stalled_at[pin]
+        if rpm <= 0 or since_last_pulse > _INSTANT_RPM_TIMEOUT:
+            return 0
+        # 2 pulses per revolution.
+        pulse_interval = max(60 / 2 / rpm, since_last_pulse)
+        return int(60 / 2 / pulse_interval)
+
+    def _wakeup(self) -> None:
+        if self._wakeup_w is not None:
+            try:
+                self._wakeup_w.send(b"\0")
+            except OSError:
+                pass
+
+    def _thread_run(self) -> None:
+        try:
+            while not self._stopping:
+                client = self._accept()
+                if client is None:
+                    continue
+                try:
+                    _EmulatedSession(self, client).run()
+                except OSError:
+                    pass  # The host has closed the connection
+                finally:
+                    with self._lock:
+                        self._client = None
+                        self._disconnect_requested = False
+                    client.close()
+        except Exception:
+            logger.error("Arduino emulator has crashed", exc_info=True)
+
+    def _accept(self) -> Optional[socket.socket]:
+        assert self._server is not None
+        assert self._wakeup_r is not None
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._server, selectors.EVENT_READ)
+            selector.register(self._wakeup_r, selectors.EVENT_READ)
+            selector.select()
+        self._drain_wakeups()
+        try:
+            client, _ = self._server.accept()
+        except BlockingIOError:
+            return None
+        client.setblocking(False)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._connected:
+            self._client = client
+            self._disconnect_requested = False
+            self.connections_accepted += 1
+            self._connected.notify_all()
+        return client
+
+    def _drain_wakeups(self) -> None:
+        assert self._wakeup_r is not None
+        try:
+            while self._wakeup_r.recv(_READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class _EmulatedSession:
+    """A single host connection: mimics the `loop` function of `micro.ino`."""
+
+    def __init__(self, emulator: ArduinoEmulator, client: socket.socket) -> None:
+        self._emulator = emulator
+        self._client = client
+        # The firmware state is reset on each connection, because
+        # opening the Serial port resets the board.
+        self._protocol_version = 0
+        self._status_streaming = True
+        self._status_requested = False
+        self._command_errors = 0
+        self._command_buffer = bytearray()
+        # (deadline, data) pairs delayed by the emulated latency.
+        self._incoming = deque()  # type: Deque[Tuple[float, bytes]]
+        self._outgoing = deque()  # type: Deque[Tuple[float, bytes]]
+        self._next_status = default_timer() + emulator.status_interval
+
+    def run(self) -> None:
+        emulator = self._emulator
+        assert emulator._wakeup_r is not None
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._client, selectors.EVENT_READ)
+            selector.register(emulator._wakeup_r, selectors.EVENT_READ)
+            while True:
+                with emulator._lock:
+                    if emulator._stopping or emulator._disconnect_requested:
+                        return
+                selector.select(self._timeout())
+                emulator._drain_wakeups()
+                self._receive()
+                self._process_incoming()
+                self._process_status()
+                self._send_outgoing()
+
+    def _timeout(self) -> float:
+        deadlines = [self._next_status]
+        if self._incoming:
+            deadlines.append(self._incoming[0][0])
+        if self._outgoing:
+            deadlines.append(self._outgoing[0][0])
+        return max(0.0, min(deadlines) - default_timer())
+
+    def _receive(self) -> None:
+        try:
+            data = self._client.recv(_READ_SIZE)
+        except BlockingIOError:
+            return
+        if not data:
+            raise ConnectionResetError("The host has closed the connection")
+        self._incoming.append((default_timer() + self._emulator.latency, data))
+
+    def _process_incoming(self) -> None:
+        now = default_timer()
+        while self._incoming and self._incoming[0][0] <= now:
+            _, data = self._incoming.popleft()
+            self._command_buffer.extend(data)
+        while True:
+            command_raw = self._pop_command()
+            if command_raw is None:
+                break
+            self._emulator.commands_received += 1
+            self._process_command(command_raw)
+
+    def _pop_command(self) -> Optional[bytes]:
+        buffer = self._command_buffer
+        while buffer:
+            marker = bytes(buffer[:1])
+            if marker == SetPWMCommand.command:
+                command_len = 3
+            elif marker in (
+                SetProtocolCommand.command,
+                SetStatusModeCommand.command,
+                AckCommand.command,
+            ):
+                command_len = 2
+            elif marker == PollStatusCommand.command:
+                command_len = 1
+            elif marker == SetPWMBatchCommand.command:
+                if len(buffer) < 2:
+                    return None
+                if buffer[1] > self._emulator.max_batch_len:
+                    self._send_error(
+                        "Too many pins in the batch command: %s" % buffer[1]
+                    )
+                    del buffer[:2]
+                    continue
+                command_len = 2 + 2 * buffer[1]
+            else:
+                self._send_error("Unknown command %X" % buffer[0])
+                del buffer[:1]
+                continue
+            if len(buffer) < command_len:
+                return None
+            command_raw = bytes(buffer[:command_len])
+            del buffer[:command_len]
+            return command_raw
+        return None
+
+    def _process_command(self, command_raw: bytes) -> None:
+        marker = command_raw[:1]
+        if marker == SetProtocolCommand.command:
+            if self._emulator.max_protocol_version == 0:
+                # The JSON-only firmware doesn't know this command.
+                self._send_error("Unknown command %X" % command_raw[0])
+                return
+            version = SetProtocolCommand.parse(command_raw).version
+            self._protocol_version = min(version, self._emulator.max_protocol_version)
+            if self._protocol_version >= 6:
+                self._send_capabilities()
+        elif marker == SetStatusModeCommand.command and self._supports(3):
+            self._status_streaming = SetStatusModeCommand.parse(command_raw).streaming
+            self._status_requested = True
+        elif marker == PollStatusCommand.command and self._supports(3):
+            self._status_requested = True
+        elif marker == AckCommand.command and self._supports(4):
+            seq = AckCommand.parse(command_raw).seq
+            ack = AckFrame(seq=seq, errors=self._command_errors)
+            self._command_errors = 0
+            self._send(ack.to_bytes(version=self._protocol_version))
+        elif marker == SetPWMBatchCommand.command and self._supports(2):
+            for pin, pwm in SetPWMBatchCommand.parse(command_raw).pwms.items():
+                self._set_pwm(pin, pwm)
+        elif marker == SetPWMCommand.command:
+            pwm_command = SetPWMCommand.parse(command_raw)
+            self._set_pwm(pwm_command.pwm_pin, pwm_command.pwm)
+        else:
+            self._send_error("Unknown command %X" % command_raw[0])
+
+    def _send_capabilities(self) -> None:
+        emulator = self._emulator
+        capabilities = CapabilitiesFrame(
+            firmware_version=FIRMWARE_VERSION,
+            max_batch_len=emulator.max_batch_len,
+            pwm_pins=[ArduinoPin(pin) for pin in emulator.pwm_pins],
+            tacho_pins=[ArduinoPin(pin) for pin in emulator.tacho_pins],
+        )
+        self._send(capabilities.to_bytes(version=self._protocol_version))
+
+    def _supports(self, version: int) -> bool:
+        return self._emulator.max_protocol_version >= version
+
+    def _set_pwm(self, pin: int, pwm: int) -> None:
+        with self._emulator._lock:
+            if pin in self._emulator._fan_pwm:
+                self._emulator._fan_pwm[pin] = pwm
+                return
+        self._send_error("Unknown pin %s for the set speed command" % pin)
+
+    def _process_status(self) -> None:
+        now = default_timer()
+        if now < self._next_status:
+            return
+        self._next_status = now + self._emulator.status_interval
+        if not (self._status_streaming or self._status_requested):
+            return
+        self._status_requested = False
+
+        emulator = self._emulator
+        if emulator._random.random() < emulator.drop_rate:
+            emulator.statuses_dropped += 1
+            return
+        status = bytearray(self._make_status())
+        if emulator._random.random() < emulator.corrupt_rate:
+            emulator.statuses_corrupted += 1
+            position = emulator._random.randrange(len(status))
+            status[position] ^= 1 << emulator._random.randrange(8)
+        emulator.statuses_sent += 1
+        self._send(bytes(status))
+
+    def _make_status(self) -> bytes:
+        with self._emulator._lock:
+            fan_inputs = dict(self._emulator._fan_inputs)
+            fan_inputs_instant = dict(fan_inputs)
+            fan_inputs_instant.update(self._emulator._fan_inputs_instant)
+            now = default_timer()
+            for pin in self._emulator._fan_inputs_stalled_at:
+                fan_inputs_instant[pin] = self._emulator._stalled_rpm(pin, now)
+            fan_pwm = dict(self._emulator._fan_pwm)
+        if self._protocol_version >= 1:
+            return StatusFrame(
+                fan_inputs={ArduinoPin(pin): rpm for pin, rpm in fan_inputs.items()},
+                fan_pwm={ArduinoPin(pin): pwm for pin, pwm in fan_pwm.items()},
+                fan_inputs_instant={
+                    ArduinoPin(pin): rpm for pin, rpm in fan_inputs_instant.items()
+                },
+            ).to_bytes(version=self._protocol_version)
+        status = {
+            "fan_inputs": {str(pin): rpm for pin, rpm in fan_inputs.items()},
+            "fan_pwm": {str(pin): pwm for pin, pwm in fan_pwm.items()},
+        }
+        return (json.dumps(status) + "\n").encode("ascii")
+
+    def _send_error(self, error: str) -> None:
+        self._command_errors += 1
+        self._send((json.dumps({"error": error}) + "\n").encode("ascii"))
+
+    def _send(self, data: bytes) -> None:
+        self._outgoing.append((default_timer() + self._emulator.latency, data))
+
+    def _send_outgoing(self) -> None:
+        now = default_timer()
+        while self._outgoing and self._outgoing[0][0] <= now:
+            _, data = self._outgoing.popleft()
+            self._client.setblocking(True)
+            try:
+                self._client.sendall(data)
+            finally:
+                self._client.setblocking(False)
@@ -0,0 +1,245 @@
+"""A helper process executing the shell commands on behalf of the daemon.
+
+Each `subprocess.run` forks the calling process. The daemon carries
+the whole interpreter, the metrics and the serial threads, so on
+the small boards forking it for every sensor read and trigger command
+is measurable. The helper is a fresh, small interpreter started once:
+the daemon sends it the commands over a pipe, and the helper forks
+itself instead and streams the results back.
+
+The protocol is a JSON object per line in both directions. The requests
+are executed concurrently, so the responses are matched by their `id`.
+The output bytes are transferred as latin-1 strings.
+"""
+
+import json
+import subprocess
+import sys
+import threading
+from typing import IO, Any, Dict, Optional
+
+from afancontrol.logger import logger
+
+# Extra time the daemon waits for a response after the command timeout.
+RESPONSE_GRACE_PERIOD = 5
+
+_installed = None  # type: Optional[CommandHelper]
+
+
+def installed_command_helper() -> "Optional[CommandHelper]":
+    """The running `CommandHelper` which `exec_shell_command` should use."""
+    return _installed
+
+
+class _PendingCommand:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.response = None  # type: Optional[Dict[str, Any]]
+
+
+class CommandHelper:
+    """Starts the helper process and installs it as the executor
+    of `exec_shell_command` while entered.
+
+    When the helper dies (e.g. killed along with the service), the commands
+    are executed by the daemon itself.
+    """
+
+    def __init__(self) -> None:
+        self._process = None  # type: Optional[subprocess.Popen]
+        self._stdin = None  # type: Optional[IO[bytes]]
+        self._reader = None  # type: Optional[threading.Thread]
+        self._write_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = {}  # type: Dict[int, _PendingCommand]
+        self._next_id = 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def __enter__(self):
+        global _installed
+        assert self._process is None
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "afancontrol.command_helper"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            # Not interrupted by a Ctrl+C in the terminal of the daemon.
+            start_new_session=True,
+        )
+        assert self._process.stdin is not None
+        self._stdin = self._process.stdin
+        self._reader = threading.Thread(
+            target=self._read_responses,
+            args=(self._process.stdout,),
+            name="afancontrol-command-helper",
+            daemon=True,
+        )
+        self._reader.start()
+        _installed = self
+        logger.info("Started the command helper process (pid %s)", self._process.pid)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        global _installed
+        assert self._process is not None and self._reader is not None
+        _installed = None
+        # The helper exits on EOF after finishing the running commands.
+        assert self._stdin is not None
+        try:
+            self._stdin.close()
+        except OSError:
+            pass
+        try:
+            self._process.wait(RESPONSE_GRACE_PERIOD)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._reader.join()
+        self._process = None
+        self._stdin = None
+        self._reader = None
+        return None
+
+    def run(self, shell_command: str, timeout: float) -> subprocess.CompletedProcess:
+        """Same as `subprocess.run(shell_command, shell=True, timeout=timeout)`
+        with the captured output, but executed by the helper.
+        """
+        if not self.is_running:
+            return self._run_directly(shell_command, timeout)
+
+        pending = _PendingCommand()
+        with self._pending_lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = pending
+        try:
+            try:
+                self._send(
+                    {"id": request_id, "command": shell_command, "timeout": timeout}
+                )
+            except BrokenPipeError:
+                # The helper has just died.
+                return self._run_directly(shell_command, timeout)
+            if not pending.done.wait(timeout + RESPONSE_GRACE_PERIOD):
+                raise RuntimeError(
+                    "The command helper hasn't responded in time for: %s"
+                    % shell_command
+                )
+        finally:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+
+        response = pending.response
+        if response is None:
+            raise RuntimeError(
+                "The command helper process has exited while executing: %s"
+                % shell_command
+            )
+        if "error" in response:
+            raise RuntimeError(
+                "The command helper has failed to execute %s: %s"
+                % (shell_command, response["error"])
+            )
+        stdout = response["stdout"].encode("latin-1")
+        stderr = response["stderr"].encode("latin-1")
+        if response.get("timed_out"):
+            raise subprocess.TimeoutExpired(
+                shell_command, timeout, output=stdout, stderr=stderr
+            )
+        return subprocess.CompletedProcess(
+            shell_command, response["returncode"], stdout, stderr
+        )
+
+    def _run_directly(
+        self, shell_command: str, timeout: float
+    ) -> subprocess.CompletedProcess:
+        logger.warning(
+            "The command helper process is not running, "
+            "executing the command directly: %s",
+            shell_command,
+        )
+        return subprocess.run(
+            shell_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=True,
+            timeout=timeout,
+        )
+
+    def _send(self, request: Dict[str, Any]) -> None:
+        assert self._stdin is not None
+        line = json.dumps(request).encode() + b"\n"
+        with self._write_lock:
+            self._stdin.write(line)
+            self._stdin.flush()
+
+    def _read_responses(self, stdout: IO[bytes]) -> None:
+        for line in stdout:
+            try:
+                response = json.loads(line.decode())
+                request_id = response["id"]
+            except Exception:
+                logger.warning("Invalid command helper response: %r", line)
+                continue
+            with self._pending_lock:
+                pending = self._pending.get(request_id)
+            if pending is not None:
+                pending.response = response
+                pending.done.set()
+
+        # EOF: the helper has exited, so nothing is going to be responded.
+        with self._pending_lock:
+            for pending in self._pending.values():
+                pending.done.set()
+        stdout.close()
+
+
+def main() -> None:
+    """The loop of the helper process."""
+    write_lock = threading.Lock()
+    out = sys.stdout.buffer
+    threads = []
+    for line in sys.stdin.buffer:
+        request = json.loads(line.decode())
+        thread = threading.Thread(target=_serve, args=(request, out, write_lock))
+        thread.start()
+        threads.append(thread)
+        threads = [thread for thread in threads if thread.is_alive()]
+    for thread in threads:
+        thread.join()
+
+
+def _serve(request: Dict[str, Any], out: IO[bytes], write_lock: threading.Lock):
+    response = {"id": request["id"]}  # type: Dict[str, Any]
+    try:
+        p = subprocess.run(
+            request["command"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=True,
+            timeout=request["timeout"],
+        )
+    except subprocess.TimeoutExpired as e:
+        response.update(
+            timed_out=True,
+            stdout=(e.stdout or b"").decode("latin-1"),
+            stderr=(e.stderr or b"").decode("latin-1"),
+        )
+    except Exception as e:
+        response["error"] = str(e)
+    else:
+        response.update(
+            returncode=p.returncode,
+            stdout=p.stdout.decode("latin-1"),
+            stderr=p.stderr.decode("latin-1"),
+        )
+    line = json.dumps(response).encode() + b"\n"
+    with write_lock:
+        out.write(line)
+        out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,26 @@
 import configparser
+import glob
+import os
+from collections import defaultdict
+from fnmatch import fnmatchcase
 from pathlib import Path
 from typing import (
     Dict,
+    Iterator,
+    List,
     Mapping,
     NamedTuple,
     NewType,
     Optional,
     Sequence,
+    Set,
     Tuple,
     TypeVar,
 )
 
 from afancontrol.arduino import (
     DEFAULT_BAUDRATE,
+    DEFAULT_STATUS_MODE,
     DEFAULT_STATUS_TTL,
     ArduinoConnection,
     ArduinoName,
@@ -27,18 +35,55 @@ from afancontrol.pwmfan import (
     PWMFanNorm,
     PWMValue,
 )
-from afancontrol.temp import CommandTemp, FileTemp, HDDTemp, Temp, TempCelsius
+from afancontrol.temp import (
+    DEFAULT_SOURCE_FORMAT,
+    DEFAULT_SOURCE_POLL_INTERVAL,
+    SOURCE_FORMATS,
+    CommandSource,
+    CommandTemp,
+    FileTemp,
+    HDDTemp,
+    SourceName,
+    SourceTemp,
+    Temp,
+    TempCelsius,
+)
 
 DEFAULT_CONFIG = "/etc/afancontrol/afancontrol.conf"
 DEFAULT_PIDFILE = "/run/afancontrol.pid"
 DEFAULT_INTERVAL = 5
 DEFAULT_FANS_SPEED_CHECK_INTERVAL = 3
 DEFAULT_HDDTEMP = "hddtemp"
+DEFAULT_EXPORTER_TYPE = "prometheus_client"
+# The ones served over HTTP at `exporter_listen_host`:
+EXPORTER_TYPES_PULL = ("prometheus_client", "builtin")
+# The ones pushed over UDP to `exporter_push_host`:
+EXPORTER_TYPES_PUSH = ("statsd", "influx")
+EXPORTER_TYPES = EXPORTER_TYPES_PULL + EXPORTER_TYPES_PUSH
+DEFAULT_EXPORTER_SERVER = "threads"
+EXPORTER_SERVERS = ("threads", "event_loop")
+DEFAULT_HISTORY_DURATION = 0
+# The options turning a section into a template, which is expanded
+# to a section per each glob match or range number.
+TEMPLATE_OPTIONS = ("foreach_glob", "foreach_range")
 DEFAULT_REPORT_CMD = (
     'printf "Subject: %s\nTo: %s\n\n%b"'
     ' "afancontrol daemon report: %REASON%" root "%MESSAGE%"'
     " | sendmail -t"
 )
+# The report and trigger commands waiting to be executed in background.
+# 0 executes them synchronously within the tick.
+DEFAULT_DISPATCH_QUEUE_SIZE = 100
+# The reports are held for this many seconds to be sent as a single
+# digest, except for the start of the panic mode. 0 disables it.
+DEFAULT_REPORT_COALESCE_WINDOW = 0
+# The reports with the same reason are sent at most once per this many
+# seconds, except for the start of the panic mode. 0 disables it.
+DEFAULT_REPORT_RATE_LIMIT = 0
+# How many per-temp trigger commands are executed concurrently, and
+# the timeout (in seconds) of each of them.
+DEFAULT_TRIGGER_COMMAND_PARALLELISM = 4
+DEFAULT_TRIGGER_COMMAND_TIMEOUT = 5
 
 DEFAULT_FAN_TYPE = "linux"
 DEFAULT_PWM_LINE_START = 100
@@ -101,6 +146,8 @@ TriggerConfig = NamedTuple(
     [
         ("global_commands", Actions),
         ("temp_commands", Mapping[TempName, Actions]),
+        ("command_parallelism", int),
+        ("command_timeout", int),
     ]
     # fmt: on
 )
@@ -125,6 +172,12 @@ DaemonConfig = NamedTuple(
         ("logfile", Optional[str]),
         ("interval", int),
         ("exporter_listen_host", Optional[str]),
+        ("exporter_type", str),
+        ("exporter_push_host", Optional[str]),
+        ("exporter_server", str),
+        ("history_duration", int),
+        ("history_resolution", int),
+        ("command_helper", bool),
     ]
     # fmt: on
 )
@@ -135,6 +188,9 @@ ParsedConfig = NamedTuple(
     [
         ("daemon", DaemonConfig),
         ("report_cmd", str),
+        ("report_coalesce_window", int),
+        ("report_rate_limit", int),
+        ("dispatch_queue_size", int),
         ("triggers", TriggerConfig),
         ("fans", Mapping[FanName, PWMFanNorm]),
         ("temps", Mapping[TempName, Temp]),
@@ -144,6 +200,23 @@ ParsedConfig = NamedTuple(
 )
 
 
+# The options of the [actions] section.
+_ActionsConfig = NamedTuple(
+    "_ActionsConfig",
+    # fmt: off
+    [
+        ("report_cmd", str),
+        ("report_coalesce_window", int),
+        ("report_rate_limit", int),
+        ("dispatch_queue_size", int),
+        ("global_commands", Actions),
+        ("trigger_command_parallelism", int),
+        ("trigger_command_timeout", int),
+    ]
+    # fmt: on
+)
+
+
 def parse_config(config_path: Path, daemon_cli_config: DaemonCLIConfig) -> ParsedConfig:
     config = configparser.ConfigParser(interpolation=None)
     try:
@@ -151,18 +224,26 @@ def parse_config(config_path: Path, daemon_cli_config: DaemonCLIConfig) -> Parse
     except Exception as e:
         raise RuntimeError("Unable to parse %s:\n%s" % (config_path, e))
 
+    sections = _index_sections(config)
     daemon, hddtemp = _parse_daemon(config, daemon_cli_config)
-    report_cmd, global_commands = _parse_actions(config)
-    arduino_connections = _parse_arduino_connections(config)
-    temps, temp_commands = _parse_temps(config, hddtemp)
-    fans = _parse_fans(config, arduino_connections)
-    mappings = _parse_mappings(config, fans, temps)
+    actions = _parse_actions(config)
+    arduino_connections = _parse_arduino_connections(config, sections["arduino"])
+    sources = _parse_sources(config, sections["source"])
+    temps, temp_commands = _parse_temps(config, sections["temp"], hddtemp, sources)
+    fans = _parse_fans(config, sections["fan"], arduino_connections)
+    mappings = _parse_mappings(config, sections["mapping"], fans, temps)
 
     return ParsedConfig(
         daemon=daemon,
-        report_cmd=report_cmd,
+        report_cmd=actions.report_cmd,
+        report_coalesce_window=actions.report_coalesce_window,
+        report_rate_limit=actions.report_rate_limit,
+        dispatch_queue_size=actions.dispatch_queue_size,
         triggers=TriggerConfig(
-            global_commands=global_commands, temp_commands=temp_commands
+            global_commands=actions.global_commands,
+            temp_commands=temp_commands,
+            command_parallelism=actions.trigger_command_parallelism,
+            command_timeout=actions.trigger_command_timeout,
         ),
         fans=fans,
         temps=temps,
@@ -170,6 +251,133 @@ def parse_config(config_path: Path, daemon_cli_config: DaemonCLIConfig) -> Parse
     )
 
 
+def _index_sections(
+    config: configparser.ConfigParser,
+) -> Mapping[str, List[Tuple[str, str]]]:
+    """Group the `[type: name]` sections by their type in a single pass,
+    expanding the template sections along the way.
+
+    Returns the `(section name, name)` pairs per each type.
+    """
+    sections = defaultdict(list)  # type: Dict[str, List[Tuple[str, str]]]
+    for section_name in config.sections():
+        section_type, sep, name = section_name.partition(":")
+        if not sep:
+            continue
+        section_type = section_type.strip().lower()
+        section = config[section_name]
+        if not any(option in section for option in TEMPLATE_OPTIONS):
+            sections[section_type].append((section_name, name))
+            continue
+
+        for expanded_name, options in _expand_template(section_name, section):
+            if config.has_section(expanded_name):
+                raise RuntimeError(
+                    "Section [%s] expanded from the template [%s] is already declared"
+                    % (expanded_name, section_name)
+                )
+            config[expanded_name] = options
+            sections[section_type].append(
+                (expanded_name, expanded_name.partition(":")[2])
+            )
+        config.remove_section(section_name)
+    return sections
+
+
+def _expand_template(
+    section_name: str, section: configparser.SectionProxy
+) -> Iterator[Tuple[str, Dict[str, str]]]:
+    foreach_glob = section.get("foreach_glob")
+    foreach_range = section.get("foreach_range")
+    if foreach_glob is not None and foreach_range is not None:
+        raise RuntimeError(
+            "`foreach_glob` and `foreach_range` are mutually exclusive "
+            "in the [%s] section" % section_name
+        )
+
+    if foreach_glob is not None:
+        placeholders = ("{n}", "{name}", "{path}")  # type: Tuple[str, ...]
+        values = [
+            (str(n), os.path.basename(path), path)
+            for n, path in enumerate(sorted(glob.glob(foreach_glob)))
+        ]  # type: List[Tuple[str, ...]]
+    else:
+        assert foreach_range is not None
+        placeholders = ("{n}",)
+        start, end = _parse_range(foreach_range, section_name)
+        values = [(str(n),) for n in range(start, end + 1)]
+
+    if not any(placeholder in section_name for placeholder in placeholders):
+        raise RuntimeError(
+            "The name of the template section [%s] must contain one of: %s"
+            % (section_name, ", ".join(placeholders))
+        )
+
+    def substitute(template: str, substitutions: Sequence[Tuple[str, str]]) -> str:
+        for placeholder, value in substitutions:
+            template = template.replace(placeholder, value)
+        return template
+
+    options = {
+        key: value for key, value in section.items() if key not in TEMPLATE_OPTIONS
+    }
+    for item_values in values:
+        substitutions = list(zip(placeholders, item_values))
+        yield substitute(section_name, substitutions), {
+            key: substitute(value, substitutions) for key, value in options.items()
+        }
+
+
+def _parse_range(value: str, section_name: str) -> Tuple[int, int]:
+    start, sep, end = value.partition("-")
+    try:
+        if not sep:
+            raise ValueError(value)
+        result = int(start), int(end)
+    except ValueError:
+        raise RuntimeError(
+            "Invalid `foreach_range` '%s' in the [%s] section: "
+            "expected `start-end`, e.g. `1-12`" % (value, section_name)
+        )
+    if result[0] > result[1]:
+        raise RuntimeError(
+            "Invalid `foreach_range` '%s' in the [%s] section: "
+            "start must not be greater than end" % (value, section_name)
+        )
+    return result
+
+
+def _expand_patterns(
+    patterns: Sequence[str], names: Sequence[str], what: str, mapping_name: str
+) -> List[str]:
+    """Replace the glob patterns (like `disk-*`) in a mapping with
+    the matching names.
+    """
+    result = []  # type: List[str]
+    for pattern in patterns:
+        if not any(c in pattern for c in "*?["):
+            result.append(pattern)
+            continue
+        matched = [name for name in names if fnmatchcase(name, pattern)]
+        if not matched:
+            raise RuntimeError(
+                "%s pattern '%s' in mapping '%s' doesn't match anything"
+                % (what.capitalize(), pattern, mapping_name)
+            )
+        result.extend(matched)
+    return result
+
+
+def _split_fan_modifier(fan_with_speed: str) -> Tuple[str, float]:
+    fan_pattern, sep, modifier = fan_with_speed.rpartition("*")
+    if sep:
+        try:
+            return fan_pattern.strip(), float(modifier)
+        except ValueError:
+            pass  # The `*` belongs to a pattern, like in `disk-*`.
+    return fan_with_speed.strip(), 1.0
+
+
 def first_not_none(*parts: Optional[T]) -> Optional[T]:
     for part in parts:
         if part is not None:
@@ -201,9 +409,63 @@ def _parse_daemon(
     )
     keys.discard("exporter_listen_host")
 
+    exporter_type = daemon.get("exporter_type", fallback=DEFAULT_EXPORTER_TYPE)
+    keys.discard("exporter_type")
+    if exporter_type not in EXPORTER_TYPES:
+        raise RuntimeError(
+            "Unsupported exporter_type '%s'. Supported ones: %s"
+            % (exporter_type, ", ".join(EXPORTER_TYPES))
+        )
+
+    exporter_push_host = daemon.get("exporter_push_host")
+    keys.discard("exporter_push_host")
+    if exporter_type in EXPORTER_TYPES_PUSH and not exporter_push_host:
+        raise RuntimeError(
+            "`exporter_type = %s` requires `exporter_push_host` to be set"
+            % exporter_type
+        )
+
+    exporter_server = daemon.get("exporter_server", fallback=DEFAULT_EXPORTER_SERVER)
+    keys.discard("exporter_server")
+    if exporter_server not in EXPORTER_SERVERS:
+        raise RuntimeError(
+            "Unsupported exporter_server '%s'. Supported ones: %s"
+            % (exporter_server, ", ".join(EXPORTER_SERVERS))
+        )
+    if (
+        exporter_listen_host
+        and exporter_listen_host.startswith("unix:")
+        and exporter_server != "event_loop"
+    ):
+        raise RuntimeError(
+            "A Unix socket in `exporter_listen_host` requires "
+            "`exporter_server = event_loop`"
+        )
+
+    history_duration = daemon.getint(
+        "history_duration", fallback=DEFAULT_HISTORY_DURATION
+    )
+    keys.discard("history_duration")
+    history_resolution = daemon.getint("history_resolution", fallback=interval)
+    keys.discard("history_resolution")
+    if history_duration:
+        if not exporter_listen_host or exporter_type not in EXPORTER_TYPES_PULL:
+            raise RuntimeError(
+                "`history_duration` requires `exporter_listen_host` to be set "
+                "and `exporter_type` to be one of: %s" % ", ".join(EXPORTER_TYPES_PULL)
+            )
+        if not (0 < history_resolution <= history_duration):
+            raise RuntimeError(
+                "`history_resolution` must be within (0; history_duration], "
+                "got %s" % history_resolution
+            )
+
     hddtemp = daemon.get("hddtemp") or DEFAULT_HDDTEMP
     keys.discard("hddtemp")
 
+    command_helper = daemon.getboolean("command_helper", fallback=False)
+    keys.discard("command_helper")
+
     if keys:
         raise RuntimeError("Unknown options in the [daemon] section: %s" % (keys,))
 
@@ -213,12 +475,18 @@ def _parse_daemon(
             logfile=logfile,
             interval=interval,
             exporter_listen_host=exporter_listen_host,
+            exporter_type=exporter_type,
+            exporter_push_host=exporter_push_host,
+            exporter_server=exporter_server,
+            history_duration=history_duration,
+            history_resolution=history_resolution,
+            command_helper=command_helper,
         ),
         hddtemp,
     )
 
 
-def _parse_actions(config: configparser.ConfigParser) -> Tuple[str, Actions]:
+def _parse_actions(config: configparser.ConfigParser) -> _ActionsConfig:
     actions = config["actions"]
     keys = set(actions.keys())
 
@@ -226,6 +494,45 @@ def _parse_actions(config: configparser.ConfigParser) -> Tuple[str, Actions]:
     assert report_cmd is not None
     keys.discard("report_cmd")
 
+    report_coalesce_window = actions.getint(
+        "report_coalesce_window", fallback=DEFAULT_REPORT_COALESCE_WINDOW
+    )
+    keys.discard("report_coalesce_window")
+    report_rate_limit = actions.getint(
+        "report_rate_limit", fallback=DEFAULT_REPORT_RATE_LIMIT
+    )
+    keys.discard("report_rate_limit")
+    for option, value in (
+        ("report_coalesce_window", report_coalesce_window),
+        ("report_rate_limit", report_rate_limit),
+    ):
+        if value < 0:
+            raise RuntimeError("`%s` must not be negative, got %s" % (option, value))
+
+    dispatch_queue_size = actions.getint(
+        "dispatch_queue_size", fallback=DEFAULT_DISPATCH_QUEUE_SIZE
+    )
+    keys.discard("dispatch_queue_size")
+    if dispatch_queue_size < 0:
+        raise RuntimeError(
+            "`dispatch_queue_size` must not be negative, got %s" % dispatch_queue_size
+        )
+
+    trigger_command_parallelism = actions.getint(
+        "trigger_command_parallelism", fallback=DEFAULT_TRIGGER_COMMAND_PARALLELISM
+    )
+    keys.discard("trigger_command_parallelism")
+    trigger_command_timeout = actions.getint(
+        "trigger_command_timeout", fallback=DEFAULT_TRIGGER_COMMAND_TIMEOUT
+    )
+    keys.discard("trigger_command_timeout")
+    for option, value in (
+        ("trigger_command_parallelism", trigger_command_parallelism),
+        ("trigger_command_timeout", trigger_command_timeout),
+    ):
+        if value <= 0:
+            raise RuntimeError("`%s` must be positive, got %s" % (option, value))
+
     panic = AlertCommands(
         enter_cmd=first_not_none(actions.get("panic_enter_cmd")),
         leave_cmd=first_not_none(actions.get("panic_leave_cmd")),
@@ -243,20 +550,23 @@ def _parse_actions(config: configparser.ConfigParser) -> Tuple[str, Actions]:
     if keys:
         raise RuntimeError("Unknown options in the [actions] section: %s" % (keys,))
 
-    return report_cmd, Actions(panic=panic, threshold=threshold)
+    return _ActionsConfig(
+        report_cmd=report_cmd,
+        report_coalesce_window=report_coalesce_window,
+        report_rate_limit=report_rate_limit,
+        dispatch_queue_size=dispatch_queue_size,
+        global_commands=Actions(panic=panic, threshold=threshold),
+        trigger_command_parallelism=trigger_command_parallelism,
+        trigger_command_timeout=trigger_command_timeout,
+    )
 
 
 def _parse_arduino_connections(
-    config: configparser.ConfigParser,
+    config: configparser.ConfigParser, sections: Sequence[Tuple[str, str]]
 ) -> Mapping[ArduinoName, ArduinoConnection]:
     arduino_connections = {}  # type: Dict[ArduinoName, ArduinoConnection]
-    for section_name in config.sections():
-        section_name_parts = section_name.split(":", 1)
-
-        if section_name_parts[0].strip().lower() != "arduino":
-            continue
-
-        arduino_name = ArduinoName(section_name_parts[1].strip())
+    for section_name, name in sections:
+        arduino_name = ArduinoName(name.strip())
         arduino = config[section_name]
         keys = set(arduino.keys())
 
@@ -267,6 +577,8 @@ def _parse_arduino_connections(
         keys.discard("baudrate")
         status_ttl = arduino.getint("status_ttl", fallback=DEFAULT_STATUS_TTL)
         keys.discard("status_ttl")
+        status_mode = arduino.get("status_mode", fallback=DEFAULT_STATUS_MODE)
+        keys.discard("status_mode")
 
         if keys:
             raise RuntimeError(
@@ -282,24 +594,73 @@ def _parse_arduino_connections(
             serial_url=serial_url,
             baudrate=baudrate,
             status_ttl=status_ttl,
+            status_mode=status_mode,
         )
 
     # Empty arduino_connections is ok
     return arduino_connections
 
 
+def _parse_sources(
+    config: configparser.ConfigParser, sections: Sequence[Tuple[str, str]]
+) -> Mapping[SourceName, CommandSource]:
+    sources = {}  # type: Dict[SourceName, CommandSource]
+    for section_name, name in sections:
+        source_name = SourceName(name.strip())
+        source = config[section_name]
+        keys = set(source.keys())
+
+        shell_command = source["command"]
+        keys.discard("command")
+
+        format = source.get("format", fallback=DEFAULT_SOURCE_FORMAT)
+        keys.discard("format")
+        if format not in SOURCE_FORMATS:
+            raise RuntimeError(
+                "Unsupported format '%s' for source '%s'. Supported ones: %s"
+                % (format, source_name, ", ".join(SOURCE_FORMATS))
+            )
+
+        poll_interval = source.getfloat(
+            "poll_interval", fallback=DEFAULT_SOURCE_POLL_INTERVAL
+        )
+        keys.discard("poll_interval")
+        if poll_interval < 0:
+            raise RuntimeError(
+                "`poll_interval` of source '%s' must not be negative" % source_name
+            )
+
+        if keys:
+            raise RuntimeError(
+                "Unknown options in the [%s] section: %s" % (section_name, keys)
+            )
+
+        if source_name in sources:
+            raise RuntimeError(
+                "Duplicate source section declaration for '%s'" % source_name
+            )
+        command_source = CommandSource(
+            shell_command, format=format, poll_interval=poll_interval
+        )
+        # The identical commands are executed once for all of them.
+        sources[source_name] = next(
+            (s for s in sources.values() if s == command_source), command_source
+        )
+
+    # Empty sources is ok
+    return sources
+
+
 def _parse_temps(
-    config: configparser.ConfigParser, hddtemp: str
+    config: configparser.ConfigParser,
+    sections: Sequence[Tuple[str, str]],
+    hddtemp: str,
+    sources: Mapping[SourceName, CommandSource],
 ) -> Tuple[Mapping[TempName, Temp], Mapping[TempName, Actions]]:
     temps = {}  # type: Dict[TempName, Temp]
     temp_commands = {}  # type: Dict[TempName, Actions]
-    for section_name in config.sections():
-        section_name_parts = section_name.split(":", 1)
-
-        if section_name_parts[0].strip().lower() != "temp":
-            continue
-
-        temp_name = TempName(section_name_parts[1].strip())
+    for section_name, name in sections:
+        temp_name = TempName(name.strip())
         temp = config[section_name]
         keys = set(temp.keys())
 
@@ -354,6 +715,25 @@ def _parse_temps(
                 temp["command"], min=min, max=max, panic=panic, threshold=threshold
             )
             keys.discard("command")
+        elif type == "source":
+            if min is None or max is None:
+                raise RuntimeError(
+                    "source temp '%s' doesn't define the mandatory `min` and `max` "
+                    "temps" % temp_name
+                )
+            source_name = SourceName(temp["source"].strip())
+            keys.discard("source")
+            if source_name not in sources:
+                raise RuntimeError("[source:%s] section is missing" % source_name)
+            t = SourceTemp(
+                sources[source_name],
+                temp["field"],
+                min=min,
+                max=max,
+                panic=panic,
+                threshold=threshold,
+            )
+            keys.discard("field")
         else:
             raise RuntimeError(
                 "Unsupported temp type '%s' for temp '%s'" % (type, temp_name)
@@ -380,16 +760,14 @@ def _parse_temps(
 
 def _parse_fans(
     config: configparser.ConfigParser,
+    sections: Sequence[Tuple[str, str]],
     arduino_connections: Mapping[ArduinoName, ArduinoConnection],
 ) -> Mapping[FanName, PWMFanNorm]:
     fans = {}  # type: Dict[FanName, PWMFanNorm]
-    for section_name in config.sections():
-        section_name_parts = section_name.split(":", 1)
-
-        if section_name_parts[0].strip().lower() != "fan":
-            continue
-
-        fan_name = FanName(section_name_parts[1].strip())
+    # (arduino name, tacho pin)
+    arduino_tacho_pins = set()  # type: Set[Tuple[ArduinoName, ArduinoPin]]
+    for section_name, name in sections:
+        fan_name = FanName(name.strip())
         fan = config[section_name]
         keys = set(fan.keys())
 
@@ -414,6 +792,23 @@ def _parse_fans(
             if arduino_name not in arduino_connections:
                 raise ValueError("[arduino:%s] section is missing" % arduino_name)
 
+            # The pins are also checked against the ones reported by
+            # the board once it is connected (see `ArduinoConnection.check_pins`).
+            for option, pin in (("pwm_pin", pwm_pin), ("tacho_pin", tacho_pin)):
+                if pin is None or not (0 <= pin <= 255):
+                    raise RuntimeError(
+                        "Incorrect `%s` value '%s' for fan '%s': "
+                        "it must be within [0;255]" % (option, pin, fan_name)
+                    )
+            # A PWM pin might be shared by several fans (with a splitter),
+            # but each of them needs its own tachometer.
+            if (arduino_name, tacho_pin) in arduino_tacho_pins:
+                raise RuntimeError(
+                    "`tacho_pin` %s of the Arduino board '%s' is used by "
+                    "more than one fan" % (tacho_pin, arduino_name)
+                )
+            arduino_tacho_pins.add((arduino_name, tacho_pin))
+
             pwmfan = ArduinoPWMFan(
                 arduino_connections[arduino_name], pwm_pin=pwm_pin, tacho_pin=tacho_pin
             )
@@ -469,27 +864,30 @@ def _parse_fans(
 
 def _parse_mappings(
     config: configparser.ConfigParser,
+    sections: Sequence[Tuple[str, str]],
     fans: Mapping[FanName, PWMFanNorm],
     temps: Mapping[TempName, Temp],
 ) -> Mapping[MappingName, FansTempsRelation]:
 
     mappings = {}  # type: Dict[MappingName, FansTempsRelation]
-    for section_name in config.sections():
-        section_name_parts = section_name.split(":", 1)
-
-        if section_name_parts[0].lower() != "mapping":
-            continue
-
-        mapping_name = MappingName(section_name_parts[1])
+    temp_names = list(temps)  # type: List[str]
+    fan_names = list(fans)  # type: List[str]
+    for section_name, name in sections:
+        mapping_name = MappingName(name)
         mapping = config[section_name]
         keys = set(mapping.keys())
 
         # temps:
 
         mapping_temps = [
-            TempName(temp_name.strip()) for temp_name in mapping["temps"].split(",")
+            TempName(temp_name)
+            for temp_name in _expand_patterns(
+                [s.strip() for s in mapping["temps"].split(",") if s.strip()],
+                temp_names,
+                "temp",
+                mapping_name,
+            )
         ]
-        mapping_temps = [s for s in mapping_temps if s]
         keys.discard("temps")
         if not mapping_temps:
             raise RuntimeError(
@@ -513,26 +911,16 @@ def _parse_mappings(
         fans_with_speed = [s for s in fans_with_speed if s]
         keys.discard("fans")
 
-        fan_speed_pairs = [
-            fan_with_speed.split("*") for fan_with_speed in fans_with_speed
-        ]
-        for fan_speed_pair in fan_speed_pairs:
-            if len(fan_speed_pair) not in (1, 2):
-                raise RuntimeError(
-                    "Invalid fan specification '%s' in mapping '%s'"
-                    % (fan_speed_pair, mapping_name)
+        # `name * 0.6`, where the name might be a pattern like `disk-* * 0.6`.
+        mapping_fans = []  # type: List[FanSpeedModifier]
+        for fan_with_speed in fans_with_speed:
+            fan_pattern, modifier = _split_fan_modifier(fan_with_speed)
+            mapping_fans.extend(
+                FanSpeedModifier(fan=FanName(fan_name), modifier=modifier)
+                for fan_name in _expand_patterns(
+                    [fan_pattern], fan_names, "fan", mapping_name
                 )
-        mapping_fans = [
-            FanSpeedModifier(
-                fan=FanName(fan_speed_pair[0].strip()),
-                modifier=(
-                    float(
-                        fan_speed_pair[1].strip() if len(fan_speed_pair) == 2 else 1.0
-                    )
-                ),
             )
-            for fan_speed_pair in fan_speed_pairs
-        ]
         for fan_speed_modifier in mapping_fans:
             if fan_speed_modifier.fan not in fans:
                 raise RuntimeError(
@@ -1,26 +1,58 @@
 import logging
 import os
 import signal
+import sys
 import threading
 from contextlib import ExitStack
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional, Tuple
 
 import click
 
+from afancontrol.command_helper import CommandHelper
 from afancontrol.config import (
     DEFAULT_CONFIG,
     DEFAULT_PIDFILE,
+    EXPORTER_TYPES_PUSH,
     DaemonCLIConfig,
+    ParsedConfig,
     parse_config,
 )
+from afancontrol.dispatch import Dispatcher
+from afancontrol.history import History
+from afancontrol.logger import logger
 from afancontrol.manager import Manager
-from afancontrol.metrics import Metrics, NullMetrics, PrometheusMetrics
+from afancontrol.metrics import (
+    BuiltinMetrics,
+    Metrics,
+    NullMetrics,
+    PrometheusMetrics,
+    UDPMetrics,
+)
+from afancontrol.probe import DEFAULT_PROBE_REPEAT, probe as run_probe
 from afancontrol.report import Report
 
 
 @click.command()
 @click.option("-t", "--test", is_flag=True, help="Test config")
+@click.option(
+    "--probe",
+    is_flag=True,
+    help="Read the configured temps and fans in parallel, report their "
+    "latencies and the projected tick duration, then exit",
+)
+@click.option(
+    "--probe-repeat",
+    help="Number of reads of each device in the probe mode",
+    default=DEFAULT_PROBE_REPEAT,
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--probe-set-pwm",
+    is_flag=True,
+    help="Also enable PWM and set the fans to full speed in the probe mode",
+)
 @click.option("-v", "--verbose", is_flag=True, help="Increase logging verbosity")
 @click.option(
     "-c",
@@ -43,12 +75,16 @@ from afancontrol.report import Report
 )
 @click.option(
     "--exporter-listen-host",
-    help="Prometheus exporter listen host, e.g. `127.0.0.1:8000` (disabled by default)",
+    help="Prometheus exporter listen host, e.g. `127.0.0.1:8000` "
+    "or `unix:/run/afancontrol.sock` (disabled by default)",
     type=str,
 )
 def daemon(
     *,
     test: bool,
+    probe: bool,
+    probe_repeat: int,
+    probe_set_pwm: bool,
     verbose: bool,
     config: str,
     pidfile: str,
@@ -65,20 +101,20 @@ def daemon(
     )
     parsed_config = parse_config(config_path, daemon_cli_config)
 
-    if parsed_config.daemon.exporter_listen_host:
-        metrics = PrometheusMetrics(
-            parsed_config.daemon.exporter_listen_host
-        )  # type: Metrics
-    else:
-        metrics = NullMetrics()
+    metrics = _make_metrics(parsed_config)
+
+    dispatcher = None  # type: Optional[Dispatcher]
+    if parsed_config.dispatch_queue_size:
+        dispatcher = Dispatcher(queue_size=parsed_config.dispatch_queue_size)
 
     manager = Manager(
         fans=parsed_config.fans,
         temps=parsed_config.temps,
         mappings=parsed_config.mappings,
-        report=Report(report_command=parsed_config.report_cmd),
+        report=_make_report(parsed_config, dispatcher),
         triggers_config=parsed_config.triggers,
         metrics=metrics,
+        dispatcher=dispatcher,
     )
 
     pidfile_instance = None  # type: Optional[PidFile]
@@ -89,6 +125,11 @@ def daemon(
         print("Config file '%s' is good" % config_path)
         return
 
+    if probe:
+        if not run_probe(parsed_config, repeat=probe_repeat, set_pwm=probe_set_pwm):
+            sys.exit(1)
+        return
+
     if parsed_config.daemon.logfile:
         # Logging to file should not be configured when running in
         # the config test mode.
@@ -102,13 +143,18 @@ def daemon(
     signal.signal(signal.SIGTERM, signals.sigterm)
     signal.signal(signal.SIGQUIT, signals.sigterm)
     signal.signal(signal.SIGINT, signals.sigterm)
-    signal.signal(signal.SIGHUP, signals.sigterm)
+    signal.signal(signal.SIGHUP, signals.sighup)
 
     with ExitStack() as stack:
         if pidfile_instance is not None:
             stack.enter_context(pidfile_instance)
             pidfile_instance.save_pid(os.getpid())
 
+        if parsed_config.daemon.command_helper:
+            # Entered before the manager, so the commands executed
+            # on its exit would still go through the helper.
+            stack.enter_context(CommandHelper())
+
         stack.enter_context(manager)
 
         # Make a first tick. If something is wrong, (e.g. bad fan/temp
@@ -116,9 +162,136 @@ def daemon(
         manager.tick()
 
         while not signals.wait_for_term_queued(parsed_config.daemon.interval):
+            if signals.pop_reload_queued():
+                parsed_config = reload_config(
+                    config_path, daemon_cli_config, parsed_config, manager
+                )
             manager.tick()
 
 
+def reload_config(
+    config_path: Path,
+    daemon_cli_config: DaemonCLIConfig,
+    parsed_config: ParsedConfig,
+    manager: Manager,
+) -> ParsedConfig:
+    """Apply the changes of the config file to the running `manager`.
+
+    The current config is kept when the new one is invalid.
+    """
+    logger.info("Reloading the config %s", config_path)
+    try:
+        new_config = parse_config(config_path, daemon_cli_config)
+        if _metrics_key(new_config) == _metrics_key(parsed_config):
+            metrics = manager.metrics
+        else:
+            metrics = _make_metrics(new_config)
+    except Exception as e:
+        logger.error("Keeping the current config, the new one is invalid:\n%s", e)
+        return parsed_config
+
+    for option in ("pidfile", "logfile", "command_helper"):
+        if getattr(new_config.daemon, option) != getattr(parsed_config.daemon, option):
+            logger.warning("Changing `%s` requires a restart, ignoring it", option)
+    if new_config.dispatch_queue_size != parsed_config.dispatch_queue_size:
+        logger.warning("Changing `dispatch_queue_size` requires a restart, ignoring it")
+    new_config = new_config._replace(
+        daemon=new_config.daemon._replace(
+            pidfile=parsed_config.daemon.pidfile,
+            logfile=parsed_config.daemon.logfile,
+            command_helper=parsed_config.daemon.command_helper,
+        ),
+        dispatch_queue_size=parsed_config.dispatch_queue_size,
+    )
+
+    try:
+        manager.reload(
+            fans=new_config.fans,
+            temps=new_config.temps,
+            mappings=new_config.mappings,
+            report=_make_report(new_config, manager.dispatcher),
+            triggers_config=new_config.triggers,
+            metrics=metrics,
+        )
+    except Exception as e:
+        logger.error(
+            "Keeping the current config, unable to apply the new one:\n%s",
+            e,
+            exc_info=True,
+        )
+        return parsed_config
+    logger.info("The config has been reloaded")
+    return new_config
+
+
+def _metrics_key(parsed_config: ParsedConfig) -> Tuple[Any, ...]:
+    # The metrics (and their server) are recreated on reload only when
+    # this changes. The history columns depend on the temps and fans.
+    daemon = parsed_config.daemon
+    key = (
+        daemon.exporter_listen_host,
+        daemon.exporter_type,
+        daemon.exporter_push_host,
+        daemon.exporter_server,
+        daemon.history_duration,
+    )  # type: Tuple[Any, ...]
+    if daemon.history_duration:
+        key += (
+            daemon.history_resolution,
+            sorted(parsed_config.temps),
+            sorted(parsed_config.fans),
+        )
+    return key
+
+
+def _make_report(
+    parsed_config: ParsedConfig, dispatcher: Optional[Dispatcher]
+) -> Report:
+    return Report(
+        report_command=parsed_config.report_cmd,
+        dispatcher=dispatcher,
+        coalesce_window=parsed_config.report_coalesce_window,
+        rate_limit=parsed_config.report_rate_limit,
+    )
+
+
+def _make_metrics(parsed_config: ParsedConfig) -> Metrics:
+    if parsed_config.daemon.exporter_type in EXPORTER_TYPES_PUSH:
+        assert parsed_config.daemon.exporter_push_host is not None
+        metrics = UDPMetrics(
+            parsed_config.daemon.exporter_push_host,
+            protocol=parsed_config.daemon.exporter_type,
+        )  # type: Metrics
+    elif parsed_config.daemon.exporter_listen_host:
+        history = None  # type: Optional[History]
+        if parsed_config.daemon.history_duration:
+            history = History(
+                duration=parsed_config.daemon.history_duration,
+                resolution=parsed_config.daemon.history_resolution,
+                temp_names=parsed_config.temps.keys(),
+                fan_names=parsed_config.fans.keys(),
+            )
+            logger.info(
+                "Keeping %s samples of history (%.1f KiB)",
+                history.capacity,
+                history.size_bytes / 1024,
+            )
+        metrics_cls = (
+            BuiltinMetrics
+            if parsed_config.daemon.exporter_type == "builtin"
+            else PrometheusMetrics
+        )
+        metrics = metrics_cls(
+            parsed_config.daemon.exporter_listen_host,
+            history=history,
+            server=parsed_config.daemon.exporter_server,
+        )
+    else:
+        metrics = NullMetrics()
+
+    return metrics
+
+
 class PidFile:
     def __init__(self, pidfile: str) -> None:
         self.pidfile = Path(pidfile)
@@ -150,13 +323,25 @@ class PidFile:
 
 class Signals:
     def __init__(self):
-        self._term_event = threading.Event()
+        self._event = threading.Event()
+        self._term_queued = False
+        self._reload_queued = False
 
     def sigterm(self, signum, stackframe):
-        self._term_event.set()
+        self._term_queued = True
+        self._event.set()
+
+    def sighup(self, signum, stackframe):
+        self._reload_queued = True
+        self._event.set()
 
     def wait_for_term_queued(self, seconds: float) -> bool:
-        is_set = self._term_event.wait(seconds)
-        if is_set:
-            return True
-        return False
+        """Wait for `seconds` or until a signal is received."""
+        self._event.wait(seconds)
+        self._event.clear()
+        return self._term_queued
+
+    def pop_reload_queued(self) -> bool:
+        is_queued = self._reload_queued
+        self._reload_queued = False
+        return is_queued
@@ -0,0 +1,129 @@
+import queue
+import threading
+from timeit import default_timer
+from typing import Any, Callable, Optional, Tuple
+
+from afancontrol.logger import logger
+
+# How long the exit waits for the queued commands to be executed.
+DEFAULT_DRAIN_TIMEOUT = 30
+
+_STOP = None
+
+
+class Dispatcher:
+    """Executes the report and the trigger commands in a background
+    thread, so the tick never waits for them (e.g. the default report
+    command, `sendmail`, might block for its whole timeout right
+    when the panic mode is entered).
+
+    The commands are executed one at a time in the order they have been
+    submitted, so a leave command never overtakes its enter command.
+    The queue is bounded: when it's full, the new commands are dropped
+    (and counted in `dropped`).
+    """
+
+    def __init__(
+        self, *, queue_size: int, drain_timeout: float = DEFAULT_DRAIN_TIMEOUT
+    ) -> None:
+        if queue_size <= 0:
+            raise ValueError("Dispatch queue size must be positive: %s" % queue_size)
+        self.queue_size = queue_size
+        self.drain_timeout = drain_timeout
+        self._queue = queue.Queue(maxsize=queue_size)  # type: queue.Queue
+        self._thread = None  # type: Optional[threading.Thread]
+
+        self.executed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of the commands waiting to be executed."""
+        return self._queue.qsize()
+
+    def __enter__(self):  # reusable
+        assert self._thread is None
+        self._thread = threading.Thread(
+            target=self._run, name="afancontrol-dispatcher", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        assert self._thread is not None
+        # The commands submitted on exit (like the trigger leave
+        # commands) are still executed, but the exit is not delayed
+        # for longer than the `drain_timeout`.
+        deadline = default_timer() + self.drain_timeout
+        try:
+            self._queue.put(_STOP, timeout=self.drain_timeout)
+        except queue.Full:
+            pass
+        else:
+            self._thread.join(max(0.0, deadline - default_timer()))
+        if self._thread.is_alive():
+            logger.warning(
+                "Gave up waiting for the queued report/trigger commands, "
+                "%s of them are not executed",
+                # Not counting the `_STOP`.
+                max(0, self.queue_depth - 1),
+            )
+        self._thread = None
+        return None
+
+    def submit(self, description: str, command: Callable[[], Any]) -> bool:
+        """Queue the `command` for execution. Never blocks.
+
+        Returns false when the command has been dropped because the queue
+        is full. When the dispatcher is not running, the command is
+        executed right away.
+        """
+        if self._thread is None:
+            self._execute((description, command))
+            return True
+        try:
+            self._queue.put_nowait((description, command))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(
+                "The report/trigger commands queue is full (%s), dropping: %s",
+                self.queue_size,
+                description,
+            )
+            return False
+        return True
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            self._execute(item)
+
+    def _execute(self, item: Tuple[str, Callable[[], Any]]) -> None:
+        if execute(*item):
+            self.executed += 1
+        else:
+            self.failed += 1
+
+
+def dispatch(
+    dispatcher: Optional[Dispatcher], description: str, command: Callable[[], Any]
+) -> None:
+    """Submit the `command` to the `dispatcher`, or execute it right away
+    when there's no dispatcher.
+    """
+    if dispatcher is None:
+        execute(description, command)
+    else:
+        dispatcher.submit(description, command)
+
+
+def execute(description: str, command: Callable[[], Any]) -> bool:
+    try:
+        command()
+    except Exception as e:
+        logger.warning("%s failed: %s", description, e, exc_info=True)
+        return False
+    return True
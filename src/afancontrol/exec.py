@@ -1,18 +1,24 @@
 import subprocess
 
+from afancontrol.command_helper import installed_command_helper
 from afancontrol.logger import logger
 
 
-def exec_shell_command(shell_command: str, timeout: int = 5) -> str:
+def exec_shell_command(shell_command: str, timeout: float = 5) -> str:
     try:
-        p = subprocess.run(
-            shell_command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True,
-            check=True,
-            timeout=timeout,
-        )
+        command_helper = installed_command_helper()
+        if command_helper is not None:
+            p = command_helper.run(shell_command, timeout=timeout)
+            p.check_returncode()
+        else:
+            p = subprocess.run(
+                shell_command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                shell=True,
+                check=True,
+                timeout=timeout,
+            )
         out = p.stdout.decode("ascii")
         err = p.stderr.decode().strip()
         if err:
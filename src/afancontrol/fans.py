@@ -1,6 +1,11 @@
-from contextlib import ExitStack
-from typing import Mapping, MutableSet, Optional
-
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterable, Iterator, List, Mapping, MutableSet, Optional
+
+from afancontrol.arduino import (
+    arduino_connections_from_pwmfan_norms,
+    reuse_arduino_connections,
+)
 from afancontrol.config import FanName
 from afancontrol.logger import logger
 from afancontrol.pwmfan import PWMFanNorm, PWMValueNorm
@@ -11,7 +16,8 @@ class Fans:
     def __init__(self, fans: Mapping[FanName, PWMFanNorm], *, report: Report) -> None:
         self.fans = fans
         self.report = report
-        self._stack = None  # type: Optional[ExitStack]
+        # A stack per fan, so a single fan could be swapped by `update`.
+        self._fan_stacks = None  # type: Optional[Dict[FanName, ExitStack]]
 
         # Set of fans marked as failing (which speed is 0)
         self._failed_fans = set()  # type: MutableSet[FanName]
@@ -26,47 +32,125 @@ class Fans:
         return fan_name in self._stopped_fans
 
     def __enter__(self):  # reusable
-        self._stack = ExitStack()
+        self._fan_stacks = OrderedDict()
         logger.info("Enabling PWM on fans...")
         try:
-            for pwmfan in self.fans.values():
-                self._stack.enter_context(pwmfan)
+            for name, pwmfan in self.fans.items():
+                self._enter_fan(name, pwmfan)
         except Exception:
-            self._stack.close()
+            self._exit_fans(list(self._fan_stacks))
             raise
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        assert self._stack is not None
+        assert self._fan_stacks is not None
         logger.info("Disabling PWM on fans...")
-        self._stack.close()
+        self._exit_fans(list(self._fan_stacks))
         logger.info("Done. Fans should be returned to full speed")
         return None
 
+    def update(self, fans: Mapping[FanName, PWMFanNorm]) -> None:
+        """Swap in the fans of a reloaded config.
+
+        The unchanged fans are kept under control, and the already
+        connected Arduino boards are not reconnected. When a new fan
+        cannot be entered, the current fans are restored and
+        the exception is raised.
+        """
+        assert self._fan_stacks is not None
+        connections = arduino_connections_from_pwmfan_norms(self.fans.values())
+        reuse_arduino_connections(fans.values(), connections)
+        kept = {name for name, fan in fans.items() if self.fans.get(name) == fan}
+        added = [name for name in fans if name not in kept]
+        # A changed fan most likely drives the same device, so the old one
+        # is exited before the new one is entered. The removed fans are
+        # exited only when all of the new ones have been entered.
+        replaced = [name for name in self.fans if name not in kept and name in fans]
+        removed = [name for name in self.fans if name not in fans]
+        with ExitStack() as stack:
+            # Don't let the boards disconnect while their fans are swapped.
+            for connection in connections:
+                stack.enter_context(connection)
+            if replaced:
+                logger.info("Disabling PWM on fans: %s", ", ".join(replaced))
+            self._exit_fans(replaced)
+            if added:
+                logger.info("Enabling PWM on fans: %s", ", ".join(added))
+            entered = []  # type: List[FanName]
+            try:
+                for name in added:
+                    self._enter_fan(name, fans[name])
+                    entered.append(name)
+            except Exception:
+                logger.warning("Restoring the fans: %s", ", ".join(replaced))
+                self._exit_fans(entered)
+                for name in replaced:
+                    try:
+                        self._enter_fan(name, self.fans[name])
+                    except Exception:
+                        logger.error(
+                            "Unable to restore the fan '%s'", name, exc_info=True
+                        )
+                raise
+            if removed:
+                logger.info("Disabling PWM on fans: %s", ", ".join(removed))
+            self._exit_fans(removed)
+            self.fans = {
+                name: self.fans[name] if name in kept else fan
+                for name, fan in fans.items()
+            }
+        self._failed_fans &= kept
+        self._stopped_fans &= kept
+
+    def _enter_fan(self, name: FanName, pwmfan: PWMFanNorm) -> None:
+        assert self._fan_stacks is not None
+        stack = ExitStack()
+        stack.enter_context(pwmfan)
+        self._fan_stacks[name] = stack
+
+    def _exit_fans(self, names: Iterable[FanName]) -> None:
+        assert self._fan_stacks is not None
+        # The fans are exited in the reverse order, and an exception
+        # doesn't prevent the rest of them from being exited.
+        with ExitStack() as stack:
+            for name in names:
+                stack.push(self._fan_stacks.pop(name))
+
     def check_speeds(self) -> None:
+        self._poll_arduino_statuses()
         for name, fan in self.fans.items():
             if name in self._stopped_fans:
                 continue
             try:
-                if fan.get_speed() <= 0:
-                    raise RuntimeError("Fan speed is 0")
+                # The instant speed allows to notice a jammed fan sooner.
+                speed = fan.get_speed_instant()
+                if fan.is_speed_stalled(speed):
+                    raise RuntimeError("Fan speed is %s" % speed)
             except Exception as e:
                 self._ensure_fan_is_failing(name, e)
             else:
                 self._ensure_fan_is_not_failing(name)
 
     def set_all_to_full_speed(self) -> None:
-        for name, fan in self.fans.items():
-            if name in self._failed_fans:
-                continue
-            try:
-                fan.set_full_speed()
-            except Exception as e:
-                logger.warning("Unable to set the fan '%s' to full speed:\n%s", name, e)
+        # Wait for the Arduino boards to confirm the full speed.
+        with self._batched_writes(confirm=True):
+            for name, fan in self.fans.items():
+                if name in self._failed_fans:
+                    continue
+                try:
+                    fan.set_full_speed()
+                except Exception as e:
+                    logger.warning(
+                        "Unable to set the fan '%s' to full speed:\n%s", name, e
+                    )
 
     def set_fan_speeds(self, speeds: Mapping[FanName, PWMValueNorm]) -> None:
         assert speeds.keys() == self.fans.keys()
         self._stopped_fans.clear()
+        with self._batched_writes():
+            self._set_fan_speeds(speeds)
+
+    def _set_fan_speeds(self, speeds: Mapping[FanName, PWMValueNorm]) -> None:
         for name, pwm_norm in speeds.items():
             fan = self.fans[name]
             assert 0.0 <= pwm_norm <= 1.0
@@ -87,6 +171,39 @@ class Fans:
                 if fan.is_pwm_stopped(pwm):
                     self._stopped_fans.add(name)
 
+    def _poll_arduino_statuses(self) -> None:
+        # Request the statuses from all boards at once, so the replies
+        # would be awaited concurrently by the `get_speed` calls below.
+        for connection in arduino_connections_from_pwmfan_norms(self.fans.values()):
+            try:
+                connection.poll_status()
+            except Exception as e:
+                logger.warning(
+                    "Unable to poll the status of the Arduino board '%s':\n%s",
+                    connection.name,
+                    e,
+                )
+
+    @contextmanager
+    def _batched_writes(self, *, confirm: bool = False) -> Iterator[None]:
+        # The fans connected to the same Arduino board are set with
+        # a single command instead of a separate command per each fan.
+        connections = arduino_connections_from_pwmfan_norms(self.fans.values())
+        for connection in connections:
+            connection.begin_batch()
+        try:
+            yield
+        finally:
+            for connection in connections:
+                try:
+                    connection.commit_batch(confirm=confirm)
+                except Exception as e:
+                    logger.warning(
+                        "Unable to set the fans speeds on the Arduino board '%s':\n%s",
+                        connection.name,
+                        e,
+                    )
+
     def _ensure_fan_is_failing(self, name: FanName, get_speed_exc: Exception) -> None:
         if name in self._failed_fans:
             return
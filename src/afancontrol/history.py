@@ -0,0 +1,157 @@
+import math
+import threading
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence
+
+from afancontrol.config import FanName, TempName
+
+if TYPE_CHECKING:
+    from afancontrol.metrics import _TickSnapshot  # noqa: F401
+
+NAN = float("nan")
+
+
+class History:
+    """A fixed-size ring buffer of the per-tick temperatures, fan speeds
+    and the panic/threshold modes.
+
+    All of the values are kept in a single pre-allocated flat array
+    of doubles (a row per `resolution` seconds, a column per value),
+    so the memory usage doesn't grow and no objects are created per
+    sample. Missing values are stored as NaN.
+
+    When several ticks fall into the same `resolution` period, the last
+    one wins.
+    """
+
+    def __init__(
+        self,
+        *,
+        duration: float,
+        resolution: float,
+        temp_names: Iterable[TempName],
+        fan_names: Iterable[FanName]
+    ) -> None:
+        if resolution <= 0:
+            raise ValueError("History resolution must be positive: %s" % resolution)
+        if duration < resolution:
+            raise ValueError(
+                "History duration (%s) must not be less than the resolution (%s)"
+                % (duration, resolution)
+            )
+        self.duration = duration
+        self.resolution = resolution
+        self.capacity = int(math.ceil(duration / resolution))
+
+        self.temp_names = sorted(temp_names)
+        self.fan_names = sorted(fan_names)
+        # Columns: is_panic, is_threshold, the temps, then rpm+pwm of the fans.
+        self._temp_columns = {
+            name: 2 + i for i, name in enumerate(self.temp_names)
+        }  # type: Dict[TempName, int]
+        fans_offset = 2 + len(self.temp_names)
+        self._fan_columns = {
+            name: fans_offset + 2 * i for i, name in enumerate(self.fan_names)
+        }  # type: Dict[FanName, int]
+        self._columns = fans_offset + 2 * len(self.fan_names)
+
+        self._lock = threading.Lock()
+        self._timestamps = array("d", [NAN]) * self.capacity
+        self._values = array("d", [NAN]) * (self.capacity * self._columns)
+        self._empty_row = array("d", [NAN]) * self._columns
+        self._next_row = 0
+        self._size = 0
+        self._last_period = None  # type: Optional[int]
+
+    @property
+    def size_bytes(self) -> int:
+        timestamps, values = self._timestamps, self._values
+        return timestamps.itemsize * len(timestamps) + values.itemsize * len(values)
+
+    def record(self, timestamp: float, snapshot: "_TickSnapshot") -> None:
+        period = int(timestamp // self.resolution)
+        with self._lock:
+            if period == self._last_period:
+                row = (self._next_row - 1) % self.capacity
+            else:
+                row = self._next_row
+                self._next_row = (row + 1) % self.capacity
+                self._size = min(self._size + 1, self.capacity)
+                self._last_period = period
+
+            self._timestamps[row] = timestamp
+            values = self._values
+            offset = row * self._columns
+            values[offset : offset + self._columns] = self._empty_row
+            values[offset] = snapshot.is_panic
+            values[offset + 1] = snapshot.is_threshold
+            for temp_name, temp_status in snapshot.temps:
+                column = self._temp_columns.get(temp_name)
+                if column is not None and temp_status is not None:
+                    values[offset + column] = temp_status.temp
+            for fan_name, fan_snapshot in snapshot.fans:
+                column = self._fan_columns.get(fan_name)
+                if column is not None:
+                    values[offset + column] = fan_snapshot.rpm
+                    values[offset + column + 1] = fan_snapshot.pwm
+
+    def query(
+        self,
+        *,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        names: Optional[Sequence[str]] = None
+    ) -> Dict[str, Any]:
+        """Return the samples within the [since; until] range as
+        a JSON-serializable dict, with the temps and the fans
+        optionally filtered by `names`. Missing values are `None`.
+        """
+        temp_names = self.temp_names
+        fan_names = self.fan_names
+        if names is not None:
+            temp_names = [name for name in temp_names if name in names]
+            fan_names = [name for name in fan_names if name in names]
+
+        with self._lock:
+            rows = self._rows(since, until)
+            values = self._values
+            columns = self._columns
+
+            def column(index: int) -> List[Optional[float]]:
+                return [_nan_to_none(values[row * columns + index]) for row in rows]
+
+            return {
+                "resolution": self.resolution,
+                "timestamps": [self._timestamps[row] for row in rows],
+                "is_panic": column(0),
+                "is_threshold": column(1),
+                "temps": {
+                    name: column(self._temp_columns[name]) for name in temp_names
+                },
+                "fans": {
+                    name: {
+                        "rpm": column(self._fan_columns[name]),
+                        "pwm": column(self._fan_columns[name] + 1),
+                    }
+                    for name in fan_names
+                },
+            }
+
+    def _rows(self, since: Optional[float], until: Optional[float]) -> List[int]:
+        oldest = (self._next_row - self._size) % self.capacity
+        rows = []
+        for i in range(self._size):
+            row = (oldest + i) % self.capacity
+            timestamp = self._timestamps[row]
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp > until:
+                break
+            rows.append(row)
+        return rows
+
+
+def _nan_to_none(value: float) -> Optional[float]:
+    if value != value:
+        return None
+    return value
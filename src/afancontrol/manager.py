@@ -9,12 +9,18 @@ from afancontrol.config import (
     TempName,
     TriggerConfig,
 )
+from afancontrol.dispatch import Dispatcher
 from afancontrol.fans import Fans
 from afancontrol.logger import logger
-from afancontrol.metrics import Metrics
+from afancontrol.metrics import Metrics, NullMetrics
 from afancontrol.pwmfan import PWMFanNorm, PWMValueNorm
 from afancontrol.report import Report
-from afancontrol.temp import Temp, TempStatus
+from afancontrol.temp import (
+    Temp,
+    TempStatus,
+    command_sources_from_temps,
+    reuse_command_sources,
+)
 from afancontrol.trigger import Triggers
 
 
@@ -27,22 +33,36 @@ class Manager:
         mappings: Mapping[MappingName, FansTempsRelation],
         report: Report,
         triggers_config: TriggerConfig,
-        metrics: Metrics
+        metrics: Metrics,
+        dispatcher: Optional[Dispatcher] = None
     ) -> None:
+        self.dispatcher = dispatcher
         self.report = report
         self.fans = Fans(fans, report=report)
         self.temps = temps
         self.mappings = mappings
-        self.triggers = Triggers(triggers_config, report)
+        self.triggers_config = triggers_config
+        self.triggers = Triggers(triggers_config, report, dispatcher=dispatcher)
         self.metrics = metrics
         self._stack = None  # type: Optional[ExitStack]
 
     def __enter__(self):  # reusable
         self._stack = ExitStack()
         try:
+            if self.dispatcher is not None:
+                # Exited last, so the commands submitted on exit
+                # are executed too.
+                self._stack.enter_context(self.dispatcher)
+            # The reports held for coalescing are sent on exit (after
+            # the ones of the fans and the triggers exits).
+            self._stack.push(lambda *exc_info: self.report.flush(force=True))
             self._stack.enter_context(self.fans)
-            self._stack.enter_context(self.triggers)
-            self._stack.enter_context(self.metrics)
+            # The triggers and the metrics might be swapped by `reload`,
+            # so the current ones are exited.
+            self.triggers.__enter__()
+            self._stack.push(lambda *exc_info: self.triggers.__exit__(*exc_info))
+            self.metrics.__enter__()
+            self._stack.push(lambda *exc_info: self.metrics.__exit__(*exc_info))
         except Exception:
             self._stack.close()
             raise
@@ -53,6 +73,70 @@ class Manager:
         self._stack.close()
         return None
 
+    def reload(
+        self,
+        *,
+        fans: Mapping[FanName, PWMFanNorm],
+        temps: Mapping[TempName, Temp],
+        mappings: Mapping[MappingName, FansTempsRelation],
+        report: Report,
+        triggers_config: TriggerConfig,
+        metrics: Metrics
+    ) -> None:
+        """Apply a reloaded config while running.
+
+        Only the changed objects are swapped: the unchanged fans stay
+        under control, the Arduino boards are not reconnected, and
+        the metrics server is kept when `metrics` is the current one.
+        The unchanged command sources are shared with the current temps.
+        The dispatcher is kept as well.
+
+        The fans are swapped first: when that fails, nothing is changed
+        and the exception is raised.
+        """
+        assert self._stack is not None
+        self.fans.update(fans)
+        old_report = self.report
+        self.report = report
+        self.fans.report = report
+        reuse_command_sources(
+            temps.values(), command_sources_from_temps(self.temps.values())
+        )
+        self.temps = {
+            name: self.temps[name] if self.temps.get(name) == temp else temp
+            for name, temp in temps.items()
+        }
+        self.mappings = mappings
+
+        if triggers_config != self.triggers_config:
+            # The leave commands of the current alerts are executed.
+            self.triggers.__exit__(None, None, None)
+            self.triggers_config = triggers_config
+            self.triggers = Triggers(
+                triggers_config,
+                report,
+                dispatcher=self.dispatcher,
+                command_stats=self.triggers.command_stats,
+            )
+            self.triggers.__enter__()
+        else:
+            self.triggers.panic_trigger.report = report
+            self.triggers.threshold_trigger.report = report
+
+        if metrics is not self.metrics:
+            self.metrics.__exit__(None, None, None)
+            self.metrics = metrics
+            try:
+                self.metrics.__enter__()
+            except Exception:
+                # Not worth stopping the fans control.
+                logger.warning("Unable to start the new metrics", exc_info=True)
+                self.metrics = NullMetrics()
+
+        if old_report is not report:
+            # Including the leave reports of the replaced triggers.
+            old_report.flush(force=True)
+
     def tick(self) -> None:
         with self.metrics.measure_tick():
             temps = self._get_temps()
@@ -66,12 +150,18 @@ class Manager:
                 speeds = self._map_temps_to_fan_speeds(temps)
                 self.fans.set_fan_speeds(speeds)
 
+            self.report.flush()
+
         try:
             self.metrics.tick(temps, self.fans, self.triggers)
         except Exception:
             logger.warning("Failed to collect metrics", exc_info=True)
 
     def _get_temps(self) -> Mapping[TempName, Optional[TempStatus]]:
+        # The shared commands are executed once per tick, by the first
+        # of their temps.
+        for source in command_sources_from_temps(self.temps.values()):
+            source.invalidate()
         result = {}
         for name, temp in self.temps.items():
             try:
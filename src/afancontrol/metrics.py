@@ -1,15 +1,41 @@
 import abc
+import asyncio
+import bisect
 import contextlib
+import gzip
+import http
+import importlib.util
+import json
+import os
+import re
+import socket
+import stat
 import threading
+import time
+import zlib
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from socketserver import ThreadingMixIn
 from timeit import default_timer
-from typing import TYPE_CHECKING, Mapping, Optional
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
 from urllib.parse import parse_qs, urlparse
 
-from afancontrol.arduino import arduino_connection_from_pwmfan_norm
-from afancontrol.config import TempName
+from afancontrol.arduino import ArduinoName, arduino_connection_from_pwmfan_norm
+from afancontrol.config import FanName, TempName
 from afancontrol.fans import Fans
+from afancontrol.history import History
 from afancontrol.logger import logger
 from afancontrol.temp import TempStatus
 from afancontrol.trigger import Triggers
@@ -17,12 +43,407 @@ from afancontrol.trigger import Triggers
 if TYPE_CHECKING:
     from typing import ContextManager  # Added in 3.6
 
-try:
-    import prometheus_client as prom
+# `prometheus_client` is imported by `PrometheusMetrics` only, so
+# the `BuiltinMetrics` don't pay for its import time and memory.
+prometheus_available = importlib.util.find_spec("prometheus_client") is not None
 
-    prometheus_available = True
-except ImportError:
-    prometheus_available = False
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# A thread per request (`http.server`), or all of the requests
+# in a single asyncio thread:
+EXPORTER_SERVER_THREADS = "threads"
+EXPORTER_SERVER_EVENT_LOOP = "event_loop"
+EXPORTER_SERVERS = (EXPORTER_SERVER_THREADS, EXPORTER_SERVER_EVENT_LOOP)
+# `exporter_listen_host = unix:/run/afancontrol.sock`
+UNIX_SOCKET_PREFIX = "unix:"
+
+UDP_PROTOCOL_STATSD = "statsd"
+UDP_PROTOCOL_INFLUX = "influx"
+UDP_PROTOCOLS = (UDP_PROTOCOL_STATSD, UDP_PROTOCOL_INFLUX)
+# Fits into a single Ethernet frame with a margin for the IP options.
+DEFAULT_MAX_DATAGRAM_SIZE = 1432
+
+INF = float("inf")
+NAN = float("nan")
+
+_FanSnapshot = NamedTuple(
+    "_FanSnapshot",
+    [
+        ("rpm", float),
+        ("pwm", float),
+        ("pwm_normalized", float),
+        ("pwm_line_start", float),
+        ("pwm_line_end", float),
+        ("is_stopped", bool),
+        ("is_failing", bool),
+    ],
+)
+
+_ArduinoSnapshot = NamedTuple(
+    "_ArduinoSnapshot",
+    [
+        ("is_connected", bool),
+        ("status_age_seconds", float),
+        ("reconnects", int),
+        ("failed_reconnects", int),
+        ("last_reconnect_duration_seconds", float),
+    ],
+)
+
+_DispatcherSnapshot = NamedTuple(
+    "_DispatcherSnapshot",
+    [
+        ("queue_depth", int),
+        ("queue_size", int),
+        ("executed", int),
+        ("failed", int),
+        ("dropped", int),
+    ],
+)
+
+# When the commands are executed synchronously (there's no dispatcher).
+_NO_DISPATCHER_SNAPSHOT = _DispatcherSnapshot(
+    queue_depth=0, queue_size=0, executed=0, failed=0, dropped=0
+)
+
+_ReportsSnapshot = NamedTuple(
+    "_ReportsSnapshot", [("sent", int), ("suppressed", int), ("coalesced", int)]
+)
+
+_NO_REPORTS_SNAPSHOT = _ReportsSnapshot(sent=0, suppressed=0, coalesced=0)
+
+_TriggerCommandsSnapshot = NamedTuple(
+    "_TriggerCommandsSnapshot",
+    [
+        ("executed", int),
+        ("failed", int),
+        ("duration_seconds", float),
+        ("max_duration_seconds", float),
+    ],
+)
+
+_NO_TRIGGER_COMMANDS_SNAPSHOT = _TriggerCommandsSnapshot(
+    executed=0, failed=0, duration_seconds=0.0, max_duration_seconds=0.0
+)
+
+# The state of a single tick, which is rendered on scrape.
+_TickSnapshot = NamedTuple(
+    "_TickSnapshot",
+    [
+        ("temps", Tuple[Tuple[TempName, Optional[TempStatus]], ...]),
+        ("fans", Tuple[Tuple[FanName, _FanSnapshot], ...]),
+        ("arduinos", Tuple[Tuple[ArduinoName, _ArduinoSnapshot], ...]),
+        ("is_panic", bool),
+        ("is_threshold", bool),
+        ("dispatcher", _DispatcherSnapshot),
+        ("reports", _ReportsSnapshot),
+        ("trigger_commands", _TriggerCommandsSnapshot),
+    ],
+)
+
+_EMPTY_TICK_SNAPSHOT = _TickSnapshot(
+    temps=(),
+    fans=(),
+    arduinos=(),
+    is_panic=False,
+    is_threshold=False,
+    dispatcher=_NO_DISPATCHER_SNAPSHOT,
+    reports=_NO_REPORTS_SNAPSHOT,
+    trigger_commands=_NO_TRIGGER_COMMANDS_SNAPSHOT,
+)
+
+_TEMPERATURE_IS_FAILING = (
+    "temperature_is_failing",
+    "The temperature sensor is failing (it isn't returning any data)",
+)
+
+# (metric name, help, `TempStatus` field)
+_TEMP_GAUGES = (
+    (
+        "temperature_current",
+        "The current temperature value (in Celsius) from a temperature sensor",
+        "temp",
+    ),
+    (
+        "temperature_min",
+        "The min temperature value (in Celsius) for a temperature sensor",
+        "min",
+    ),
+    (
+        "temperature_max",
+        "The max temperature value (in Celsius) for a temperature sensor",
+        "max",
+    ),
+    (
+        "temperature_panic",
+        "The panic temperature value (in Celsius) for a temperature sensor",
+        "panic",
+    ),
+    (
+        "temperature_threshold",
+        "The threshold temperature value (in Celsius) for a temperature sensor",
+        "threshold",
+    ),
+    (
+        "temperature_is_panic",
+        "Is panic temperature reached for a temperature sensor",
+        "is_panic",
+    ),
+    (
+        "temperature_is_threshold",
+        "Is threshold temperature reached for a temperature sensor",
+        "is_threshold",
+    ),
+)
+
+# (metric name, help, `_FanSnapshot` field)
+_FAN_GAUGES = (
+    ("fan_rpm", "Fan speed (in RPM) as reported by the fan", "rpm"),
+    ("fan_pwm", "Current fan's PWM value (from 0 to 255)", "pwm"),
+    (
+        "fan_pwm_normalized",
+        "Current fan's normalized PWM value (from 0.0 to 1.0, within "
+        "the `fan_pwm_line_start` and `fan_pwm_line_end` interval)",
+        "pwm_normalized",
+    ),
+    (
+        "fan_pwm_line_start",
+        "PWM value where a linear correlation with RPM starts for the fan",
+        "pwm_line_start",
+    ),
+    (
+        "fan_pwm_line_end",
+        "PWM value where a linear correlation with RPM ends for the fan",
+        "pwm_line_end",
+    ),
+    (
+        "fan_is_stopped",
+        "Is PWM fan stopped because the corresponding temperatures " "are already low",
+        "is_stopped",
+    ),
+    (
+        "fan_is_failing",
+        "Is PWM fan marked as failing (e.g. because it has jammed)",
+        "is_failing",
+    ),
+)
+
+# (metric name, help, `_ArduinoSnapshot` field)
+_ARDUINO_GAUGES = (
+    (
+        "arduino_is_connected",
+        "Is Arduino board connected via Serial",
+        "is_connected",
+    ),
+    (
+        "arduino_status_age_seconds",
+        "Seconds since the last `status` message from "
+        "the Arduino board (measured at the latest tick)",
+        "status_age_seconds",
+    ),
+    (
+        "arduino_reconnects",
+        "The number of times the lost Serial connection to "
+        "the Arduino board has been restored",
+        "reconnects",
+    ),
+    (
+        "arduino_failed_reconnects",
+        "The number of the failed attempts to reconnect to the Arduino board",
+        "failed_reconnects",
+    ),
+    (
+        "arduino_last_reconnect_duration_seconds",
+        "Seconds it took to restore the lost Serial connection to "
+        "the Arduino board the last time",
+        "last_reconnect_duration_seconds",
+    ),
+)
+
+# (metric name, help, `_DispatcherSnapshot` field)
+_DISPATCHER_GAUGES = (
+    (
+        "dispatch_queue_depth",
+        "The number of the report and trigger commands waiting to be executed",
+        "queue_depth",
+    ),
+    (
+        "dispatch_queue_size",
+        "The max number of the queued report and trigger commands "
+        "(0 means that they are executed synchronously within the tick)",
+        "queue_size",
+    ),
+    (
+        "dispatch_commands_executed",
+        "The number of the report and trigger commands executed in background",
+        "executed",
+    ),
+    (
+        "dispatch_commands_failed",
+        "The number of the report and trigger commands failed in background",
+        "failed",
+    ),
+    (
+        "dispatch_commands_dropped",
+        "The number of the report and trigger commands dropped because "
+        "the queue was full",
+        "dropped",
+    ),
+)
+
+# (metric name, help, `_ReportsSnapshot` field)
+_REPORTS_GAUGES = (
+    (
+        "reports_sent",
+        "The number of the report commands executed (a digest of "
+        "the coalesced reports counts as one)",
+        "sent",
+    ),
+    (
+        "reports_suppressed",
+        "The number of the reports suppressed by the rate limit " "of their reason",
+        "suppressed",
+    ),
+    (
+        "reports_coalesced",
+        "The number of the reports merged into the digests of other reports",
+        "coalesced",
+    ),
+)
+
+# (metric name, help, `_TriggerCommandsSnapshot` field)
+_TRIGGER_COMMANDS_GAUGES = (
+    (
+        "trigger_commands_executed",
+        "The number of the panic and threshold enter/leave commands executed",
+        "executed",
+    ),
+    (
+        "trigger_commands_failed",
+        "The number of the panic and threshold enter/leave commands failed",
+        "failed",
+    ),
+    (
+        "trigger_commands_duration_seconds",
+        "The total time spent executing the panic and threshold "
+        "enter/leave commands",
+        "duration_seconds",
+    ),
+    (
+        "trigger_commands_max_duration_seconds",
+        "The longest execution time of a panic or threshold enter/leave command",
+        "max_duration_seconds",
+    ),
+)
+
+
+IS_PANIC_HELP = "Is in panic mode"
+IS_THRESHOLD_HELP = "Is in threshold mode"
+LAST_METRICS_TICK_SECONDS_AGO_HELP = (
+    "The time in seconds since the last tick (which also updates these metrics)"
+)
+TICK_DURATION_HELP = "Duration of a single tick"
+TICK_DURATION_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0, INF)
+
+
+def _make_tick_snapshot(
+    temps: Mapping[TempName, Optional[TempStatus]], fans: Fans, triggers: Triggers
+) -> _TickSnapshot:
+    # The fans and the boards are read right away: the metrics must
+    # not touch the hardware outside of the tick. `TempStatus` is
+    # already immutable.
+    fan_snapshots = tuple(
+        (fan_name, _make_fan_snapshot(fans, fan_name, pwmfan_norm))
+        for fan_name, pwmfan_norm in fans.fans.items()
+    )
+
+    arduino_connections = {
+        arduino_connection.name: arduino_connection
+        for arduino_connection in (
+            arduino_connection_from_pwmfan_norm(pwmfan_norm)
+            for pwmfan_norm in fans.fans.values()
+        )
+        if arduino_connection is not None
+    }
+    arduino_snapshots = tuple(
+        (
+            arduino_name,
+            _ArduinoSnapshot(
+                is_connected=arduino_connection.is_connected,
+                status_age_seconds=arduino_connection.status_age_seconds,
+                reconnects=arduino_connection.reconnects,
+                failed_reconnects=arduino_connection.failed_reconnects,
+                last_reconnect_duration_seconds=(
+                    arduino_connection.last_reconnect_duration_seconds
+                ),
+            ),
+        )
+        for arduino_name, arduino_connection in arduino_connections.items()
+    )
+
+    command_stats = triggers.command_stats
+    dispatcher = triggers.dispatcher
+    if dispatcher is None:
+        dispatcher_snapshot = _NO_DISPATCHER_SNAPSHOT
+    else:
+        dispatcher_snapshot = _DispatcherSnapshot(
+            queue_depth=dispatcher.queue_depth,
+            queue_size=dispatcher.queue_size,
+            executed=dispatcher.executed,
+            failed=dispatcher.failed,
+            dropped=dispatcher.dropped,
+        )
+
+    return _TickSnapshot(
+        temps=tuple(temps.items()),
+        fans=fan_snapshots,
+        arduinos=arduino_snapshots,
+        is_panic=triggers.panic_trigger.is_alerting,
+        is_threshold=triggers.threshold_trigger.is_alerting,
+        dispatcher=dispatcher_snapshot,
+        reports=_ReportsSnapshot(
+            sent=fans.report.sent,
+            suppressed=fans.report.suppressed,
+            coalesced=fans.report.coalesced,
+        ),
+        trigger_commands=_TriggerCommandsSnapshot(
+            executed=command_stats.executed,
+            failed=command_stats.failed,
+            duration_seconds=command_stats.duration_seconds,
+            max_duration_seconds=command_stats.max_duration_seconds,
+        ),
+    )
+
+
+def _global_gauges(snapshot: _TickSnapshot) -> Iterator[Tuple[str, str, float]]:
+    # The unlabeled gauges: (metric name, help, value).
+    yield "is_panic", IS_PANIC_HELP, snapshot.is_panic
+    yield "is_threshold", IS_THRESHOLD_HELP, snapshot.is_threshold
+    for name, documentation, field in _DISPATCHER_GAUGES:
+        yield name, documentation, getattr(snapshot.dispatcher, field)
+    for name, documentation, field in _REPORTS_GAUGES:
+        yield name, documentation, getattr(snapshot.reports, field)
+    for name, documentation, field in _TRIGGER_COMMANDS_GAUGES:
+        yield name, documentation, getattr(snapshot.trigger_commands, field)
+
+
+def _make_fan_snapshot(fans, fan_name, pwm_fan_norm) -> _FanSnapshot:
+    try:
+        rpm = pwm_fan_norm.get_speed()
+        pwm = pwm_fan_norm.get_raw()
+        pwm_normalized = pwm_fan_norm.get()
+    except Exception:
+        logger.warning("Failed to collect metrics for fan %s", fan_name, exc_info=True)
+        rpm = pwm = pwm_normalized = NAN
+    return _FanSnapshot(
+        rpm=rpm,
+        pwm=pwm,
+        pwm_normalized=pwm_normalized,
+        pwm_line_start=pwm_fan_norm.pwm_line_start,
+        pwm_line_end=pwm_fan_norm.pwm_line_end,
+        is_stopped=fans.is_fan_stopped(fan_name),
+        is_failing=fans.is_fan_failing(fan_name),
+    )
 
 
 class Metrics(abc.ABC):
@@ -71,20 +492,139 @@ class NullMetrics(Metrics):
         return null_context_manager()
 
 
-class PrometheusMetrics(Metrics):
-    def __init__(self, listen_host: str) -> None:
+class _ExporterMetrics(Metrics):
+    """A `Metrics` serving the state of the last tick over HTTP."""
+
+    def __init__(
+        self,
+        listen_host: str,
+        *,
+        history: Optional[History] = None,
+        server: str = EXPORTER_SERVER_THREADS
+    ) -> None:
+        if server not in EXPORTER_SERVERS:
+            raise ValueError(
+                "Unsupported exporter server '%s'. Supported ones: %s"
+                % (server, ", ".join(EXPORTER_SERVERS))
+            )
+        self._server = server
+        self._unix_path = None  # type: Optional[str]
+        if listen_host.startswith(UNIX_SOCKET_PREFIX):
+            if server != EXPORTER_SERVER_EVENT_LOOP:
+                raise ValueError(
+                    "Listening on a Unix socket requires the `%s` exporter server"
+                    % EXPORTER_SERVER_EVENT_LOOP
+                )
+            self._unix_path = listen_host[len(UNIX_SOCKET_PREFIX) :]
+            self._listen_addr, self._listen_port = "", 0
+        else:
+            self._listen_addr, port_str = listen_host.rsplit(":", 1)
+            self._listen_port = int(port_str)
+
+        self.history = history
+
+        self._http_server = None  # type: Any
+
+        self._last_metrics_collect_clock = NAN
+
+        # Replaced as a whole on each tick and rendered on scrape,
+        # so a scrape never sees a half-updated tick.
+        self._tick_snapshot = _EMPTY_TICK_SNAPSHOT
+
+        self._exposition_cache = _ExpositionCache(self._render, self._render_live)
+
+    @abc.abstractmethod
+    def _render(self, names: Optional[Sequence[str]] = None) -> bytes:
+        """Render the exposition output (limited to the `names` metric
+        families when they're given), except for the `_render_live` part.
+        """
+
+    @abc.abstractmethod
+    def _render_live(self, names: Optional[Sequence[str]] = None) -> bytes:
+        """Render the metrics changing between the ticks (like the time
+        since the last tick), which are not cached.
+        """
+
+    @property
+    def last_metrics_tick_seconds_ago(self):
+        return self._clock() - self._last_metrics_collect_clock
+
+    def _start(self):
+        if self._server == EXPORTER_SERVER_EVENT_LOOP:
+            server = _EventLoopServer(
+                self._respond,
+                address=(
+                    None
+                    if self._unix_path is not None
+                    else (self._listen_addr, self._listen_port)
+                ),
+                unix_path=self._unix_path,
+            )
+            server.start()
+            return server
+
+        # `prometheus_client.start_http_server` which persists a server reference
+        # so it could be stopped later.
+        CustomMetricsHandler = MetricsHandler.factory(
+            self._exposition_cache, self.history
+        )
+        httpd = _ThreadingSimpleServer(
+            (self._listen_addr, self._listen_port), CustomMetricsHandler
+        )
+        t = threading.Thread(target=httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        return httpd
+
+    def _respond(self, path: str, accept_encoding: str) -> "_Response":
+        return _metrics_response(
+            self._exposition_cache, self.history, path, accept_encoding
+        )
+
+    def __enter__(self):
+        self._http_server = self._start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        assert self._http_server is not None
+        self._http_server.shutdown()  # stop serve_forever()
+        self._http_server.server_close()
+        self._http_server = None
+        return None
+
+    def tick(
+        self,
+        temps: Mapping[TempName, Optional[TempStatus]],
+        fans: Fans,
+        triggers: Triggers,
+    ) -> None:
+        self._tick_snapshot = _make_tick_snapshot(temps, fans, triggers)
+        if self.history is not None:
+            self.history.record(time.time(), self._tick_snapshot)
+
+        self._last_metrics_collect_clock = self._clock()
+        self._exposition_cache.invalidate()
+
+    def _clock(self):
+        return default_timer()
+
+
+class PrometheusMetrics(_ExporterMetrics):
+    def __init__(
+        self,
+        listen_host: str,
+        *,
+        history: Optional[History] = None,
+        server: str = EXPORTER_SERVER_THREADS
+    ) -> None:
         if not prometheus_available:
             raise RuntimeError(
                 "`prometheus_client` is not installed. "
                 "Run `pip install 'afancontrol[metrics]'`."
             )
+        import prometheus_client as prom
 
-        self._listen_addr, port_str = listen_host.rsplit(":", 1)
-        self._listen_port = int(port_str)
-
-        self._http_server = None  # type: Optional[HTTPServer]
-
-        self._last_metrics_collect_clock = float("nan")
+        super().__init__(listen_host, history=history, server=server)
 
         # Create a separate registry for this instance instead of using
         # the default one (which is global and doesn't allow to instantiate
@@ -99,256 +639,473 @@ class PrometheusMetrics(Metrics):
         if hasattr(prom, "GCCollector"):
             prom.GCCollector(registry=self.registry)
 
-        # Temps:
-        self.temperature_is_failing = prom.Gauge(
-            "temperature_is_failing",
-            "The temperature sensor is failing (it isn't returning any data)",
-            ["temp_name"],
-            registry=self.registry,
-        )
-        self.temperature_current = prom.Gauge(
-            "temperature_current",
-            "The current temperature value (in Celsius) from a temperature sensor",
-            ["temp_name"],
-            registry=self.registry,
-        )
-        self.temperature_min = prom.Gauge(
-            "temperature_min",
-            "The min temperature value (in Celsius) for a temperature sensor",
-            ["temp_name"],
-            registry=self.registry,
-        )
-        self.temperature_max = prom.Gauge(
-            "temperature_max",
-            "The max temperature value (in Celsius) for a temperature sensor",
-            ["temp_name"],
-            registry=self.registry,
-        )
-        self.temperature_panic = prom.Gauge(
-            "temperature_panic",
-            "The panic temperature value (in Celsius) for a temperature sensor",
-            ["temp_name"],
-            registry=self.registry,
-        )
-        self.temperature_threshold = prom.Gauge(
-            "temperature_threshold",
-            "The threshold temperature value (in Celsius) for a temperature sensor",
-            ["temp_name"],
-            registry=self.registry,
-        )
-        self.temperature_is_panic = prom.Gauge(
-            "temperature_is_panic",
-            "Is panic temperature reached for a temperature sensor",
-            ["temp_name"],
-            registry=self.registry,
-        )
-        self.temperature_is_threshold = prom.Gauge(
-            "temperature_is_threshold",
-            "Is threshold temperature reached for a temperature sensor",
-            ["temp_name"],
-            registry=self.registry,
-        )
-
-        # Fans:
-        self.fan_rpm = prom.Gauge(
-            "fan_rpm",
-            "Fan speed (in RPM) as reported by the fan",
-            ["fan_name"],
-            registry=self.registry,
-        )
-        self.fan_pwm = prom.Gauge(
-            "fan_pwm",
-            "Current fan's PWM value (from 0 to 255)",
-            ["fan_name"],
-            registry=self.registry,
-        )
-        self.fan_pwm_normalized = prom.Gauge(
-            "fan_pwm_normalized",
-            "Current fan's normalized PWM value (from 0.0 to 1.0, within "
-            "the `fan_pwm_line_start` and `fan_pwm_line_end` interval)",
-            ["fan_name"],
-            registry=self.registry,
-        )
-        self.fan_pwm_line_start = prom.Gauge(
-            "fan_pwm_line_start",
-            "PWM value where a linear correlation with RPM starts for the fan",
-            ["fan_name"],
-            registry=self.registry,
-        )
-        self.fan_pwm_line_end = prom.Gauge(
-            "fan_pwm_line_end",
-            "PWM value where a linear correlation with RPM ends for the fan",
-            ["fan_name"],
-            registry=self.registry,
-        )
-        self.fan_is_stopped = prom.Gauge(
-            "fan_is_stopped",
-            "Is PWM fan stopped because the corresponding temperatures "
-            "are already low",
-            ["fan_name"],
-            registry=self.registry,
-        )
-        self.fan_is_failing = prom.Gauge(
-            "fan_is_failing",
-            "Is PWM fan marked as failing (e.g. because it has jammed)",
-            ["fan_name"],
-            registry=self.registry,
-        )
-
-        # Arduino boards:
-        self.arduino_is_connected = prom.Gauge(
-            "arduino_is_connected",
-            "Is Arduino board connected via Serial",
-            ["arduino_name"],
-            registry=self.registry,
-        )
-        self.arduino_status_age_seconds = prom.Gauge(
-            "arduino_status_age_seconds",
-            "Seconds since the last `status` message from "
-            "the Arduino board (measured at the latest tick)",
-            ["arduino_name"],
-            registry=self.registry,
-        )
+        # Temps, fans, Arduino boards and the panic/threshold modes:
+        self.registry.register(_TickCollector(self))
 
         # Others:
-        self.is_panic = prom.Gauge(
-            "is_panic", "Is in panic mode", registry=self.registry
-        )
-        self.is_threshold = prom.Gauge(
-            "is_threshold", "Is in threshold mode", registry=self.registry
-        )
-
         self.tick_duration = prom.Histogram(
             # Summary would have been better there, but prometheus_client
             # doesn't yet support quantiles in Summaries.
             # See: https://github.com/prometheus/client_python/issues/92
             "tick_duration",
-            "Duration of a single tick",
-            buckets=(0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0, float("inf")),
+            TICK_DURATION_HELP,
+            buckets=TICK_DURATION_BUCKETS,
             registry=self.registry,
         )
+        # Rendered on each scrape, unlike the cached `registry`, so
+        # a stuck loop is noticed.
+        self.live_registry = prom.CollectorRegistry(auto_describe=True)
         last_metrics_tick_seconds_ago = prom.Gauge(
             "last_metrics_tick_seconds_ago",
-            "The time in seconds since the last tick (which also updates these metrics)",
-            registry=self.registry,
+            LAST_METRICS_TICK_SECONDS_AGO_HELP,
+            registry=self.live_registry,
         )
         last_metrics_tick_seconds_ago.set_function(
             lambda: self.last_metrics_tick_seconds_ago
         )
 
-    @property
-    def last_metrics_tick_seconds_ago(self):
-        return self._clock() - self._last_metrics_collect_clock
+    @contextlib.contextmanager
+    def measure_tick(self):
+        try:
+            with self.tick_duration.time():
+                yield
+        finally:
+            self._exposition_cache.invalidate()
 
-    def _start(self):
-        # `prometheus_client.start_http_server` which persists a server reference
-        # so it could be stopped later.
-        CustomMetricsHandler = MetricsHandler.factory(self.registry)
-        httpd = _ThreadingSimpleServer(
-            (self._listen_addr, self._listen_port), CustomMetricsHandler
+    def _render(self, names: Optional[Sequence[str]] = None) -> bytes:
+        from prometheus_client.exposition import generate_latest
+
+        if names is None:
+            return generate_latest(self.registry)
+        return generate_latest(self.registry.restricted_registry(names))
+
+    def _render_live(self, names: Optional[Sequence[str]] = None) -> bytes:
+        from prometheus_client.exposition import generate_latest
+
+        if names is None:
+            return generate_latest(self.live_registry)
+        return generate_latest(self.live_registry.restricted_registry(names))
+
+
+class _TickCollector:
+    """Renders the last `_TickSnapshot` of `PrometheusMetrics` on scrape."""
+
+    def __init__(self, metrics: PrometheusMetrics) -> None:
+        self._metrics = metrics
+
+    def describe(self):
+        return self._metric_families(_EMPTY_TICK_SNAPSHOT)
+
+    def collect(self):
+        return self._metric_families(self._metrics._tick_snapshot)
+
+    def _metric_families(self, snapshot: _TickSnapshot):
+        from prometheus_client.core import GaugeMetricFamily
+
+        families = []
+
+        name, documentation = _TEMPERATURE_IS_FAILING
+        temperature_is_failing = GaugeMetricFamily(
+            name, documentation, labels=["temp_name"]
         )
-        t = threading.Thread(target=httpd.serve_forever)
-        t.daemon = True
-        t.start()
-        return httpd
+        for temp_name, temp_status in snapshot.temps:
+            temperature_is_failing.add_metric([temp_name], temp_status is None)
+        families.append(temperature_is_failing)
+
+        for name, documentation, field in _TEMP_GAUGES:
+            family = GaugeMetricFamily(name, documentation, labels=["temp_name"])
+            for temp_name, temp_status in snapshot.temps:
+                family.add_metric([temp_name], _temp_value(temp_status, field))
+            families.append(family)
+
+        for label, items, gauges in (
+            ("fan_name", snapshot.fans, _FAN_GAUGES),
+            ("arduino_name", snapshot.arduinos, _ARDUINO_GAUGES),
+        ):
+            for name, documentation, field in gauges:
+                family = GaugeMetricFamily(name, documentation, labels=[label])
+                for item_name, item_snapshot in items:
+                    family.add_metric([item_name], getattr(item_snapshot, field))
+                families.append(family)
+
+        for name, documentation, value in _global_gauges(snapshot):
+            families.append(GaugeMetricFamily(name, documentation, value=value))
+        return families
+
+
+class BuiltinMetrics(_ExporterMetrics):
+    """Exposes the same metrics as `PrometheusMetrics` without depending
+    on `prometheus_client`.
+
+    The text format is rendered straight from the `_TickSnapshot`.
+    The process, platform and GC metrics of `prometheus_client` are not
+    exposed: this is what makes it lighter.
+    """
+
+    def __init__(
+        self,
+        listen_host: str,
+        *,
+        history: Optional[History] = None,
+        server: str = EXPORTER_SERVER_THREADS
+    ) -> None:
+        super().__init__(listen_host, history=history, server=server)
+        # Per-bucket (non-cumulative) counts, sum and count. Replaced
+        # as a whole, like the `_tick_snapshot`.
+        self._tick_duration = (
+            (0,) * len(TICK_DURATION_BUCKETS),
+            0.0,
+            0,
+        )  # type: Tuple[Tuple[int, ...], float, int]
+
+    @contextlib.contextmanager
+    def measure_tick(self):
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self._observe_tick_duration(default_timer() - start)
+            self._exposition_cache.invalidate()
+
+    def _observe_tick_duration(self, duration: float) -> None:
+        buckets, total, count = self._tick_duration
+        bucket = bisect.bisect_left(TICK_DURATION_BUCKETS, duration)
+        self._tick_duration = (
+            buckets[:bucket] + (buckets[bucket] + 1,) + buckets[bucket + 1 :],
+            total + duration,
+            count + 1,
+        )
+
+    def _render(self, names: Optional[Sequence[str]] = None) -> bytes:
+        wanted = None if names is None else frozenset(names)
+        out = []  # type: List[str]
+        self._render_tick(out, wanted, self._tick_snapshot)
+        self._render_others(out, wanted)
+        return "".join(out).encode("utf-8")
+
+    def _render_tick(
+        self,
+        out: List[str],
+        wanted: Optional[AbstractSet[str]],
+        snapshot: _TickSnapshot,
+    ) -> None:
+        name, documentation = _TEMPERATURE_IS_FAILING
+        if _render_header(out, wanted, name, documentation):
+            for temp_name, temp_status in snapshot.temps:
+                out.append(
+                    '%s{temp_name="%s"} %s\n'
+                    % (name, _escape_label(temp_name), _float(temp_status is None))
+                )
+
+        for name, documentation, field in _TEMP_GAUGES:
+            if _render_header(out, wanted, name, documentation):
+                for temp_name, temp_status in snapshot.temps:
+                    out.append(
+                        '%s{temp_name="%s"} %s\n'
+                        % (
+                            name,
+                            _escape_label(temp_name),
+                            _float(_temp_value(temp_status, field)),
+                        )
+                    )
+
+        for label, items, gauges in (
+            ("fan_name", snapshot.fans, _FAN_GAUGES),
+            ("arduino_name", snapshot.arduinos, _ARDUINO_GAUGES),
+        ):
+            for name, documentation, field in gauges:
+                if _render_header(out, wanted, name, documentation):
+                    for item_name, item_snapshot in items:
+                        out.append(
+                            '%s{%s="%s"} %s\n'
+                            % (
+                                name,
+                                label,
+                                _escape_label(item_name),
+                                _float(getattr(item_snapshot, field)),
+                            )
+                        )
+
+        for name, documentation, value in _global_gauges(snapshot):
+            if _render_header(out, wanted, name, documentation):
+                out.append("%s %s\n" % (name, _float(value)))
+
+    def _render_others(
+        self, out: List[str], wanted: Optional[AbstractSet[str]]
+    ) -> None:
+        if _render_header(
+            out, wanted, "tick_duration", TICK_DURATION_HELP, "histogram"
+        ):
+            buckets, total, count = self._tick_duration
+            cumulative = 0
+            for le, bucket_count in zip(TICK_DURATION_BUCKETS, buckets):
+                cumulative += bucket_count
+                out.append(
+                    'tick_duration_bucket{le="%s"} %s\n'
+                    % (_float(le), _float(cumulative))
+                )
+            out.append("tick_duration_count %s\n" % _float(count))
+            out.append("tick_duration_sum %s\n" % _float(total))
+
+    def _render_live(self, names: Optional[Sequence[str]] = None) -> bytes:
+        wanted = None if names is None else frozenset(names)
+        out = []  # type: List[str]
+        name = "last_metrics_tick_seconds_ago"
+        if _render_header(out, wanted, name, LAST_METRICS_TICK_SECONDS_AGO_HELP):
+            out.append("%s %s\n" % (name, _float(self.last_metrics_tick_seconds_ago)))
+        return "".join(out).encode("utf-8")
+
+
+def _render_header(
+    out: List[str],
+    wanted: Optional[AbstractSet[str]],
+    name: str,
+    documentation: str,
+    type: str = "gauge",
+) -> bool:
+    if wanted is not None and name not in wanted:
+        return False
+    out.append(
+        "# HELP %s %s\n# TYPE %s %s\n" % (name, _escape_help(documentation), name, type)
+    )
+    return True
+
+
+def _temp_value(temp_status: Optional[TempStatus], field: str) -> float:
+    if temp_status is None:
+        return NAN
+    return none_to_nan(getattr(temp_status, field))
+
+
+def _float(value: float) -> str:
+    # Same as `prometheus_client.utils.floatToGoString` for the values
+    # exposed there.
+    value = float(value)
+    if value == INF:
+        return "+Inf"
+    if value == -INF:
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    return repr(value)
+
+
+def _escape_help(documentation: str) -> str:
+    return documentation.replace("\\", r"\\").replace("\n", r"\n")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+class UDPMetrics(Metrics):
+    """Pushes the metrics of each tick over UDP in the StatsD or
+    the InfluxDB line protocol format instead of serving them over HTTP.
+
+    The lines are packed into as few datagrams as `max_datagram_size`
+    allows. The socket is non-blocking and the send errors are only
+    logged, so an absent collector never slows the ticks down.
+    """
+
+    def __init__(
+        self,
+        push_host: str,
+        *,
+        protocol: str = UDP_PROTOCOL_STATSD,
+        prefix: str = "afancontrol",
+        max_datagram_size: int = DEFAULT_MAX_DATAGRAM_SIZE
+    ) -> None:
+        if protocol not in UDP_PROTOCOLS:
+            raise ValueError(
+                "Unsupported UDP metrics protocol '%s'. Supported ones: %s"
+                % (protocol, ", ".join(UDP_PROTOCOLS))
+            )
+        host, port_str = push_host.rsplit(":", 1)
+        self._host = host.strip("[]")
+        self._port = int(port_str)
+        self.protocol = protocol
+        self.prefix = prefix
+        self.max_datagram_size = max_datagram_size
+
+        self._socket = None  # type: Optional[socket.socket]
+        self._address = None  # type: Any
+        self._tick_duration = NAN
+
+        self.datagrams_sent = 0
+        self.send_errors = 0
 
     def __enter__(self):
-        self._http_server = self._start()
+        # Resolved once, so the ticks don't wait for DNS.
+        family, _, _, _, address = socket.getaddrinfo(
+            self._host, self._port, type=socket.SOCK_DGRAM
+        )[0]
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        self._socket = sock
+        self._address = address
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        assert self._http_server is not None
-        self._http_server.shutdown()  # stop serve_forever()
-        self._http_server.server_close()
-        self._http_server = None
+        assert self._socket is not None
+        self._socket.close()
+        self._socket = None
         return None
 
+    @contextlib.contextmanager
+    def measure_tick(self):
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self._tick_duration = default_timer() - start
+
     def tick(
         self,
         temps: Mapping[TempName, Optional[TempStatus]],
         fans: Fans,
         triggers: Triggers,
     ) -> None:
-        for temp_name, temp_status in temps.items():
-            if temp_status is None:
-                self.temperature_is_failing.labels(temp_name).set(1)
-                self.temperature_current.labels(temp_name).set(none_to_nan(None))
-                self.temperature_min.labels(temp_name).set(none_to_nan(None))
-                self.temperature_max.labels(temp_name).set(none_to_nan(None))
-                self.temperature_panic.labels(temp_name).set(none_to_nan(None))
-                self.temperature_threshold.labels(temp_name).set(none_to_nan(None))
-                self.temperature_is_panic.labels(temp_name).set(none_to_nan(None))
-                self.temperature_is_threshold.labels(temp_name).set(none_to_nan(None))
+        snapshot = _make_tick_snapshot(temps, fans, triggers)
+        if self.protocol == UDP_PROTOCOL_INFLUX:
+            lines = self._influx_lines(snapshot, time.time())
+        else:
+            lines = self._statsd_lines(snapshot)
+        self._send(_pack_datagrams(lines, self.max_datagram_size))
+
+    def _send(self, datagrams: Iterable[bytes]) -> None:
+        assert self._socket is not None
+        error = None  # type: Optional[OSError]
+        for datagram in datagrams:
+            try:
+                self._socket.sendto(datagram, self._address)
+            except OSError as e:
+                # Including `BlockingIOError` when the send buffer is full:
+                # the datagram is dropped, as UDP would have done anyway.
+                self.send_errors += 1
+                error = e
             else:
-                self.temperature_is_failing.labels(temp_name).set(0)
-                self.temperature_current.labels(temp_name).set(temp_status.temp)
-                self.temperature_min.labels(temp_name).set(temp_status.min)
-                self.temperature_max.labels(temp_name).set(temp_status.max)
-                self.temperature_panic.labels(temp_name).set(
-                    none_to_nan(temp_status.panic)
-                )
-                self.temperature_threshold.labels(temp_name).set(
-                    none_to_nan(temp_status.threshold)
-                )
-                self.temperature_is_panic.labels(temp_name).set(temp_status.is_panic)
-                self.temperature_is_threshold.labels(temp_name).set(
-                    temp_status.is_threshold
-                )
+                self.datagrams_sent += 1
+        if error is not None:
+            logger.warning(
+                "Failed to push metrics to %s:%s: %s", self._host, self._port, error
+            )
+
+    def _statsd_lines(self, snapshot: _TickSnapshot) -> Iterator[str]:
+        prefix = self.prefix
 
-        for fan_name, pwmfan_norm in fans.fans.items():
-            self._collect_fan_metrics(fans, fan_name, pwmfan_norm)
+        def gauge(name: str, value: float) -> Iterator[str]:
+            value = float(value)
+            if value != value:
+                return  # StatsD has no NaN, so the value is skipped.
+            if value < 0:
+                # A signed value would be applied as a delta.
+                yield "%s:0|g" % name
+            yield "%s:%s|g" % (name, _float(value))
 
-        arduino_connections = {
-            arduino_connection.name: arduino_connection
-            for arduino_connection in (
-                arduino_connection_from_pwmfan_norm(pwmfan_norm)
-                for pwmfan_norm in fans.fans.values()
+        is_failing_name, _ = _TEMPERATURE_IS_FAILING
+        for temp_name, temp_status in snapshot.temps:
+            key = "%s.%%s.%s" % (prefix, _statsd_name(temp_name))
+            yield from gauge(key % is_failing_name, temp_status is None)
+            for name, _, field in _TEMP_GAUGES:
+                yield from gauge(key % name, _temp_value(temp_status, field))
+
+        for items, gauges in (
+            (snapshot.fans, _FAN_GAUGES),
+            (snapshot.arduinos, _ARDUINO_GAUGES),
+        ):
+            for item_name, item_snapshot in items:
+                key = "%s.%%s.%s" % (prefix, _statsd_name(item_name))
+                for name, _, field in gauges:
+                    yield from gauge(key % name, getattr(item_snapshot, field))
+
+        for name, _, value in _global_gauges(snapshot):
+            yield from gauge("%s.%s" % (prefix, name), value)
+        if self._tick_duration == self._tick_duration:
+            yield "%s.tick_duration:%s|ms" % (
+                prefix,
+                _float(self._tick_duration * 1000),
             )
-            if arduino_connection is not None
-        }
-        for arduino_name, arduino_connection in arduino_connections.items():
-            self.arduino_is_connected.labels(arduino_name).set(
-                arduino_connection.is_connected
+
+    def _influx_lines(self, snapshot: _TickSnapshot, timestamp: float) -> Iterator[str]:
+        measurement = _influx_escape(self.prefix, ", ")
+        suffix = " %d" % (timestamp * 1e9)
+
+        def line(tags: str, fields: Iterable[Tuple[str, float]]) -> str:
+            # NaN is not supported by the line protocol, so it is skipped.
+            return "%s%s %s%s" % (
+                measurement,
+                tags,
+                ",".join(
+                    "%s=%s" % (name, _float(value))
+                    for name, value in fields
+                    if value == value
+                ),
+                suffix,
             )
-            self.arduino_status_age_seconds.labels(arduino_name).set(
-                arduino_connection.status_age_seconds
+
+        is_failing_name, _ = _TEMPERATURE_IS_FAILING
+        for temp_name, temp_status in snapshot.temps:
+            fields = [(is_failing_name, float(temp_status is None))]
+            fields.extend(
+                (name, _temp_value(temp_status, field))
+                for name, _, field in _TEMP_GAUGES
             )
+            yield line(",temp_name=%s" % _influx_escape(temp_name, ",= "), fields)
 
-        self.is_panic.set(triggers.panic_trigger.is_alerting)
-        self.is_threshold.set(triggers.threshold_trigger.is_alerting)
+        for label, items, gauges in (
+            ("fan_name", snapshot.fans, _FAN_GAUGES),
+            ("arduino_name", snapshot.arduinos, _ARDUINO_GAUGES),
+        ):
+            for item_name, item_snapshot in items:
+                yield line(
+                    ",%s=%s" % (label, _influx_escape(item_name, ",= ")),
+                    (
+                        (name, float(getattr(item_snapshot, field)))
+                        for name, _, field in gauges
+                    ),
+                )
 
-        self._last_metrics_collect_clock = self._clock()
+        fields = [(name, float(value)) for name, _, value in _global_gauges(snapshot)]
+        fields.append(("tick_duration", self._tick_duration))
+        yield line("", fields)
 
-    def measure_tick(self) -> "ContextManager[None]":
-        return self.tick_duration.time()
 
-    def _collect_fan_metrics(self, fans, fan_name, pwm_fan_norm):
-        self.fan_pwm_line_start.labels(fan_name).set(pwm_fan_norm.pwm_line_start)
-        self.fan_pwm_line_end.labels(fan_name).set(pwm_fan_norm.pwm_line_end)
-        self.fan_is_stopped.labels(fan_name).set(fans.is_fan_stopped(fan_name))
-        self.fan_is_failing.labels(fan_name).set(fans.is_fan_failing(fan_name))
-        try:
-            self.fan_rpm.labels(fan_name).set(pwm_fan_norm.get_speed())
-            self.fan_pwm.labels(fan_name).set(pwm_fan_norm.get_raw())
-            self.fan_pwm_normalized.labels(fan_name).set(pwm_fan_norm.get())
-        except Exception:
-            logger.warning(
-                "Failed to collect metrics for fan %s", fan_name, exc_info=True
-            )
-            self.fan_rpm.labels(fan_name).set(none_to_nan(None))
-            self.fan_pwm.labels(fan_name).set(none_to_nan(None))
-            self.fan_pwm_normalized.labels(fan_name).set(none_to_nan(None))
+def _pack_datagrams(lines: Iterable[str], max_size: int) -> Iterator[bytes]:
+    datagram = bytearray()
+    for line in lines:
+        encoded = line.encode("utf-8")
+        if datagram and len(datagram) + 1 + len(encoded) > max_size:
+            yield bytes(datagram)
+            datagram = bytearray()
+        if datagram:
+            datagram += b"\n"
+        datagram += encoded
+    if datagram:
+        yield bytes(datagram)
 
-    def _clock(self):
-        return default_timer()
+
+def _statsd_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_\-]", "_", name)
+
+
+def _influx_escape(value: str, chars: str) -> str:
+    value = value.replace("\\", "\\\\")
+    for char in chars:
+        value = value.replace(char, "\\" + char)
+    return value
 
 
 def none_to_nan(v: Optional[float]) -> float:
     if v is None:
-        return float("nan")
+        return NAN
     return v
 
 
+_Response = NamedTuple(
+    "_Response", [("status", int), ("headers", List[Tuple[str, str]]), ("body", bytes)]
+)
+
+
 class _ThreadingSimpleServer(ThreadingMixIn, HTTPServer):
     """Thread per request HTTP server."""
 
@@ -362,38 +1119,351 @@ class _ThreadingSimpleServer(ThreadingMixIn, HTTPServer):
     daemon_threads = True
 
 
-# `MetricsHandler` of `prometheus_client==0.0.18` doesn't support exposing
-# a custom registry. This is backported below:
-if prometheus_available:
-    if hasattr(prom.MetricsHandler, "factory"):
-        MetricsHandler = prom.MetricsHandler
-    else:
-        from prometheus_client.exposition import generate_latest, CONTENT_TYPE_LATEST
+class _EventLoopServer:
+    """HTTP server handling all of the connections in a single thread
+    with an asyncio event loop, so the scrapes (and port scanners)
+    don't spawn a thread per request within the daemon.
+
+    Listens either on a TCP `address` or on a Unix domain socket
+    at `unix_path`. Only `GET` and `HEAD` are supported, and
+    the connection is closed after each response.
+
+    Mimics the `shutdown()` and `server_close()` of the `HTTPServer`.
+    """
+
+    request_timeout = 5.0
+    max_request_size = 16 * 1024
+
+    def __init__(
+        self,
+        respond: Callable[[str, str], _Response],
+        *,
+        address: Optional[Tuple[str, int]] = None,
+        unix_path: Optional[str] = None
+    ) -> None:
+        if (address is None) == (unix_path is None):
+            raise ValueError("Exactly one of `address` and `unix_path` is required")
+        self._respond = respond
+        self._address = address
+        self._unix_path = unix_path
+        self.server_address = None  # type: Any
+        self._loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def start(self) -> None:
+        started = threading.Event()
+        errors = []  # type: List[Exception]
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                server = loop.run_until_complete(self._start_server())
+            except Exception as e:
+                errors.append(e)
+                loop.close()
+                started.set()
+                return
+            self.server_address = server.sockets[0].getsockname()
+            self._loop = loop
+            started.set()
+            try:
+                loop.run_forever()
+            finally:
+                server.close()
+                loop.run_until_complete(server.wait_closed())
+                self._cancel_connections(loop)
+                # Let the closed transports release their sockets.
+                loop.run_until_complete(asyncio.sleep(0))
+                loop.close()
 
-        class MetricsHandler(BaseHTTPRequestHandler):  # type: ignore
-            # https://github.com/prometheus/client_python/blob/31f5557e2e84ca4ffa9a03abf6e3f4d0c8b8c3eb/prometheus_client/exposition.py#L141-L177  # noqa
-            registry = prom.REGISTRY
+        self._thread = threading.Thread(target=run, name="metrics-server")
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def shutdown(self) -> None:
+        assert self._loop is not None and self._thread is not None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+        self._thread = None
+
+    def server_close(self) -> None:
+        if self._unix_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._unix_path)
+
+    async def _start_server(self):
+        if self._unix_path is not None:
+            _remove_stale_unix_socket(self._unix_path)
+            return await asyncio.start_unix_server(
+                self._handle_connection,
+                path=self._unix_path,
+                limit=self.max_request_size,
+            )
+        assert self._address is not None
+        host, port = self._address
+        return await asyncio.start_server(
+            self._handle_connection,
+            host=host or None,
+            port=port,
+            limit=self.max_request_size,
+        )
+
+    @staticmethod
+    def _cancel_connections(loop: asyncio.AbstractEventLoop) -> None:
+        # `asyncio.all_tasks` has been added in Python 3.7, and
+        # `asyncio.Task.all_tasks` has been removed in 3.9.
+        all_tasks = getattr(asyncio, "all_tasks", None)
+        if all_tasks is None:
+            all_tasks = asyncio.Task.all_tasks  # type: ignore
+        tasks = list(all_tasks(loop))
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+    async def _handle_connection(self, reader, writer) -> None:
+        try:
+            try:
+                request = await asyncio.wait_for(
+                    reader.readuntil(b"\r\n\r\n"), self.request_timeout
+                )
+            except (
+                asyncio.TimeoutError,
+                asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError,
+                ConnectionError,
+            ):
+                # Not a complete HTTP request within the limits: drop it.
+                return
+            writer.write(self._process(request))
+            await asyncio.wait_for(writer.drain(), self.request_timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
 
-            def do_GET(self):
-                registry = self.registry
-                params = parse_qs(urlparse(self.path).query)
-                if "name[]" in params:
-                    registry = registry.restricted_registry(params["name[]"])
+    def _process(self, request: bytes) -> bytes:
+        lines = request.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return _encode_response(_error_response(400, "bad request"))
+        if method not in ("GET", "HEAD"):
+            return _encode_response(_error_response(405, "method not allowed"))
+        accept_encoding = ""
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "accept-encoding":
+                accept_encoding = value.strip()
+        try:
+            response = self._respond(path, accept_encoding)
+        except Exception:
+            logger.warning("Failed to generate the metrics output", exc_info=True)
+            response = _error_response(500, "error generating metric output")
+        return _encode_response(response, with_body=method != "HEAD")
+
+
+def _encode_response(response: _Response, *, with_body: bool = True) -> bytes:
+    status_line = "HTTP/1.1 %s %s" % (
+        response.status,
+        http.HTTPStatus(response.status).phrase,
+    )
+    headers = response.headers + [
+        ("Content-Length", str(len(response.body))),
+        ("Connection", "close"),
+    ]
+    head = "\r\n".join(
+        [status_line] + ["%s: %s" % (name, value) for name, value in headers]
+    )
+    return (head + "\r\n\r\n").encode("latin-1") + (response.body if with_body else b"")
+
+
+def _remove_stale_unix_socket(path: str) -> None:
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError("%s exists and is not a Unix socket" % path)
+    os.unlink(path)
+
+
+class _ExpositionCache:
+    """The exposition output, rendered at most once per tick.
+
+    All scrapers between two ticks are served the same bytes, so
+    several Prometheus servers (or a `watch curl ...`) don't re-render
+    the same text over and over competing for the GIL with the ticks.
+    The gzipped copy is compressed on the first request accepting it.
+
+    Only the small `render_live` part is rendered on each request
+    and appended to the cached one. The gzip compressor state is kept
+    after compressing the cached part, so the live part is compressed
+    into the same gzip stream.
+    """
+
+    def __init__(
+        self, render: Callable[..., bytes], render_live: Callable[..., bytes]
+    ) -> None:
+        self.render = render
+        self.render_live = render_live
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._cached_generation = -1
+        self._output = b""
+        self._output_gzip = None  # type: Optional[bytes]
+        self._compressor = None  # type: Any
+
+    def invalidate(self) -> None:
+        self._generation += 1
+
+    def get(self, *, gzipped: bool) -> bytes:
+        live = self.render_live()
+        with self._lock:
+            generation = self._generation
+            if self._cached_generation != generation:
+                self._output = self.render()
+                self._output_gzip = None
+                self._compressor = None
+                self._cached_generation = generation
+            if not gzipped:
+                return self._output + live
+            if self._compressor is None:
+                self._compressor = zlib.compressobj(
+                    9, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+                )
+                self._output_gzip = self._compressor.compress(self._output)
+            assert self._output_gzip is not None
+            compressor = self._compressor.copy()
+        return self._output_gzip + compressor.compress(live) + compressor.flush()
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    for coding in accept_encoding.split(","):
+        name, *params = coding.split(";")
+        if name.strip().lower() != "gzip":
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
                 try:
-                    output = generate_latest(registry)
-                except Exception:
-                    self.send_error(500, "error generating metric output")
-                    raise
-                self.send_response(200)
-                self.send_header("Content-Type", CONTENT_TYPE_LATEST)
-                self.end_headers()
-                self.wfile.write(output)
-
-            def log_message(self, format, *args):
-                """Log nothing."""
-
-            @classmethod
-            def factory(cls, registry):
-                cls_name = str(cls.__name__)
-                MyMetricsHandler = type(cls_name, (cls, object), {"registry": registry})
-                return MyMetricsHandler
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def _metrics_response(
+    exposition_cache: _ExpositionCache,
+    history: Optional[History],
+    path: str,
+    accept_encoding: str,
+) -> _Response:
+    """Build the response to a `GET path` request, regardless of
+    the server which has received it.
+    """
+    url = urlparse(path)
+    params = parse_qs(url.query)
+    gzipped = _accepts_gzip(accept_encoding)
+    if url.path.rstrip("/") == "/history":
+        if history is None:
+            return _error_response(404, "history is disabled")
+        try:
+            since, until = (
+                _parse_history_timestamp(params[key][0]) if key in params else None
+                for key in ("since", "until")
+            )
+        except ValueError as e:
+            return _error_response(400, str(e))
+        content_type = "application/json"
+        output = json.dumps(
+            history.query(since=since, until=until, names=params.get("name"))
+        ).encode("utf-8")
+        if gzipped:
+            output = gzip.compress(output)
+    else:
+        content_type = CONTENT_TYPE
+        if "name[]" in params:
+            # Filtered scrapes are rare, so they're not cached.
+            names = params["name[]"]
+            output = exposition_cache.render(names)
+            output += exposition_cache.render_live(names)
+            if gzipped:
+                output = gzip.compress(output)
+        else:
+            output = exposition_cache.get(gzipped=gzipped)
+    headers = [("Content-Type", content_type), ("Vary", "Accept-Encoding")]
+    if gzipped:
+        headers.append(("Content-Encoding", "gzip"))
+    return _Response(200, headers, output)
+
+
+def _error_response(status: int, message: str) -> _Response:
+    return _Response(
+        status,
+        [("Content-Type", "text/plain; charset=utf-8")],
+        message.encode("utf-8"),
+    )
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # Based on `prometheus_client.MetricsHandler`, but serves the output
+    # from the `_ExpositionCache`, supports gzip and doesn't depend on
+    # `prometheus_client`.
+    exposition_cache = None  # type: Optional[_ExpositionCache]
+    history = None  # type: Optional[History]
+
+    def do_GET(self):
+        exposition_cache = self.exposition_cache
+        assert exposition_cache is not None
+        try:
+            response = _metrics_response(
+                exposition_cache,
+                self.history,
+                self.path,
+                self.headers.get("Accept-Encoding", ""),
+            )
+        except Exception:
+            self.send_error(500, "error generating metric output")
+            raise
+        if response.status != 200:
+            self.send_error(response.status, response.body.decode("utf-8"))
+            return
+        self.send_response(200)
+        for name, value in response.headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def log_message(self, format, *args):
+        """Log nothing."""
+
+    @classmethod
+    def factory(
+        cls, exposition_cache: _ExpositionCache, history: Optional[History] = None
+    ):
+        cls_name = str(cls.__name__)
+        MyMetricsHandler = type(
+            cls_name,
+            (cls, object),
+            {"exposition_cache": exposition_cache, "history": history},
+        )
+        return MyMetricsHandler
+
+
+def _parse_history_timestamp(value: str) -> float:
+    """A unix timestamp, or the seconds before now when negative."""
+    try:
+        timestamp = float(value)
+    except ValueError:
+        raise ValueError("Invalid timestamp: %r" % value)
+    if timestamp < 0:
+        timestamp += time.time()
+    return timestamp
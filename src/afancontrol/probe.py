@@ -0,0 +1,173 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from timeit import default_timer
+from typing import Callable, List, NamedTuple, Sequence, Tuple
+
+import click
+
+from afancontrol.arduino import arduino_connections_from_pwmfan_norms
+from afancontrol.config import ParsedConfig
+from afancontrol.pwmfan import PWMFanNorm, PWMValueNorm
+from afancontrol.temp import SourceTemp, Temp
+
+DEFAULT_PROBE_REPEAT = 5
+# The devices are probed in parallel, but not with thousands of threads.
+MAX_PROBE_THREADS = 32
+
+ProbeResult = NamedTuple(
+    "ProbeResult",
+    [
+        ("kind", str),  # temp, fan or arduino
+        ("name", str),
+        ("timings", List[float]),  # seconds, of the successful reads only
+        ("errors", List[str]),
+    ],
+)
+
+
+def probe(parsed_config: ParsedConfig, *, repeat: int, set_pwm: bool) -> bool:
+    """Read every configured temp and fan `repeat` times, all of the
+    devices in parallel, and print the latencies and the tick duration
+    projected from them.
+
+    The PWM of the fans is not changed unless `set_pwm` is true, in which
+    case PWM is enabled and the fans are set to full speed (and returned
+    to the automatic control on exit).
+
+    Returns false when any of the devices has failed, or the projected
+    tick duration exceeds the `interval`.
+    """
+    fans = parsed_config.fans
+    temps = parsed_config.temps
+    click.echo(
+        "Probing %s temps and %s fans, %s reads each..."
+        % (len(temps), len(fans), repeat)
+    )
+
+    with ExitStack() as stack:
+        connections = arduino_connections_from_pwmfan_norms(fans.values())
+        for connection in connections:
+            stack.enter_context(connection)
+        # The boards must have sent their first status before the fans
+        # could be read.
+        boards = _probe_concurrently(
+            [
+                ("arduino", connection.name, connection.wait_for_status)
+                for connection in connections
+            ],
+            repeat=1,
+        )
+
+        if set_pwm:
+            for fan in fans.values():
+                stack.enter_context(fan)
+        devices = _probe_concurrently(
+            [("temp", name, _temp_reader(temp)) for name, temp in sorted(temps.items())]
+            + [
+                ("fan", name, _fan_reader(fan, set_pwm=set_pwm))
+                for name, fan in sorted(fans.items())
+            ],
+            repeat=repeat,
+        )
+
+    click.echo()
+    for result in boards + devices:
+        click.echo(_format_result(result))
+
+    # The tick reads the temps and the fans one after another.
+    projected_p50 = sum(_percentile(result.timings, 0.5) for result in devices)
+    projected_p95 = sum(_percentile(result.timings, 0.95) for result in devices)
+    interval = parsed_config.daemon.interval
+    click.echo()
+    click.echo(
+        "Projected tick duration: p50=%.1fms p95=%.1fms (interval is %ss)"
+        % (projected_p50 * 1000, projected_p95 * 1000, interval)
+    )
+
+    is_ok = True
+    failed = [result for result in boards + devices if result.errors]
+    if failed:
+        click.echo("%s device(s) have failed" % len(failed))
+        is_ok = False
+    if projected_p95 >= interval:
+        click.echo("The projected tick duration exceeds the interval")
+        is_ok = False
+    return is_ok
+
+
+def _temp_reader(temp: Temp) -> Callable[[], object]:
+    if not isinstance(temp, SourceTemp):
+        return temp.get
+
+    # The tick executes a shared command once for all of its temps, but
+    # here each read executes it, so the projection is pessimistic.
+    def read() -> object:
+        temp.source.invalidate()
+        return temp.get()
+
+    return read
+
+
+def _fan_reader(fan: PWMFanNorm, *, set_pwm: bool) -> Callable[[], None]:
+    # What the tick does with a fan.
+    def read() -> None:
+        fan.get_speed_instant()
+        fan.get_raw()
+        if set_pwm:
+            fan.set(PWMValueNorm(1.0))
+
+    return read
+
+
+def _probe_concurrently(
+    devices: Sequence[Tuple[str, str, Callable[[], object]]], *, repeat: int
+) -> List[ProbeResult]:
+    if not devices:
+        return []
+    with ThreadPoolExecutor(
+        max_workers=min(len(devices), MAX_PROBE_THREADS)
+    ) as executor:
+        return list(
+            executor.map(lambda device: _probe_device(*device, repeat=repeat), devices)
+        )
+
+
+def _probe_device(
+    kind: str, name: str, read: Callable[[], object], *, repeat: int
+) -> ProbeResult:
+    result = ProbeResult(kind=kind, name=name, timings=[], errors=[])
+    for _ in range(repeat):
+        start = default_timer()
+        try:
+            read()
+        except Exception as e:
+            result.errors.append("%s: %s" % (type(e).__name__, e))
+        else:
+            result.timings.append(default_timer() - start)
+    return result
+
+
+def _format_result(result: ProbeResult) -> str:
+    line = "%-8s %-20s" % (result.kind, result.name)
+    if result.timings:
+        line += " p50=%.1fms p95=%.1fms max=%.1fms" % (
+            _percentile(result.timings, 0.5) * 1000,
+            _percentile(result.timings, 0.95) * 1000,
+            max(result.timings) * 1000,
+        )
+    if result.errors:
+        line += " errors=%s/%s (last: %s)" % (
+            len(result.errors),
+            len(result.errors) + len(result.timings),
+            result.errors[-1],
+        )
+    return line
+
+
+def _percentile(timings: Sequence[float], q: float) -> float:
+    if not timings:
+        return 0.0
+    ordered = sorted(timings)
+    # The nearest-rank method.
+    return ordered[max(0, int(math.ceil(q * len(ordered))) - 1)]
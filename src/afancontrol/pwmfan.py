@@ -21,6 +21,11 @@ class BasePWMFan(abc.ABC):
     def is_pwm_stopped(pwm: PWMValue) -> bool:
         return pwm <= 0
 
+    @staticmethod
+    def is_speed_stalled(speed: FanValue) -> bool:
+        """Whether the `get_speed_instant` value means a stopped fan."""
+        return speed <= 0
+
     @abc.abstractmethod
     def get(self) -> PWMValue:
         pass
@@ -44,6 +49,10 @@ class BasePWMFan(abc.ABC):
     def get_speed(self) -> FanValue:
         pass
 
+    def get_speed_instant(self) -> FanValue:
+        """The current speed, without the smoothing done by `get_speed` (if any)."""
+        return self.get_speed()
+
     def __enter__(self):  # reusable
         """Enable PWM control for this fan"""
         self._enable_pwm()
@@ -183,12 +192,18 @@ class PWMFanNorm:
     def is_pwm_stopped(self, pwm: PWMValue) -> bool:
         return type(self.pwmfan).is_pwm_stopped(pwm)
 
+    def is_speed_stalled(self, speed: FanValue) -> bool:
+        return type(self.pwmfan).is_speed_stalled(speed)
+
     def set_full_speed(self) -> None:
         self.pwmfan.set_full_speed()
 
     def get_speed(self) -> FanValue:
         return self.pwmfan.get_speed()
 
+    def get_speed_instant(self) -> FanValue:
+        return self.pwmfan.get_speed_instant()
+
     def get_raw(self) -> PWMValue:
         return self.pwmfan.get()
 
@@ -1,17 +1,103 @@
+from timeit import default_timer
+from typing import Dict, List, Optional, Tuple
+
+from afancontrol.dispatch import Dispatcher, dispatch
 from afancontrol.exec import exec_shell_command
 from afancontrol.logger import logger
 
 
 class Report:
-    def __init__(self, report_command: str) -> None:
+    """Executes the `report_command` for the important events.
+
+    With a `coalesce_window`, the reports are held for that many seconds
+    and then sent as a single digest (see `flush`), unless they're
+    `urgent` (like the start of the panic mode), which are sent right
+    away. With a `rate_limit`, the reports with the same reason are sent
+    at most once per that many seconds (again, except for the `urgent`
+    ones): the suppressed ones are counted and mentioned in the next
+    report with that reason.
+    """
+
+    def __init__(
+        self,
+        report_command: str,
+        *,
+        dispatcher: Optional[Dispatcher] = None,
+        coalesce_window: float = 0,
+        rate_limit: float = 0
+    ) -> None:
         self._report_command = report_command
+        self.dispatcher = dispatcher
+        self.coalesce_window = coalesce_window
+        self.rate_limit = rate_limit
+
+        self._pending = []  # type: List[Tuple[str, str]]
+        self._pending_since = None  # type: Optional[float]
+        self._last_sent = {}  # type: Dict[str, float]
+        self._suppressed_reasons = {}  # type: Dict[str, int]
 
-    def report(self, reason: str, message: str) -> None:
+        self.sent = 0
+        self.suppressed = 0
+        self.coalesced = 0
+
+    def report(self, reason: str, message: str, *, urgent: bool = False) -> None:
         logger.info("[REPORT] Reason: %s. Message: %s", reason, message)
-        try:
-            rc = self._report_command
-            rc = rc.replace("%REASON%", reason)
-            rc = rc.replace("%MESSAGE%", message)
-            exec_shell_command(rc)
-        except Exception as ex:
-            logger.warning("Report failed: %s", ex, exc_info=True)
+        now = self._clock()
+        last_sent = self._last_sent.get(reason)
+        if not urgent and last_sent is not None and now - last_sent < self.rate_limit:
+            self.suppressed += 1
+            self._suppressed_reasons[reason] = (
+                self._suppressed_reasons.get(reason, 0) + 1
+            )
+            return
+        self._last_sent[reason] = now
+
+        suppressed = self._suppressed_reasons.pop(reason, 0)
+        if suppressed:
+            message += (
+                "\n\n(%s more report(s) with this reason have been suppressed "
+                "since the previous one)" % suppressed
+            )
+
+        if urgent or not self.coalesce_window:
+            self._send(reason, message)
+            return
+        if self._pending_since is None:
+            self._pending_since = now
+        self._pending.append((reason, message))
+
+    def flush(self, *, force: bool = False) -> None:
+        """Send the reports held for the `coalesce_window` (or all
+        of the held ones when `force` is true).
+
+        Expected to be called on every tick.
+        """
+        if not self._pending:
+            return
+        assert self._pending_since is not None
+        if not force and self._clock() - self._pending_since < self.coalesce_window:
+            return
+
+        pending = self._pending
+        self._pending = []
+        self._pending_since = None
+        if len(pending) == 1:
+            self._send(*pending[0])
+            return
+
+        self.coalesced += len(pending) - 1
+        first_reason = pending[0][0]
+        self._send(
+            "%s (and %s more)" % (first_reason, len(pending) - 1),
+            "\n\n".join("[%s]\n%s" % (reason, message) for reason, message in pending),
+        )
+
+    def _send(self, reason: str, message: str) -> None:
+        self.sent += 1
+        rc = self._report_command
+        rc = rc.replace("%REASON%", reason)
+        rc = rc.replace("%MESSAGE%", message)
+        dispatch(self.dispatcher, "Report", lambda: exec_shell_command(rc))
+
+    def _clock(self) -> float:
+        return default_timer()
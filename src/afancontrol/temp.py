@@ -1,11 +1,22 @@
 import abc
+import csv
+import io
+import json
 import re
+import threading
 from pathlib import Path
-from typing import NamedTuple, NewType, Optional, Tuple
+from timeit import default_timer
+from typing import Any, Iterable, List, NamedTuple, NewType, Optional, Tuple
 
 from afancontrol.exec import exec_shell_command
 
 TempCelsius = NewType("TempCelsius", float)
+SourceName = NewType("SourceName", str)
+
+SOURCE_FORMATS = ("lines", "csv", "json")
+DEFAULT_SOURCE_FORMAT = "lines"
+# 0 executes the command once per tick.
+DEFAULT_SOURCE_POLL_INTERVAL = 0
 
 TempStatus = NamedTuple(
     "TempStatus",
@@ -268,3 +279,211 @@ class CommandTemp(Temp):
             max_t = TempCelsius(temps[2])
 
         return temp, min_t, max_t
+
+
+class CommandSource:
+    """A shell command reporting many temperatures at once (like
+    `nvidia-smi` for all GPUs, or `sensors -j`), which is shared by
+    the `SourceTemp`s picking their values from its output.
+
+    The command is executed at most once per tick (see `invalidate`),
+    and, with a `poll_interval`, at most once per that many seconds
+    (counted from the end of the previous execution). Its failure is
+    cached for that long as well.
+
+    The `format` of the output and the `field` addressing a value in it:
+    - `lines`: the 0-based line number of the non-empty lines;
+    - `csv`: `row,column`, both 0-based, of the non-empty rows;
+    - `json`: the `/`-separated keys (or list indexes) of the nested
+      objects, e.g. `coretemp-isa-0000/Package id 0/temp1_input`.
+    """
+
+    def __init__(
+        self,
+        shell_command: str,
+        *,
+        format: str = DEFAULT_SOURCE_FORMAT,
+        poll_interval: float = DEFAULT_SOURCE_POLL_INTERVAL
+    ) -> None:
+        if format not in SOURCE_FORMATS:
+            raise ValueError(
+                "Unsupported source format '%s'. Supported ones: %s"
+                % (format, ", ".join(SOURCE_FORMATS))
+            )
+        self._shell_command = shell_command
+        self._format = format
+        self._poll_interval = poll_interval
+        # The temps might be read concurrently (see `probe`).
+        self._lock = threading.Lock()
+        self._polled_at = None  # type: Optional[float]
+        self._is_invalidated = True
+        self._output = None  # type: Any
+        self._error = None  # type: Optional[Exception]
+
+    def __eq__(self, other):
+        if isinstance(other, type(self)):
+            return (
+                self._shell_command == other._shell_command
+                and self._format == other._format
+                and self._poll_interval == other._poll_interval
+            )
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __repr__(self):
+        return "%s(%r, format=%r, poll_interval=%r)" % (
+            type(self).__name__,
+            self._shell_command,
+            self._format,
+            self._poll_interval,
+        )
+
+    def check_field(self, field: str) -> None:
+        if self._format == "lines":
+            valid = field.isdigit()
+        elif self._format == "csv":
+            row, sep, column = field.partition(",")
+            valid = bool(sep) and row.strip().isdigit() and column.strip().isdigit()
+        else:
+            valid = bool(field)
+        if not valid:
+            raise RuntimeError(
+                "Invalid field '%s' for the `%s` source format" % (field, self._format)
+            )
+
+    def invalidate(self) -> None:
+        """Allow the command to be executed again. Called once per tick."""
+        with self._lock:
+            self._is_invalidated = True
+
+    def get_value(self, field: str) -> TempCelsius:
+        output = self._poll()
+        try:
+            value = self._pick(output, field)
+            return TempCelsius(float(value))
+        except (LookupError, TypeError, ValueError) as e:
+            raise RuntimeError(
+                "Unable to get the field '%s' from the output of %s: %r"
+                % (field, self._shell_command, e)
+            )
+
+    def _poll(self) -> Any:
+        with self._lock:
+            if self._polled_at is None or (
+                self._is_invalidated
+                and self._clock() - self._polled_at >= self._poll_interval
+            ):
+                try:
+                    self._output = self._parse(exec_shell_command(self._shell_command))
+                    self._error = None
+                except Exception as e:
+                    self._output = None
+                    self._error = e
+                # A slow command is not considered stale right away.
+                self._polled_at = self._clock()
+                self._is_invalidated = False
+            if self._error is not None:
+                raise self._error
+            return self._output
+
+    def _parse(self, output: str) -> Any:
+        if self._format == "lines":
+            return [line.strip() for line in output.split("\n") if line.strip()]
+        if self._format == "csv":
+            return [
+                [cell.strip() for cell in row]
+                for row in csv.reader(io.StringIO(output))
+                if any(cell.strip() for cell in row)
+            ]
+        return json.loads(output)
+
+    def _pick(self, output: Any, field: str) -> Any:
+        if self._format == "lines":
+            return output[int(field)]
+        if self._format == "csv":
+            row, _, column = field.partition(",")
+            return output[int(row)][int(column)]
+        for key in field.split("/"):
+            output = output[int(key)] if isinstance(output, list) else output[key]
+        return output
+
+    def _clock(self) -> float:
+        return default_timer()
+
+
+def command_sources_from_temps(temps: Iterable[Temp]) -> List[CommandSource]:
+    # Used in manager
+    sources = []  # type: List[CommandSource]
+    for temp in temps:
+        if isinstance(temp, SourceTemp) and all(
+            source is not temp.source for source in sources
+        ):
+            sources.append(temp.source)
+    return sources
+
+
+def reuse_command_sources(
+    temps: Iterable[Temp], sources: Iterable[CommandSource]
+) -> None:
+    # Used in manager on a config reload: the kept temps and the changed
+    # ones of the same source share a single command execution per tick.
+    sources = list(sources)
+    for temp in temps:
+        if isinstance(temp, SourceTemp) and temp._source in sources:
+            temp._source = sources[sources.index(temp._source)]
+
+
+class SourceTemp(Temp):
+    def __init__(
+        self,
+        source: CommandSource,
+        field: str,
+        *,
+        min: TempCelsius,
+        max: TempCelsius,
+        panic: Optional[TempCelsius],
+        threshold: Optional[TempCelsius]
+    ) -> None:
+        super().__init__(panic=panic, threshold=threshold)
+        source.check_field(field)
+        self._source = source
+        self._field = field
+        self._min = min
+        self._max = max
+
+    def __eq__(self, other):
+        if isinstance(other, type(self)):
+            return (
+                self._source == other._source
+                and self._field == other._field
+                and self._min == other._min
+                and self._max == other._max
+                and self._panic == other._panic
+                and self._threshold == other._threshold
+            )
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __repr__(self):
+        return "%s(%r, %r, min=%r, max=%r, panic=%r, threshold=%r)" % (
+            type(self).__name__,
+            self._source,
+            self._field,
+            self._min,
+            self._max,
+            self._panic,
+            self._threshold,
+        )
+
+    @property
+    def source(self) -> CommandSource:
+        return self._source
+
+    def _get_temp(self) -> Tuple[TempCelsius, TempCelsius, TempCelsius]:
+        return self._source.get_value(self._field), self._min, self._max
@@ -1,25 +1,68 @@
 import abc
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import ExitStack
-from typing import Mapping, Optional, Set
+from timeit import default_timer
+from typing import List, Mapping, Optional, Sequence, Set
 
-from afancontrol.config import AlertCommands, TempName, TriggerConfig
+from afancontrol.config import (
+    DEFAULT_TRIGGER_COMMAND_PARALLELISM,
+    DEFAULT_TRIGGER_COMMAND_TIMEOUT,
+    AlertCommands,
+    TempName,
+    TriggerConfig,
+)
+from afancontrol.dispatch import Dispatcher, dispatch
 from afancontrol.exec import exec_shell_command
 from afancontrol.logger import logger
 from afancontrol.report import Report
 from afancontrol.temp import TempStatus
 
 
+class CommandStats:
+    """The counters of the executed trigger commands, shared by
+    the triggers and kept across the config reloads.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.failed = 0
+        self.duration_seconds = 0.0
+        self.max_duration_seconds = 0.0
+
+    def record(self, duration: float, *, is_failed: bool) -> None:
+        # Called concurrently by the commands being executed in parallel.
+        with self._lock:
+            self.executed += 1
+            self.failed += is_failed
+            self.duration_seconds += duration
+            self.max_duration_seconds = max(self.max_duration_seconds, duration)
+
+
 class Trigger(abc.ABC):
+    # Whether entering the mode is reported without waiting for
+    # the other reports to be coalesced with.
+    urgent_report = False
+
     def __init__(
         self,
         *,
         global_commands: AlertCommands,
         temp_commands: Mapping[TempName, AlertCommands],
-        report: Report
+        report: Report,
+        dispatcher: Optional[Dispatcher] = None,
+        command_parallelism: int = DEFAULT_TRIGGER_COMMAND_PARALLELISM,
+        command_timeout: int = DEFAULT_TRIGGER_COMMAND_TIMEOUT,
+        command_stats: Optional[CommandStats] = None
     ) -> None:
         self.global_commands = global_commands
         self.temp_commands = temp_commands
         self.report = report
+        self.dispatcher = dispatcher
+        self.command_parallelism = command_parallelism
+        self.command_timeout = command_timeout
+        self.command_stats = command_stats or CommandStats()
         self._alerting_temps = set()  # type: Set[TempName]
 
     @property
@@ -46,9 +89,10 @@ class Trigger(abc.ABC):
                 "Leaving %s MODE because of shutting down or restarting."
                 % self.trigger_name.upper(),
             )
-            for name in self._alerting_temps:
-                self._alert_cmd(self.temp_commands[name].leave_cmd)
-            self._alert_cmd(self.global_commands.leave_cmd)
+            self._alert_cmds(
+                [self.temp_commands[name].leave_cmd for name in self._alerting_temps],
+                self.global_commands.leave_cmd,
+            )
 
         self._alerting_temps.clear()
         return None
@@ -59,12 +103,16 @@ class Trigger(abc.ABC):
 
     def check(self, temps: Mapping[TempName, Optional[TempStatus]]) -> None:
         was_alerting = self.is_alerting
-        self._update_alerting_temps(temps)
-        self._process_global_alerting_commands(temps, was_alerting, self.is_alerting)
+        temp_cmds = self._update_alerting_temps(temps)
+        global_cmd = self._process_global_alerting_commands(
+            temps, was_alerting, self.is_alerting
+        )
+        self._alert_cmds(temp_cmds, global_cmd)
 
     def _update_alerting_temps(
         self, temps: Mapping[TempName, Optional[TempStatus]]
-    ) -> None:
+    ) -> List[Optional[str]]:
+        temp_cmds = []  # type: List[Optional[str]]
         stopped_alerting_temps = self._alerting_temps.copy()
         for name, status in temps.items():
             temp_alerting_reason = self._temp_alerting_reason(status)
@@ -84,7 +132,7 @@ class Trigger(abc.ABC):
                 status,
                 temp_alerting_reason,
             )
-            self._alert_cmd(self.temp_commands[name].enter_cmd)
+            temp_cmds.append(self.temp_commands[name].enter_cmd)
 
         for name in stopped_alerting_temps:
             self._alerting_temps.discard(name)
@@ -96,14 +144,15 @@ class Trigger(abc.ABC):
                 name,
                 status,
             )
-            self._alert_cmd(self.temp_commands[name].leave_cmd)
+            temp_cmds.append(self.temp_commands[name].leave_cmd)
+        return temp_cmds
 
     def _process_global_alerting_commands(
         self,
         temps: Mapping[TempName, Optional[TempStatus]],
         was_alerting: bool,
         is_alerting: bool,
-    ) -> None:
+    ) -> Optional[str]:
         is_entered = not was_alerting and is_alerting
         is_left = was_alerting and not is_alerting
         if is_entered or is_left:
@@ -116,36 +165,81 @@ class Trigger(abc.ABC):
                     "Entered %s MODE" % self.trigger_name.upper(),
                     "Entered %s MODE. Take a look as soon as possible!!!\nSensors:\n%s"
                     % (self.trigger_name.upper(), temps_debug),
+                    urgent=self.urgent_report,
                 )
-                self._alert_cmd(self.global_commands.enter_cmd)
+                return self.global_commands.enter_cmd
             if is_left:
                 self.report.report(
                     "Leaving %s MODE" % self.trigger_name.upper(),
                     "Leaving %s MODE.\nSensors:\n%s"
                     % (self.trigger_name.upper(), temps_debug),
                 )
-                self._alert_cmd(self.global_commands.leave_cmd)
+                return self.global_commands.leave_cmd
+        return None
 
     @abc.abstractmethod
     def _temp_alerting_reason(self, temp: Optional[TempStatus]) -> Optional[str]:
         pass
 
-    def _alert_cmd(self, shell_cmd):
-        if not shell_cmd:
+    def _alert_cmds(
+        self, temp_cmds: Sequence[Optional[str]], global_cmd: Optional[str]
+    ) -> None:
+        shell_cmds = [shell_cmd for shell_cmd in temp_cmds if shell_cmd]
+        if not shell_cmds and not global_cmd:
             return
+        dispatch(
+            self.dispatcher,
+            "%s trigger commands" % self.trigger_name.capitalize(),
+            lambda: self._exec_alert_cmds(shell_cmds, global_cmd),
+        )
+
+    def _exec_alert_cmds(self, temp_cmds: List[str], global_cmd: Optional[str]) -> None:
+        # The per-temp commands are independent from each other, so they
+        # are executed concurrently. The global one might depend on them
+        # (e.g. stop the services which the per-temp ones have notified),
+        # so it is executed after all of them.
+        if len(temp_cmds) > 1 and self.command_parallelism > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(len(temp_cmds), self.command_parallelism)
+            ) as executor:
+                results = list(executor.map(self._exec_alert_cmd, temp_cmds))
+        else:
+            results = [self._exec_alert_cmd(shell_cmd) for shell_cmd in temp_cmds]
+        if global_cmd:
+            results.append(self._exec_alert_cmd(global_cmd))
+
+        failed = results.count(False)
+        if failed:
+            raise RuntimeError("%s of %s commands have failed" % (failed, len(results)))
+
+    def _exec_alert_cmd(self, shell_cmd: str) -> bool:
+        start = default_timer()
         try:
-            exec_shell_command(shell_cmd)
+            exec_shell_command(shell_cmd, timeout=self.command_timeout)
         except Exception as e:
+            is_failed = True
             logger.warning(
-                "Enable to execute %s trigger command %s:\n%s",
+                "Unable to execute %s trigger command %s:\n%s",
                 self.trigger_name,
                 shell_cmd,
                 e,
             )
+        else:
+            is_failed = False
+        duration = default_timer() - start
+        self.command_stats.record(duration, is_failed=is_failed)
+        logger.info(
+            "%s trigger command %s took %.3fs",
+            self.trigger_name.capitalize(),
+            shell_cmd,
+            duration,
+        )
+        return not is_failed
 
 
 class PanicTrigger(Trigger):
     trigger_name = "panic"
+    urgent_report = True
 
     def _temp_alerting_reason(self, temp: Optional[TempStatus]) -> Optional[str]:
         if temp is None:
@@ -167,7 +261,16 @@ class ThresholdTrigger(Trigger):
 
 
 class Triggers:
-    def __init__(self, triggers_config: TriggerConfig, report: Report) -> None:
+    def __init__(
+        self,
+        triggers_config: TriggerConfig,
+        report: Report,
+        *,
+        dispatcher: Optional[Dispatcher] = None,
+        command_stats: Optional[CommandStats] = None
+    ) -> None:
+        self.dispatcher = dispatcher
+        self.command_stats = command_stats or CommandStats()
         self.panic_trigger = PanicTrigger(
             global_commands=triggers_config.global_commands.panic,
             temp_commands={
@@ -175,6 +278,10 @@ class Triggers:
                 for temp_name, actions in triggers_config.temp_commands.items()
             },
             report=report,
+            dispatcher=dispatcher,
+            command_parallelism=triggers_config.command_parallelism,
+            command_timeout=triggers_config.command_timeout,
+            command_stats=self.command_stats,
         )
         self.threshold_trigger = ThresholdTrigger(
             global_commands=triggers_config.global_commands.threshold,
@@ -183,6 +290,10 @@ class Triggers:
                 for temp_name, actions in triggers_config.temp_commands.items()
             },
             report=report,
+            dispatcher=dispatcher,
+            command_parallelism=triggers_config.command_parallelism,
+            command_timeout=triggers_config.command_timeout,
+            command_stats=self.command_stats,
         )
         self._stack = None  # type: Optional[ExitStack]
 
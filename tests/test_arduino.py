@@ -4,19 +4,36 @@ import threading
 import traceback
 from contextlib import ExitStack
 from time import sleep
-from typing import Dict
+from typing import Any, Dict, List, Optional
+from timeit import default_timer
+from unittest.mock import MagicMock, call, patch
 
 import pytest
 
 from afancontrol.arduino import (
+    PROTOCOL_VERSION,
+    AckCommand,
+    AckFrame,
     ArduinoConnection,
     ArduinoName,
     ArduinoPin,
     ArduinoPWMFan,
+    CapabilitiesFrame,
+    PollStatusCommand,
+    SetProtocolCommand,
+    SetPWMBatchCommand,
     SetPWMCommand,
+    SetStatusModeCommand,
+    StatusFrame,
+    _io_loop,
+    _SerialChannel,
+    _StatusProtocol,
     pyserial_available,
 )
-from afancontrol.pwmfan import PWMValue
+from afancontrol.config import FanName
+from afancontrol.fans import Fans
+from afancontrol.pwmfan import PWMFanNorm, PWMValue, PWMValueNorm
+from afancontrol.report import Report
 
 pytestmark = pytest.mark.skipif(
     not pyserial_available, reason="pyserial is not installed"
@@ -29,7 +46,7 @@ class DummyArduino:
     Slightly mimics the Arduino program `micro.ino`.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, *, supports_binary: bool = True) -> None:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.bind(("127.0.0.1", 0))
         s.listen(1)
@@ -44,6 +61,11 @@ class DummyArduino:
         self._is_connected = False
         self._inner_state_pwms = {"5": 255, "9": 255, "10": 255, "11": 255}
         self._inner_state_speeds = {"0": 0, "1": 0, "2": 0, "3": 0, "7": 0}
+        self._supports_binary = supports_binary
+        self._protocol_version = 0
+        self._status_streaming = True
+        self._status_requested = False
+        self.received_commands = []  # type: List[Any]
 
     def set_inner_state_pwms(self, pwms: Dict[str, int]) -> None:
         with self._lock:
@@ -92,18 +114,25 @@ class DummyArduino:
                 # in the `micro.ino` program.
 
                 try:
-                    command_buffer.extend(sock.recv(1024))
+                    data = sock.recv(1024)
                 except socket.timeout:
                     pass
+                else:
+                    if not data:
+                        break  # The connection has been closed by the host
+                    command_buffer.extend(data)
 
-                while len(command_buffer) >= 3:
-                    command_raw = command_buffer[:3]
-                    del command_buffer[:3]
-                    command = SetPWMCommand.parse(command_raw)
-                    with self._lock:
-                        self._inner_state_pwms[str(command.pwm_pin)] = command.pwm
+                while True:
+                    command_raw = self._pop_command(command_buffer)
+                    if command_raw is None:
+                        break
+                    self._process_command(sock, command_raw)
 
-                sock.sendall(self._make_status())
+                with self._lock:
+                    send_status = self._status_streaming or self._status_requested
+                    self._status_requested = False
+                if send_status:
+                    sock.sendall(self._make_status())
 
                 self._loop_iteration_complete.set()
                 self._first_loop_iteration_complete.set()
@@ -120,8 +149,81 @@ class DummyArduino:
             sock.close()
             self._disconnected.set()
 
+    @staticmethod
+    def _pop_command(command_buffer: bytearray) -> Optional[bytes]:
+        if not command_buffer:
+            return None
+        marker = bytes(command_buffer[:1])
+        if marker == SetProtocolCommand.command:
+            command_len = 2
+        elif marker == SetStatusModeCommand.command:
+            command_len = 2
+        elif marker == PollStatusCommand.command:
+            command_len = 1
+        elif marker == AckCommand.command:
+            command_len = 2
+        elif marker == SetPWMBatchCommand.command:
+            if len(command_buffer) < 2:
+                return None
+            command_len = 2 + 2 * command_buffer[1]
+        else:
+            command_len = 3
+        if len(command_buffer) < command_len:
+            return None
+        command_raw = bytes(command_buffer[:command_len])
+        del command_buffer[:command_len]
+        return command_raw
+
+    def _process_command(self, sock, command_raw: bytes) -> None:
+        marker = command_raw[:1]
+        if marker == SetProtocolCommand.command:
+            if not self._supports_binary:
+                # Mimic an older firmware
+                sock.sendall(b'{"error": "Unknown command F2"}\n')
+                return
+            protocol_command = SetProtocolCommand.parse(command_raw)
+            with self._lock:
+                self._protocol_version = protocol_command.version
+        elif marker == SetStatusModeCommand.command:
+            status_mode_command = SetStatusModeCommand.parse(command_raw)
+            with self._lock:
+                self._status_streaming = status_mode_command.streaming
+                self._status_requested = True
+        elif marker == PollStatusCommand.command:
+            with self._lock:
+                self.received_commands.append(PollStatusCommand.parse(command_raw))
+                self._status_requested = True
+        elif marker == AckCommand.command:
+            ack_command = AckCommand.parse(command_raw)
+            with self._lock:
+                self.received_commands.append(ack_command)
+                version = self._protocol_version
+            sock.sendall(AckFrame(seq=ack_command.seq).to_bytes(version=version))
+        elif marker == SetPWMBatchCommand.command:
+            batch_command = SetPWMBatchCommand.parse(command_raw)
+            with self._lock:
+                self.received_commands.append(batch_command)
+                for pwm_pin, pwm in batch_command.pwms.items():
+                    self._inner_state_pwms[str(pwm_pin)] = pwm
+        else:
+            command = SetPWMCommand.parse(command_raw)
+            with self._lock:
+                self.received_commands.append(command)
+                self._inner_state_pwms[str(command.pwm_pin)] = command.pwm
+
     def _make_status(self):
         with self._lock:
+            if self._protocol_version >= 1:
+                return StatusFrame(
+                    fan_inputs={
+                        ArduinoPin(int(pin)): rpm
+                        for pin, rpm in self._inner_state_speeds.items()
+                    },
+                    fan_pwm={
+                        ArduinoPin(int(pin)): pwm
+                        for pin, pwm in self._inner_state_pwms.items()
+                    },
+                ).to_bytes()
             status = {
                 "fan_inputs": self._inner_state_speeds,
                 "fan_pwm": self._inner_state_pwms,
@@ -132,9 +234,9 @@ class DummyArduino:
         assert self._thread_error.is_set() is not True
 
 
-@pytest.fixture
-def dummy_arduino():
-    return DummyArduino()
+@pytest.fixture(params=[True, False], ids=["binary", "json"])
+def dummy_arduino(request):
+    return DummyArduino(supports_binary=request.param)
 
 
 def test_smoke(dummy_arduino):
@@ -151,6 +253,9 @@ def test_smoke(dummy_arduino):
 
         dummy_arduino.set_speeds({"3": 1200})
         conn.wait_for_status()  # required only for synchronization in the tests
+        assert conn.protocol_version == (
+            PROTOCOL_VERSION if dummy_arduino._supports_binary else 0
+        )
         assert fan.get_speed() == 1200
         assert fan.get() == 255
         assert dummy_arduino.inner_state_pwms["9"] == 255
@@ -166,3 +271,357 @@ def test_smoke(dummy_arduino):
     assert dummy_arduino.inner_state_pwms["9"] == 255
     assert not dummy_arduino.is_connected
     dummy_arduino.ensure_no_errors_in_thread()
+
+
+def test_status_snapshot_unknown_pin(dummy_arduino):
+    conn = ArduinoConnection(ArduinoName("test"), dummy_arduino.pyserial_url)
+
+    with conn:
+        dummy_arduino.accept()
+        dummy_arduino.set_speeds({"3": 1200})
+        conn.wait_for_status()  # required only for synchronization in the tests
+
+        assert conn.get_rpm(ArduinoPin(3)) == 1200
+        with pytest.raises(RuntimeError):
+            conn.get_rpm(ArduinoPin(5))
+        with pytest.raises(RuntimeError):
+            conn.get_rpm(ArduinoPin(100))
+
+    dummy_arduino.wait_for_disconnected()
+    dummy_arduino.ensure_no_errors_in_thread()
+
+
+def test_fans_batch_pwm_commands(dummy_arduino):
+    conn = ArduinoConnection(ArduinoName("test"), dummy_arduino.pyserial_url)
+    fans = Fans(
+        {
+            FanName("fan1"): PWMFanNorm(
+                ArduinoPWMFan(conn, pwm_pin=ArduinoPin(9), tacho_pin=ArduinoPin(3)),
+                pwm_line_start=PWMValue(100),
+                pwm_line_end=PWMValue(240),
+            ),
+            FanName("fan2"): PWMFanNorm(
+                ArduinoPWMFan(conn, pwm_pin=ArduinoPin(10), tacho_pin=ArduinoPin(2)),
+                pwm_line_start=PWMValue(100),
+                pwm_line_end=PWMValue(240),
+            ),
+        },
+        report=MagicMock(spec=Report),
+    )
+
+    with fans:
+        dummy_arduino.accept()
+        assert dummy_arduino.is_connected
+        dummy_arduino.set_speeds({"2": 1000, "3": 1200})
+        conn.wait_for_status()  # required only for synchronization in the tests
+        dummy_arduino.received_commands.clear()
+
+        fans.set_fan_speeds(
+            {FanName("fan1"): PWMValueNorm(0.5), FanName("fan2"): PWMValueNorm(1.0)}
+        )
+        dummy_arduino.set_speeds({})  # wait for the commands to be processed
+        assert dummy_arduino.inner_state_pwms["9"] == 120
+        assert dummy_arduino.inner_state_pwms["10"] == 255
+        if dummy_arduino._supports_binary:
+            assert len(dummy_arduino.received_commands) == 1
+            assert dummy_arduino.received_commands[0].pwms == {9: 120, 10: 255}
+        else:
+            assert len(dummy_arduino.received_commands) == 2
+
+    dummy_arduino.ensure_no_errors_in_thread()
+
+
+def test_fans_full_speed_is_acknowledged(dummy_arduino):
+    conn = ArduinoConnection(ArduinoName("test"), dummy_arduino.pyserial_url)
+    fans = Fans(
+        {
+            FanName("fan1"): PWMFanNorm(
+                ArduinoPWMFan(conn, pwm_pin=ArduinoPin(9), tacho_pin=ArduinoPin(3)),
+                pwm_line_start=PWMValue(100),
+                pwm_line_end=PWMValue(240),
+            ),
+        },
+        report=MagicMock(spec=Report),
+    )
+
+    with fans:
+        dummy_arduino.accept()
+        assert dummy_arduino.is_connected
+        conn.wait_for_status()  # required only for synchronization in the tests
+        dummy_arduino.received_commands.clear()
+
+        fans.set_all_to_full_speed()
+        if dummy_arduino._supports_binary:
+            # The ack is received before `set_all_to_full_speed` returns.
+            assert [type(c) for c in dummy_arduino.received_commands] == [
+                SetPWMBatchCommand,
+                AckCommand,
+            ]
+        else:
+            dummy_arduino.set_speeds({})  # wait for the commands to be processed
+            assert [type(c) for c in dummy_arduino.received_commands] == [SetPWMCommand]
+        assert dummy_arduino.inner_state_pwms["9"] == 255
+
+    dummy_arduino.ensure_no_errors_in_thread()
+
+
+def test_poll_status_mode():
+    dummy_arduino = DummyArduino()
+    conn = ArduinoConnection(
+        ArduinoName("test"), dummy_arduino.pyserial_url, status_mode="poll"
+    )
+    fan = ArduinoPWMFan(conn, pwm_pin=ArduinoPin(9), tacho_pin=ArduinoPin(3))
+
+    with fan:
+        dummy_arduino.accept()
+        assert dummy_arduino.is_connected
+        dummy_arduino.set_speeds({"3": 1200})
+        conn.poll_status()
+        assert fan.get_speed() == 1200
+
+        statuses_received = conn.statuses_received
+        sleep(0.3)
+        # The board doesn't send any statuses unless they are requested:
+        assert conn.statuses_received == statuses_received
+
+        dummy_arduino.set_speeds({"3": 998})
+        conn.poll_status()
+        assert fan.get_speed() == 998
+        assert conn.statuses_received == statuses_received + 1
+
+    dummy_arduino.wait_for_disconnected()
+    assert dummy_arduino.inner_state_pwms["9"] == 255
+    dummy_arduino.ensure_no_errors_in_thread()
+
+
+def test_single_io_thread_for_all_boards():
+    def io_threads():
+        return [
+            thread
+            for thread in threading.enumerate()
+            if thread.name == "afancontrol-arduino-io"
+        ]
+
+    dummy_arduinos = [DummyArduino() for _ in range(3)]
+    fans = [
+        ArduinoPWMFan(
+            ArduinoConnection(ArduinoName("test%s" % i), dummy_arduino.pyserial_url),
+            pwm_pin=ArduinoPin(9),
+            tacho_pin=ArduinoPin(3),
+        )
+        for i, dummy_arduino in enumerate(dummy_arduinos)
+    ]
+    threads_before = threading.active_count()
+
+    with ExitStack() as stack:
+        for fan, dummy_arduino in zip(fans, dummy_arduinos):
+            stack.enter_context(fan)
+            dummy_arduino.accept()
+            assert dummy_arduino.is_connected
+
+        assert len(io_threads()) == 1
+        # A single I/O thread plus a thread per each dummy board:
+        assert threading.active_count() == threads_before + 1 + len(dummy_arduinos)
+
+        for i, (fan, dummy_arduino) in enumerate(zip(fans, dummy_arduinos)):
+            dummy_arduino.set_speeds({"3": 1000 + i})
+            fan._conn.wait_for_status()
+            assert fan.get_speed() == 1000 + i
+
+    for dummy_arduino in dummy_arduinos:
+        dummy_arduino.wait_for_disconnected()
+        assert dummy_arduino.inner_state_pwms["9"] == 255
+        dummy_arduino.ensure_no_errors_in_thread()
+
+    for thread in io_threads():
+        thread.join(5)
+    assert _io_loop.thread is None
+    assert not io_threads()
+
+
+def test_set_pwm_batch_command_roundtrip():
+    command = SetPWMBatchCommand(
+        pwms={ArduinoPin(9): PWMValue(42), ArduinoPin(5): PWMValue(0)}
+    )
+    b = command.to_bytes()
+    assert b == b"\xf3\x02\x09\x2a\x05\x00"
+    assert SetPWMBatchCommand.parse(b).pwms == command.pwms
+
+
+def test_ack_roundtrip():
+    command = AckCommand(seq=42)
+    assert AckCommand.parse(command.to_bytes()).seq == 42
+
+    frame = AckFrame(seq=255, errors=2)
+    conn = MagicMock(spec=ArduinoConnection)
+    protocol = _StatusProtocol(conn)
+    with patch.object(conn, "_incoming_frame") as mock_incoming_frame:
+        protocol.data_received(frame.to_bytes())
+    mock_incoming_frame.assert_called_once_with(
+        PROTOCOL_VERSION, AckFrame.frame_type, b"\xff\x02"
+    )
+    parsed = AckFrame.parse_payload(b"\xff\x02")
+    assert (parsed.seq, parsed.errors) == (255, 2)
+
+
+def test_status_frame_roundtrip():
+    frame = StatusFrame(
+        fan_inputs={ArduinoPin(0): 0, ArduinoPin(3): 1200, ArduinoPin(7): 65535},
+        fan_pwm={ArduinoPin(9): 42, ArduinoPin(11): 255},
+    )
+    b = frame.to_bytes(version=4)
+    assert b[:2] == b"\xa5\x5a"
+    assert len(b) == 2 + 3 + (1 + 3 * 3 + 1 + 2 * 2) + 2
+
+    parsed = StatusFrame.parse_payload(b[5:-2], version=4)
+    assert parsed.fan_inputs == frame.fan_inputs
+    assert parsed.fan_pwm == frame.fan_pwm
+    assert parsed.fan_inputs_instant == {}
+
+
+def test_status_frame_instant_rpm_roundtrip():
+    frame = StatusFrame(
+        fan_inputs={ArduinoPin(3): 1200, ArduinoPin(7): 900},
+        fan_pwm={ArduinoPin(9): 42},
+        fan_inputs_instant={ArduinoPin(3): 1180, ArduinoPin(7): 0},
+    )
+    b = frame.to_bytes(version=5)
+    assert len(b) == 2 + 3 + (1 + 2 * 3 + 1 + 1 * 2 + 1 + 2 * 3) + 2
+
+    parsed = StatusFrame.parse_payload(b[5:-2], version=5)
+    assert parsed.fan_inputs == frame.fan_inputs
+    assert parsed.fan_pwm == frame.fan_pwm
+    assert parsed.fan_inputs_instant == frame.fan_inputs_instant
+
+    with pytest.raises(ValueError):
+        StatusFrame.parse_payload(b[5:-2], version=4)
+
+
+def test_capabilities_frame_roundtrip():
+    frame = CapabilitiesFrame(
+        firmware_version=258,
+        max_batch_len=16,
+        pwm_pins=[ArduinoPin(5), ArduinoPin(9)],
+        tacho_pins=[ArduinoPin(0), ArduinoPin(2), ArduinoPin(3)],
+    )
+    b = frame.to_bytes()
+    assert len(b) == 2 + 3 + (2 + 1 + 1 + 2 + 1 + 3) + 2
+
+    parsed = CapabilitiesFrame.parse_payload(b[5:-2])
+    assert parsed.firmware_version == 258
+    assert parsed.max_batch_len == 16
+    assert parsed.pwm_pins == frame.pwm_pins
+    assert parsed.tacho_pins == frame.tacho_pins
+
+    with pytest.raises(ValueError):
+        CapabilitiesFrame.parse_payload(b[5:-3])
+    with pytest.raises(ValueError):
+        CapabilitiesFrame.parse_payload(b[5:-2] + b"\x00")
+
+
+def test_check_pins_waits_for_capabilities_after_json(caplog):
+    conn = ArduinoConnection(ArduinoName("test"), "loop://")
+    frame = CapabilitiesFrame(
+        firmware_version=1,
+        max_batch_len=16,
+        pwm_pins=[ArduinoPin(9)],
+        tacho_pins=[ArduinoPin(3)],
+    )
+    # A JSON status which was sent before the board has switched to frames.
+    conn._incoming_message({"fan_inputs": {"3": 1200}, "fan_pwm": {"9": 255}})
+    timer = threading.Timer(
+        0.1,
+        conn._incoming_frame,
+        args=(PROTOCOL_VERSION, CapabilitiesFrame.frame_type, frame.to_bytes()[5:-2]),
+    )
+    timer.start()
+    try:
+        with pytest.raises(ValueError, match="tacho pin 2"):
+            conn.check_pins(pwm_pin=ArduinoPin(9), tacho_pin=ArduinoPin(2))
+    finally:
+        timer.join()
+    conn.check_pins(pwm_pin=ArduinoPin(9), tacho_pin=ArduinoPin(3))
+    assert "not checked" not in caplog.text
+
+
+def test_check_pins_skipped_for_json_firmware(caplog):
+    conn = ArduinoConnection(ArduinoName("test"), "loop://")
+    conn._incoming_message({"fan_inputs": {"3": 1200}, "fan_pwm": {"9": 255}})
+    conn.check_pins(pwm_pin=ArduinoPin(9), tacho_pin=ArduinoPin(100))
+    assert "the tacho pin 100 are not checked" in caplog.text
+
+    # The handshake is not awaited again for the other fans of the board.
+    start = default_timer()
+    conn.check_pins(pwm_pin=ArduinoPin(10), tacho_pin=ArduinoPin(2))
+    assert default_timer() - start < 0.1
+
+
+def test_status_protocol_parses_mixed_stream():
+    conn = MagicMock(spec=ArduinoConnection)
+    protocol = _StatusProtocol(conn)
+    frame = StatusFrame(fan_inputs={ArduinoPin(3): 1200}, fan_pwm={ArduinoPin(9): 42})
+    frame_bytes = frame.to_bytes()
+    corrupted_frame_bytes = (
+        frame_bytes[:-3] + bytes([frame_bytes[-3] ^ 0xFF]) + frame_bytes[-2:]
+    )
+    stream = (
+        b'": 42}\n'  # a partial line received right after the connection is opened
+        + b'{"error": "Unknown command F2"}\n'
+        + corrupted_frame_bytes
+        + frame_bytes
+        + b'{"fan_inputs": {"3": 1100}, "fan_pwm": {"9": 40}}\n'
+        + frame_bytes
+    )
+
+    # Feed the stream byte by byte to ensure that the partial messages
+    # are handled correctly.
+    for i in range(len(stream)):
+        protocol.data_received(stream[i : i + 1])
+
+    assert conn._incoming_message.call_args_list == [
+        call({"error": "Unknown command F2"}),
+        call({"fan_inputs": {"3": 1100}, "fan_pwm": {"9": 40}}),
+    ]
+    assert conn._incoming_frame.call_args_list == [
+        call(PROTOCOL_VERSION, StatusFrame.frame_type, frame_bytes[5:-2]),
+        call(PROTOCOL_VERSION, StatusFrame.frame_type, frame_bytes[5:-2]),
+    ]
+
+
+def test_reconnect_backoff():
+    channel = _SerialChannel(MagicMock(), url="socket://127.0.0.1:1")
+    channel._schedule_reconnect()
+    assert channel._disconnected_at is not None
+    assert channel._reconnect_at is not None
+    assert channel._reconnect_at <= default_timer()
+
+    delays = []
+    for _ in range(10):
+        channel._reconnect()  # nothing listens on that port
+        reconnect_at = channel._reconnect_at
+        assert reconnect_at is not None
+        delays.append(reconnect_at - default_timer())
+
+    assert channel.failed_reconnects == 10
+    assert channel.reconnects == 0
+    assert 0.04 < delays[0] <= 0.1
+    assert 0.4 < delays[3] <= 0.8
+    assert 4.9 < delays[-1] <= 10.0
+
+
+def test_channel_without_fileno_is_polled():
+    # `loop://` has no fileno, so it cannot be watched by the selector.
+    protocol = MagicMock()
+    received = threading.Event()
+    protocol.data_received.side_effect = lambda data: received.set()
+    channel = _SerialChannel(lambda: protocol, url="loop://")
+    with channel:
+        channel.write(b"hello")
+        assert received.wait(5)
+        assert channel.is_open
+        thread = _io_loop.thread
+    assert protocol.data_received.call_args_list == [call(b"hello")]
+    protocol.connection_lost.assert_called_once_with(None)
+    assert thread is not None
+    thread.join(5)
+    assert _io_loop.thread is None
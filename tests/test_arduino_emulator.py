@@ -0,0 +1,247 @@
+from timeit import default_timer
+from unittest.mock import MagicMock
+
+import pytest
+
+from afancontrol.arduino import (
+    PROTOCOL_VERSION,
+    STATUS_MODE_POLL,
+    ArduinoConnection,
+    ArduinoName,
+    ArduinoPin,
+    ArduinoPWMFan,
+    arduino_connection_from_pwmfan_norm,
+    pyserial_available,
+)
+from afancontrol.arduino_emulator import ArduinoEmulator
+from afancontrol.config import FanName
+from afancontrol.fans import Fans
+from afancontrol.pwmfan import PWMFanNorm, PWMValue
+from afancontrol.report import Report
+
+pytestmark = pytest.mark.skipif(
+    not pyserial_available, reason="pyserial is not installed"
+)
+
+
+@pytest.mark.parametrize("protocol_version", [0, 1, 2, PROTOCOL_VERSION])
+def test_emulator_smoke(protocol_version):
+    with ArduinoEmulator(
+        status_interval=0.01, protocol_version=protocol_version
+    ) as emulator:
+        emulator.set_fan_inputs({3: 1200})
+        conn = ArduinoConnection(ArduinoName("test"), emulator.url)
+        with conn:
+            assert emulator.wait_for_connection(5) is True
+            conn.wait_for_status()
+            assert conn.protocol_version == protocol_version
+            assert conn.get_rpm(ArduinoPin(3)) == 1200
+            assert conn.get_pwm(ArduinoPin(9)) == 255
+
+            conn.set_pwms({ArduinoPin(9): PWMValue(100), ArduinoPin(5): PWMValue(50)})
+            conn.wait_for_status()
+            conn.wait_for_status()
+            assert conn.get_pwm(ArduinoPin(9)) == 100
+            assert emulator.fan_pwm[5] == 50
+
+
+def test_emulator_poll_mode():
+    with ArduinoEmulator(status_interval=0.01) as emulator:
+        conn = ArduinoConnection(
+            ArduinoName("test"), emulator.url, status_mode=STATUS_MODE_POLL
+        )
+        with conn:
+            conn.wait_for_status()
+            sent = emulator.statuses_sent
+            conn.wait_for_status()
+            assert emulator.statuses_sent == sent + 1
+
+
+def test_emulator_drops_and_corruption():
+    with ArduinoEmulator(
+        status_interval=0.005, drop_rate=0.3, corrupt_rate=0.3, seed=42
+    ) as emulator:
+        emulator.set_fan_inputs({7: 900})
+        conn = ArduinoConnection(ArduinoName("test"), emulator.url)
+        with conn:
+            while emulator.statuses_sent < 50:
+                conn.wait_for_status()
+            assert conn.get_rpm(ArduinoPin(7)) == 900
+
+    assert emulator.statuses_dropped > 0
+    assert emulator.statuses_corrupted > 0
+    assert conn.statuses_received < emulator.statuses_sent
+
+
+def test_emulator_accepts_reconnections():
+    with ArduinoEmulator(status_interval=0.01) as emulator:
+        for _ in range(2):
+            with ArduinoConnection(ArduinoName("test"), emulator.url) as conn:
+                conn.wait_for_status()
+        assert emulator.connections_accepted == 2
+
+
+def test_emulator_confirmed_pwm():
+    with ArduinoEmulator(status_interval=0.25) as emulator:
+        with ArduinoConnection(ArduinoName("test"), emulator.url) as conn:
+            conn.wait_for_status()
+            assert conn.supports_ack
+
+            conn.set_pwm(ArduinoPin(9), PWMValue(100), confirm=True)
+            # Confirmed without waiting for the next status.
+            assert emulator.fan_pwm[9] == 100
+
+            with pytest.raises(RuntimeError, match="rejected 1 command"):
+                conn.set_pwms(
+                    {ArduinoPin(9): PWMValue(110), ArduinoPin(4): PWMValue(120)},
+                    confirm=True,
+                )
+            assert emulator.fan_pwm[9] == 110
+
+
+def test_emulator_disconnect_is_detected_and_restored():
+    with ArduinoEmulator(status_interval=0.01) as emulator:
+        emulator.set_fan_inputs({3: 1200})
+        with ArduinoConnection(ArduinoName("test"), emulator.url) as conn:
+            conn.wait_for_status()
+            assert conn.is_connected
+
+            emulator.disconnect()
+            start = default_timer()
+            while conn.is_connected:
+                assert default_timer() - start < conn.status_ttl / 2
+            # The failure is reported without waiting for the `status_ttl`.
+            with pytest.raises(RuntimeError):
+                conn.get_rpm(ArduinoPin(3))
+
+            while not (conn.is_connected and emulator.connections_accepted == 2):
+                assert default_timer() - start < conn.status_ttl
+            assert conn.get_rpm(ArduinoPin(3)) == 1200
+            assert conn.reconnects == 1
+            assert conn.last_reconnect_duration_seconds > 0
+
+
+@pytest.mark.parametrize("protocol_version", [4, PROTOCOL_VERSION])
+def test_emulator_instant_rpm(protocol_version):
+    with ArduinoEmulator(
+        status_interval=0.01, protocol_version=protocol_version
+    ) as emulator:
+        emulator.set_fan_inputs({3: 1200})
+        emulator.set_fan_inputs_instant({3: 0})
+        with ArduinoConnection(ArduinoName("test"), emulator.url) as conn:
+            conn.wait_for_status()
+            assert conn.get_rpm(ArduinoPin(3)) == 1200
+            if protocol_version >= 5:
+                assert conn.get_rpm_instant(ArduinoPin(3)) == 0
+            else:
+                # The older firmware doesn't report it.
+                assert conn.get_rpm_instant(ArduinoPin(3)) == 1200
+
+
+def test_emulator_stalled_fan_is_detected_quickly():
+    report = MagicMock(spec=Report)
+    with ArduinoEmulator(status_interval=0.01) as emulator:
+        emulator.set_fan_inputs({3: 1200, 2: 1200})
+        # A slow fan is still reported as spinning.
+        emulator.set_fan_inputs_instant({2: 70})
+        conn = ArduinoConnection(ArduinoName("test"), emulator.url)
+        fans = Fans(
+            {
+                FanName(str(tacho_pin)): PWMFanNorm(
+                    ArduinoPWMFan(
+                        conn,
+                        pwm_pin=ArduinoPin(pwm_pin),
+                        tacho_pin=ArduinoPin(tacho_pin),
+                    ),
+                    pwm_line_start=PWMValue(100),
+                    pwm_line_end=PWMValue(240),
+                )
+                for pwm_pin, tacho_pin in ((9, 3), (10, 2))
+            },
+            report=report,
+        )
+        with fans:
+            fans.check_speeds()
+            assert fans._failed_fans == set()
+
+            emulator.stall_fan_inputs([3])
+            start = default_timer()
+            while not fans._failed_fans and default_timer() - start < 5:
+                fans.check_speeds()
+            # The smoothed RPM would have taken 1.5s to fall to 0.
+            assert default_timer() - start < 1.0
+            assert fans._failed_fans == {"3"}
+            assert conn.get_rpm(ArduinoPin(3)) == 1200
+
+
+def test_emulator_capabilities():
+    # Arduino Mega has way more pins than Arduino Micro.
+    pwm_pins = list(range(2, 14)) + [44, 45]
+    tacho_pins = [2, 3, 18, 19, 20, 21]
+    with ArduinoEmulator(
+        status_interval=0.01,
+        pwm_pins=pwm_pins,
+        tacho_pins=tacho_pins,
+        max_batch_len=8,
+    ) as emulator:
+        with ArduinoConnection(ArduinoName("mega"), emulator.url) as conn:
+            conn.wait_for_status()
+            assert conn.capabilities is not None
+            assert list(conn.capabilities.pwm_pins) == pwm_pins
+            assert list(conn.capabilities.tacho_pins) == tacho_pins
+            assert conn.capabilities.max_batch_len == 8
+
+            conn.check_pins(pwm_pin=ArduinoPin(45), tacho_pin=ArduinoPin(21))
+            with pytest.raises(ValueError, match="PWM pin 14"):
+                conn.check_pins(pwm_pin=ArduinoPin(14), tacho_pin=ArduinoPin(2))
+            with pytest.raises(ValueError, match="tacho pin 7"):
+                conn.check_pins(pwm_pin=ArduinoPin(9), tacho_pin=ArduinoPin(7))
+
+            fan = ArduinoPWMFan(conn, pwm_pin=ArduinoPin(14), tacho_pin=ArduinoPin(2))
+            with pytest.raises(ValueError):
+                fan.__enter__()
+
+            # 14 pins are sent in 2 batches of at most 8 pins.
+            received = emulator.commands_received
+            conn.set_pwms(
+                {ArduinoPin(pin): PWMValue(pin) for pin in pwm_pins}, confirm=True
+            )
+            assert emulator.commands_received == received + 3  # + ack
+            assert emulator.fan_pwm[45] == 45
+
+
+def test_emulator_old_firmware_pins_are_not_checked():
+    with ArduinoEmulator(status_interval=0.01, protocol_version=5) as emulator:
+        with ArduinoConnection(ArduinoName("test"), emulator.url) as conn:
+            conn.wait_for_status()
+            assert conn.capabilities is None
+            conn.check_pins(pwm_pin=ArduinoPin(100), tacho_pin=ArduinoPin(100))
+
+
+def test_emulator_connection_is_kept_on_fans_update():
+    report = MagicMock(spec=Report)
+
+    def make_fans(url, pwm_line_start):
+        conn = ArduinoConnection(ArduinoName("test"), url)
+        return {
+            FanName(str(pin)): PWMFanNorm(
+                ArduinoPWMFan(conn, pwm_pin=ArduinoPin(pin), tacho_pin=ArduinoPin(3)),
+                pwm_line_start=PWMValue(pwm_line_start),
+                pwm_line_end=PWMValue(240),
+            )
+            for pin in (9, 10)
+        }
+
+    with ArduinoEmulator(status_interval=0.01) as emulator:
+        fans = Fans(make_fans(emulator.url, 100), report=report)
+        with fans:
+            conn = arduino_connection_from_pwmfan_norm(fans.fans[FanName("9")])
+            assert conn is not None
+            # All of the fans on the board are changed, yet the board
+            # is not reconnected.
+            fans.update(make_fans(emulator.url, 110))
+            assert fans.fans[FanName("9")].pwm_line_start == 110
+            for fan in fans.fans.values():
+                assert arduino_connection_from_pwmfan_norm(fan) is conn
+            assert conn.is_connected
+        assert emulator.connections_accepted == 1
@@ -0,0 +1,56 @@
+import subprocess
+import threading
+from timeit import default_timer
+
+import pytest
+
+from afancontrol.command_helper import CommandHelper, installed_command_helper
+from afancontrol.exec import exec_shell_command
+
+
+@pytest.fixture
+def command_helper():
+    with CommandHelper() as helper:
+        yield helper
+    assert installed_command_helper() is None
+
+
+def test_exec_shell_command_via_helper(command_helper):
+    assert installed_command_helper() is command_helper
+    assert exec_shell_command("printf '@%s' hi") == "@hi"
+
+
+def test_helper_concurrent_commands(command_helper):
+    results = {}
+
+    def run(i):
+        results[i] = exec_shell_command("sleep 0.3; printf %s %s" % (i, i))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(5)]
+    start = default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert default_timer() - start < 1.2
+    assert results == {i: str(i) for i in range(5)}
+
+
+def test_helper_failed_command(command_helper):
+    with pytest.raises(subprocess.CalledProcessError) as cm:
+        exec_shell_command("printf out; printf err >&2; exit 3")
+    assert cm.value.returncode == 3
+    assert cm.value.stdout == b"out"
+    assert cm.value.stderr == b"err"
+
+
+def test_helper_timeout(command_helper):
+    with pytest.raises(subprocess.TimeoutExpired):
+        exec_shell_command("sleep 10", timeout=0.2)
+
+
+def test_helper_died_fallback(command_helper, caplog):
+    command_helper._process.kill()
+    command_helper._process.wait()
+    assert exec_shell_command("printf fallback") == "fallback"
+    assert "is not running" in caplog.text
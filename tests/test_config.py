@@ -31,7 +31,14 @@ from afancontrol.pwmfan import (
     PWMFanNorm,
     PWMValue,
 )
-from afancontrol.temp import FileTemp, HDDTemp, TempCelsius
+from afancontrol.temp import (
+    CommandSource,
+    FileTemp,
+    HDDTemp,
+    SourceTemp,
+    TempCelsius,
+    command_sources_from_temps,
+)
 
 
 @pytest.fixture
@@ -63,11 +70,20 @@ def test_pkg_conf(pkg_conf: Path):
             logfile="/var/log/afancontrol.log",
             interval=5,
             exporter_listen_host=None,
+            exporter_type="prometheus_client",
+            exporter_push_host=None,
+            exporter_server="threads",
+            history_duration=0,
+            history_resolution=5,
+            command_helper=False,
         ),
         report_cmd=(
             'printf "Subject: %s\nTo: %s\n\n%b" '
             '"afancontrol daemon report: %REASON%" root "%MESSAGE%" | sendmail -t'
         ),
+        report_coalesce_window=0,
+        report_rate_limit=0,
+        dispatch_queue_size=100,
         triggers=TriggerConfig(
             global_commands=Actions(
                 panic=AlertCommands(enter_cmd=None, leave_cmd=None),
@@ -79,6 +95,8 @@ def test_pkg_conf(pkg_conf: Path):
                     threshold=AlertCommands(enter_cmd=None, leave_cmd=None),
                 )
             },
+            command_parallelism=4,
+            command_timeout=5,
         ),
         fans={
             FanName("hdd"): PWMFanNorm(
@@ -121,12 +139,21 @@ def test_example_conf(example_conf: Path):
             pidfile="/run/afancontrol.pid",
             logfile="/var/log/afancontrol.log",
             exporter_listen_host="127.0.0.1:8083",
+            exporter_type="prometheus_client",
+            exporter_push_host=None,
+            exporter_server="threads",
+            history_duration=0,
+            history_resolution=5,
+            command_helper=False,
             interval=5,
         ),
         report_cmd=(
             'printf "Subject: %s\nTo: %s\n\n%b" '
             '"afancontrol daemon report: %REASON%" root "%MESSAGE%" | sendmail -t'
         ),
+        report_coalesce_window=0,
+        report_rate_limit=0,
+        dispatch_queue_size=100,
         triggers=TriggerConfig(
             global_commands=Actions(
                 panic=AlertCommands(enter_cmd=None, leave_cmd=None),
@@ -142,6 +169,8 @@ def test_example_conf(example_conf: Path):
                     threshold=AlertCommands(enter_cmd=None, leave_cmd=None),
                 ),
             },
+            command_parallelism=4,
+            command_timeout=5,
         ),
         fans={
             FanName("cpu"): PWMFanNorm(
@@ -241,12 +270,21 @@ temps = mobo
             pidfile="/run/afancontrol.pid",
             logfile=None,
             exporter_listen_host=None,
+            exporter_type="prometheus_client",
+            exporter_push_host=None,
+            exporter_server="threads",
+            history_duration=0,
+            history_resolution=5,
+            command_helper=False,
             interval=5,
         ),
         report_cmd=(
             'printf "Subject: %s\nTo: %s\n\n%b" '
             '"afancontrol daemon report: %REASON%" root "%MESSAGE%" | sendmail -t'
         ),
+        report_coalesce_window=0,
+        report_rate_limit=0,
+        dispatch_queue_size=100,
         triggers=TriggerConfig(
             global_commands=Actions(
                 panic=AlertCommands(enter_cmd=None, leave_cmd=None),
@@ -258,6 +296,8 @@ temps = mobo
                     threshold=AlertCommands(enter_cmd=None, leave_cmd=None),
                 )
             },
+            command_parallelism=4,
+            command_timeout=5,
         ),
         fans={
             FanName("case"): PWMFanNorm(
@@ -286,3 +326,271 @@ temps = mobo
             )
         },
     )
+
+
+@pytest.mark.skipif(not pyserial_available, reason="pyserial is not installed")
+@pytest.mark.parametrize(
+    "fan2_pins, error",
+    [
+        ("pwm_pin = 10\ntacho_pin = 3", "`tacho_pin` 3 .* more than one fan"),
+        ("pwm_pin = 256\ntacho_pin = 2", "`pwm_pin` value '256'"),
+        ("tacho_pin = 2", "`pwm_pin` value 'None'"),
+        # The fans on a splitter share the PWM pin.
+        ("pwm_pin = 9\ntacho_pin = 2", None),
+    ],
+)
+def test_arduino_fan_pins(fan2_pins, error) -> None:
+    daemon_cli_config = DaemonCLIConfig(
+        pidfile=None, logfile=None, exporter_listen_host=None
+    )
+
+    config = """
+[daemon]
+
+[actions]
+
+[temp:mobo]
+type = file
+path = /sys/class/hwmon/hwmon0/device/temp1_input
+
+[arduino: mymicro]
+serial_url = /dev/ttyACM0
+
+[fan: fan1]
+type = arduino
+arduino_name = mymicro
+pwm_pin = 9
+tacho_pin = 3
+
+[fan: fan2]
+type = arduino
+arduino_name = mymicro
+%s
+
+[mapping:1]
+fans = fan1, fan2
+temps = mobo
+""" % (fan2_pins,)
+    if error is None:
+        parsed = parse_config(path_from_str(config), daemon_cli_config)
+        assert set(parsed.fans) == {FanName("fan1"), FanName("fan2")}
+        return
+    with pytest.raises(RuntimeError, match=error):
+        parse_config(path_from_str(config), daemon_cli_config)
+
+
+def test_source_temps() -> None:
+    daemon_cli_config = DaemonCLIConfig(
+        pidfile=None, logfile=None, exporter_listen_host=None
+    )
+
+    config = """
+[daemon]
+
+[actions]
+
+[source:gpus]
+command = nvidia-smi --query-gpu=index,temperature.gpu --format=csv,noheader
+format = csv
+
+[source:gpus-again]
+command = nvidia-smi --query-gpu=index,temperature.gpu --format=csv,noheader
+format = csv
+
+[temp:gpu{n}]
+foreach_range = 0-1
+type = source
+source = gpus
+field = {n},1
+min = 40
+max = 80
+
+[temp:gpu2]
+type = source
+source = gpus-again
+field = 2,1
+min = 40
+max = 80
+
+[fan: case]
+pwm = /sys/class/hwmon/hwmon0/device/pwm2
+fan_input = /sys/class/hwmon/hwmon0/device/fan2_input
+
+[mapping:1]
+fans = case
+temps = gpu*
+"""
+    parsed = parse_config(path_from_str(config), daemon_cli_config)
+    source = CommandSource(
+        "nvidia-smi --query-gpu=index,temperature.gpu --format=csv,noheader",
+        format="csv",
+    )
+    assert parsed.temps[TempName("gpu1")] == SourceTemp(
+        source,
+        "1,1",
+        min=TempCelsius(40),
+        max=TempCelsius(80),
+        panic=None,
+        threshold=None,
+    )
+    # The identical commands are deduplicated.
+    assert len(command_sources_from_temps(parsed.temps.values())) == 1
+
+    with pytest.raises(RuntimeError, match="Invalid field"):
+        parse_config(
+            path_from_str(config.replace("field = 2,1", "field = 2")),
+            daemon_cli_config,
+        )
+    with pytest.raises(RuntimeError, match=r"\[source:gpus-again\] section is missing"):
+        parse_config(
+            path_from_str(config.replace("[source:gpus-again]", "[source:other]")),
+            daemon_cli_config,
+        )
+    with pytest.raises(RuntimeError, match="Unsupported format"):
+        parse_config(
+            path_from_str(config.replace("format = csv", "format = xml")),
+            daemon_cli_config,
+        )
+
+
+def test_history_requires_exporter() -> None:
+    daemon_cli_config = DaemonCLIConfig(
+        pidfile=None, logfile=None, exporter_listen_host=None
+    )
+
+    config = """
+[daemon]
+history_duration = 3600
+
+[actions]
+
+[temp:mobo]
+type = file
+path = /sys/class/hwmon/hwmon0/device/temp1_input
+
+[fan: case]
+pwm = /sys/class/hwmon/hwmon0/device/pwm2
+fan_input = /sys/class/hwmon/hwmon0/device/fan2_input
+
+[mapping:1]
+fans = case*0.6,
+temps = mobo
+"""
+    with pytest.raises(RuntimeError, match="exporter_listen_host"):
+        parse_config(path_from_str(config), daemon_cli_config)
+
+    daemon_cli_config = daemon_cli_config._replace(
+        exporter_listen_host="127.0.0.1:8083"
+    )
+    parsed = parse_config(path_from_str(config), daemon_cli_config)
+    assert parsed.daemon.history_duration == 3600
+    assert parsed.daemon.history_resolution == 5
+
+
+def test_unix_socket_requires_event_loop_server() -> None:
+    daemon_cli_config = DaemonCLIConfig(
+        pidfile=None, logfile=None, exporter_listen_host="unix:/run/afancontrol.sock"
+    )
+
+    config = """
+[daemon]
+
+[actions]
+
+[temp:mobo]
+type = file
+path = /sys/class/hwmon/hwmon0/device/temp1_input
+
+[fan: case]
+pwm = /sys/class/hwmon/hwmon0/device/pwm2
+fan_input = /sys/class/hwmon/hwmon0/device/fan2_input
+
+[mapping:1]
+fans = case*0.6,
+temps = mobo
+"""
+    with pytest.raises(RuntimeError, match="exporter_server = event_loop"):
+        parse_config(path_from_str(config), daemon_cli_config)
+
+    config = config.replace("[daemon]\n", "[daemon]\nexporter_server = event_loop\n")
+    parsed = parse_config(path_from_str(config), daemon_cli_config)
+    assert parsed.daemon.exporter_server == "event_loop"
+
+
+def test_template_sections(temp_path: Path) -> None:
+    for disk in ("ata-2", "ata-1"):
+        (temp_path / disk).write_text("")
+    daemon_cli_config = DaemonCLIConfig(
+        pidfile=None, logfile=None, exporter_listen_host=None
+    )
+
+    config = """
+[daemon]
+
+[actions]
+
+[temp:disk-{name}]
+foreach_glob = %(disks)s
+type = hdd
+path = {path}
+min = 30
+max = 50
+
+[temp: mobo]
+type = file
+path = /sys/class/hwmon/hwmon0/device/temp1_input
+
+[fan:jbod{n}]
+foreach_range = 1-3
+pwm = /sys/class/hwmon/hwmon1/device/pwm{n}
+fan_input = /sys/class/hwmon/hwmon1/device/fan{n}_input
+
+[mapping:disks]
+fans = jbod* * 0.6
+temps = disk-*
+
+[mapping:mobo]
+fans = jbod1
+temps = mobo
+""" % dict(disks=temp_path / "ata-*")
+    parsed = parse_config(path_from_str(config), daemon_cli_config)
+    assert list(parsed.temps) == ["disk-ata-1", "disk-ata-2", "mobo"]
+    assert parsed.temps[TempName("disk-ata-2")] == HDDTemp(
+        str(temp_path / "ata-2"),
+        min=TempCelsius(30),
+        max=TempCelsius(50),
+        panic=None,
+        threshold=None,
+        hddtemp_bin="hddtemp",
+    )
+    assert parsed.fans[FanName("jbod3")] == PWMFanNorm(
+        LinuxPWMFan(
+            PWMDevice("/sys/class/hwmon/hwmon1/device/pwm3"),
+            FanInputDevice("/sys/class/hwmon/hwmon1/device/fan3_input"),
+        ),
+        pwm_line_start=PWMValue(100),
+        pwm_line_end=PWMValue(240),
+        never_stop=True,
+    )
+    assert parsed.mappings[MappingName("disks")] == FansTempsRelation(
+        temps=[TempName("disk-ata-1"), TempName("disk-ata-2")],
+        fans=[
+            FanSpeedModifier(fan=FanName("jbod%s" % n), modifier=0.6) for n in (1, 2, 3)
+        ],
+    )
+
+    with pytest.raises(RuntimeError, match="must contain one of: {n}"):
+        parse_config(
+            path_from_str(config.replace("[fan:jbod{n}]", "[fan:jbod]")),
+            daemon_cli_config,
+        )
+    with pytest.raises(RuntimeError, match="already declared"):
+        parse_config(
+            path_from_str(config.replace("[temp: mobo]", "[temp:disk-ata-1]")),
+            daemon_cli_config,
+        )
+    with pytest.raises(RuntimeError, match="doesn't match anything"):
+        parse_config(
+            path_from_str(config.replace("temps = disk-*", "temps = ssd-*")),
+            daemon_cli_config,
+        )
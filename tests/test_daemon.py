@@ -1,12 +1,16 @@
 import threading
 from contextlib import ExitStack
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 from click.testing import CliRunner
 
 from afancontrol import daemon
-from afancontrol.daemon import PidFile, Signals, daemon as main
+from afancontrol.config import DaemonCLIConfig, parse_config
+from afancontrol.daemon import PidFile, Signals, daemon as main, reload_config
+from afancontrol.dispatch import Dispatcher
+from afancontrol.manager import Manager
+from afancontrol.metrics import Metrics
 
 
 def test_main_smoke(temp_path):
@@ -96,3 +100,64 @@ def test_signals():
 
     threading.Timer(0.01, lambda: s.sigterm(None, None)).start()
     assert True is s.wait_for_term_queued(1e6)
+
+
+def test_signals_reload():
+    s = Signals()
+
+    threading.Timer(0.01, lambda: s.sighup(None, None)).start()
+    assert False is s.wait_for_term_queued(1e6)
+    assert True is s.pop_reload_queued()
+    assert False is s.pop_reload_queued()
+
+
+def test_reload_config(temp_path):
+    config_path = temp_path / "afancontrol.conf"
+    config = """
+[daemon]
+interval = %(interval)s
+
+[actions]
+
+[temp:mobo]
+type = file
+path = /fake/sys/class/hwmon/hwmon0/device/temp1_input
+
+[fan: case]
+pwm = /fake/sys/class/hwmon/hwmon0/device/pwm2
+fan_input = /fake/sys/class/hwmon/hwmon0/device/fan2_input
+
+[mapping:1]
+fans = case*0.6,
+temps = mobo
+"""
+    config_path.write_text(config % dict(interval=5))
+    daemon_cli_config = DaemonCLIConfig(
+        pidfile=None, logfile=None, exporter_listen_host=None
+    )
+    parsed_config = parse_config(config_path, daemon_cli_config)
+    manager = MagicMock(spec=Manager)
+    manager.metrics = MagicMock(spec=Metrics)()
+    manager.dispatcher = Dispatcher(queue_size=100)
+
+    config_path.write_text(config % dict(interval=10))
+    new_config = reload_config(config_path, daemon_cli_config, parsed_config, manager)
+    assert new_config.daemon.interval == 10
+    assert manager.reload.call_count == 1
+    # The metrics are unchanged, so they're kept.
+    assert manager.reload.call_args[1]["metrics"] is manager.metrics
+    assert manager.reload.call_args[1]["report"].dispatcher is manager.dispatcher
+
+    config_path.write_text(config % dict(interval="soon"))
+    assert reload_config(config_path, daemon_cli_config, new_config, manager) is (
+        new_config
+    )
+    assert manager.reload.call_count == 1
+
+    # A fan which cannot be entered.
+    manager.reload.side_effect = RuntimeError("no pwm_enable")
+    config_path.write_text(config % dict(interval=15))
+    assert reload_config(config_path, daemon_cli_config, new_config, manager) is (
+        new_config
+    )
+    assert manager.reload.call_count == 2
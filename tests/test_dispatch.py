@@ -0,0 +1,137 @@
+import threading
+from unittest.mock import MagicMock, call
+
+import pytest
+
+from afancontrol import report, trigger
+from afancontrol.config import AlertCommands, TempName
+from afancontrol.dispatch import Dispatcher
+from afancontrol.metrics import BuiltinMetrics
+from afancontrol.report import Report
+from afancontrol.trigger import PanicTrigger, Triggers
+
+
+def blocking_command(started, release):
+    def command():
+        started.set()
+        assert release.wait(5)
+
+    return command
+
+
+def test_dispatcher_executes_in_background_in_order():
+    started, release = threading.Event(), threading.Event()
+    executed = []
+    with Dispatcher(queue_size=10) as dispatcher:
+        assert dispatcher.submit("blocking", blocking_command(started, release))
+        assert started.wait(5)
+        for i in range(3):
+            assert dispatcher.submit(str(i), lambda i=i: executed.append(i))
+        assert dispatcher.queue_depth == 3
+        assert executed == []
+        release.set()
+    # The queue is drained on exit.
+    assert executed == [0, 1, 2]
+    assert dispatcher.queue_depth == 0
+    assert dispatcher.executed == 4
+    assert dispatcher.failed == 0
+
+
+def test_dispatcher_drops_when_full():
+    started, release = threading.Event(), threading.Event()
+    executed = []
+    with Dispatcher(queue_size=1) as dispatcher:
+        dispatcher.submit("blocking", blocking_command(started, release))
+        assert started.wait(5)
+        assert dispatcher.submit("first", lambda: executed.append("first"))
+        assert not dispatcher.submit("second", lambda: executed.append("second"))
+        assert dispatcher.dropped == 1
+        release.set()
+    assert executed == ["first"]
+
+
+def test_dispatcher_counts_failures():
+    def failing():
+        raise RuntimeError("boom")
+
+    with Dispatcher(queue_size=10) as dispatcher:
+        dispatcher.submit("failing", failing)
+        dispatcher.submit("good", lambda: None)
+    assert dispatcher.failed == 1
+    assert dispatcher.executed == 1
+
+
+def test_dispatcher_drain_timeout(caplog):
+    started, release = threading.Event(), threading.Event()
+    dispatcher = Dispatcher(queue_size=10, drain_timeout=0.1)
+    with dispatcher:
+        dispatcher.submit("blocking", blocking_command(started, release))
+        dispatcher.submit("never", lambda: None)
+        assert started.wait(5)
+    # The exit didn't wait for the blocked command.
+    assert "1 of them are not executed" in caplog.text
+    assert dispatcher.executed == 0
+    release.set()
+
+
+def test_dispatcher_not_running_executes_synchronously():
+    executed = []
+    dispatcher = Dispatcher(queue_size=10)
+    assert dispatcher.submit("sync", lambda: executed.append(1))
+    assert executed == [1]
+    assert dispatcher.executed == 1
+
+
+def test_dispatcher_invalid_queue_size():
+    with pytest.raises(ValueError):
+        Dispatcher(queue_size=0)
+
+
+def test_report_and_trigger_commands_are_dispatched(sense_exec_shell_command):
+    started, release = threading.Event(), threading.Event()
+    dispatcher = Dispatcher(queue_size=10)
+    r = Report(r"printf '@%s' '%REASON%'", dispatcher=dispatcher)
+    t = PanicTrigger(
+        global_commands=AlertCommands(enter_cmd="printf '@%s' enter", leave_cmd=None),
+        temp_commands={TempName("mobo"): AlertCommands(None, None)},
+        report=r,
+        dispatcher=dispatcher,
+    )
+    with sense_exec_shell_command(report) as (report_exec, _):
+        with sense_exec_shell_command(trigger) as (trigger_exec, _):
+            with dispatcher:
+                dispatcher.submit("blocking", blocking_command(started, release))
+                assert started.wait(5)
+                with t:
+                    t.check({TempName("mobo"): None})
+                    assert t.is_alerting
+                    # The tick doesn't wait for the commands.
+                    assert dispatcher.queue_depth == 2
+                # Neither does the exit of the trigger.
+                assert dispatcher.queue_depth == 3
+                assert report_exec.call_count == 0
+                assert trigger_exec.call_count == 0
+                release.set()
+
+    assert report_exec.call_args_list == [
+        call("printf '@%s' 'Entered PANIC MODE'"),
+        call("printf '@%s' 'Leaving PANIC MODE'"),
+    ]
+    assert trigger_exec.call_args_list == [call("printf '@%s' enter", timeout=5)]
+
+
+def test_dispatcher_metrics():
+    dispatcher = Dispatcher(queue_size=10)
+    dispatcher.submit("failing", lambda: 1 / 0)
+    triggers = MagicMock(spec=Triggers)()
+    triggers.panic_trigger.is_alerting = False
+    triggers.threshold_trigger.is_alerting = False
+    triggers.dispatcher = dispatcher
+    metrics = BuiltinMetrics("127.0.0.1:0")
+    metrics.tick(temps={}, fans=MagicMock(fans={}), triggers=triggers)
+
+    text = metrics._render().decode()
+    assert "dispatch_queue_depth 0.0\n" in text
+    assert "dispatch_queue_size 10.0\n" in text
+    assert "dispatch_commands_failed 1.0\n" in text
+    assert "dispatch_commands_dropped 0.0\n" in text
@@ -14,21 +14,33 @@ def report():
     return MagicMock(spec=Report)
 
 
+@pytest.fixture
+def make_fan():
+    def make_fan():
+        fan = MagicMock(spec=PWMFanNorm)
+        fan.pwmfan = MagicMock(spec=BasePWMFan)
+        return fan
+
+    return make_fan
+
+
 @pytest.mark.parametrize("is_fan_failing", [False, True])
 def test_smoke(report, is_fan_failing):
     fan = MagicMock(spec=PWMFanNorm)
+    fan.pwmfan = MagicMock(spec=BasePWMFan)
     fans = Fans({FanName("test"): fan}, report=report)
 
     fan.set = lambda pwm_norm: int(255 * pwm_norm)
-    fan.get_speed.return_value = 0 if is_fan_failing else 942
+    fan.get_speed_instant.return_value = 0 if is_fan_failing else 942
     fan.is_pwm_stopped = BasePWMFan.is_pwm_stopped
+    fan.is_speed_stalled = BasePWMFan.is_speed_stalled
 
     with fans:
         assert 1 == fan.__enter__.call_count
         fans.check_speeds()
         fans.set_all_to_full_speed()
         fans.set_fan_speeds({FanName("test"): PWMValueNorm(0.42)})
-        assert fan.get_speed.call_count == 1
+        assert fan.get_speed_instant.call_count == 1
         if is_fan_failing:
             assert fans._failed_fans == {"test"}
             assert fans._stopped_fans == set()
@@ -50,6 +62,7 @@ def test_set_fan_speeds(report):
     )
 
     for fan in mocked_fans.values():
+        fan.pwmfan = MagicMock(spec=BasePWMFan)
         fan.set.return_value = 240
         fan.get_speed.return_value = 942
         fan.is_pwm_stopped = BasePWMFan.is_pwm_stopped
@@ -66,3 +79,51 @@ def test_set_fan_speeds(report):
             }
         )
         assert [1, 0, 1, 1] == [f.set.call_count for f in mocked_fans.values()]
+
+
+def test_update_swaps_changed_fans_only(report, make_fan):
+    kept, changed, removed = make_fan(), make_fan(), make_fan()
+    fans = Fans(
+        {FanName("kept"): kept, FanName("changed"): changed, FanName("rm"): removed},
+        report=report,
+    )
+    new_changed, added = make_fan(), make_fan()
+    with fans:
+        fans._ensure_fan_is_failing(FanName("kept"), Exception("test"))
+        fans._ensure_fan_is_failing(FanName("changed"), Exception("test"))
+
+        fans.update(
+            {
+                FanName("kept"): kept,
+                FanName("changed"): new_changed,
+                FanName("new"): added,
+            }
+        )
+        assert [kept.__exit__.call_count, changed.__exit__.call_count] == [0, 1]
+        assert removed.__exit__.call_count == 1
+        assert [new_changed.__enter__.call_count, added.__enter__.call_count] == [1, 1]
+        assert fans.fans == {"kept": kept, "changed": new_changed, "new": added}
+        assert fans._failed_fans == {"kept"}
+
+    for fan in (kept, new_changed, added):
+        assert fan.__exit__.call_count == 1
+    assert kept.__enter__.call_count == 1
+
+
+def test_update_failure_keeps_current_fans(report, make_fan):
+    changed, removed = make_fan(), make_fan()
+    current = {FanName("changed"): changed, FanName("rm"): removed}
+    fans = Fans(current, report=report)
+    new_changed, added = make_fan(), make_fan()
+    added.__enter__.side_effect = RuntimeError("no pwm_enable")
+    with fans:
+        with pytest.raises(RuntimeError):
+            fans.update({FanName("changed"): new_changed, FanName("new"): added})
+        assert fans.fans == current
+        # The changed fan is restored, the removed one is not touched.
+        assert [changed.__exit__.call_count, changed.__enter__.call_count] == [1, 2]
+        assert [removed.__exit__.call_count, removed.__enter__.call_count] == [0, 1]
+        assert new_changed.__exit__.call_count == 1
+        assert added.__exit__.call_count == 0
+
+    assert [changed.__exit__.call_count, removed.__exit__.call_count] == [2, 1]
@@ -0,0 +1,113 @@
+import math
+
+import pytest
+
+from afancontrol.config import FanName, TempName
+from afancontrol.history import History
+from afancontrol.metrics import (
+    _NO_DISPATCHER_SNAPSHOT,
+    _NO_REPORTS_SNAPSHOT,
+    _NO_TRIGGER_COMMANDS_SNAPSHOT,
+    _FanSnapshot,
+    _TickSnapshot,
+)
+from afancontrol.temp import TempCelsius, TempStatus
+
+
+def make_snapshot(temp, rpm, is_panic=False):
+    temp_status = None
+    if temp is not None:
+        temp_status = TempStatus(
+            temp=TempCelsius(temp),
+            min=TempCelsius(30.0),
+            max=TempCelsius(50.0),
+            panic=None,
+            threshold=None,
+            is_panic=is_panic,
+            is_threshold=False,
+        )
+    return _TickSnapshot(
+        temps=((TempName("mobo"), temp_status),),
+        fans=(
+            (
+                FanName("hdd"),
+                _FanSnapshot(
+                    rpm=rpm,
+                    pwm=100,
+                    pwm_normalized=0.5,
+                    pwm_line_start=100,
+                    pwm_line_end=240,
+                    is_stopped=False,
+                    is_failing=False,
+                ),
+            ),
+        ),
+        arduinos=(),
+        is_panic=is_panic,
+        is_threshold=False,
+        dispatcher=_NO_DISPATCHER_SNAPSHOT,
+        reports=_NO_REPORTS_SNAPSHOT,
+        trigger_commands=_NO_TRIGGER_COMMANDS_SNAPSHOT,
+    )
+
+
+@pytest.fixture
+def history():
+    return History(
+        duration=50,
+        resolution=10,
+        temp_names=[TempName("mobo"), TempName("cpu")],
+        fan_names=[FanName("hdd")],
+    )
+
+
+def test_history_ring_buffer(history):
+    assert history.capacity == 5
+    size_bytes = history.size_bytes
+
+    for i in range(8):
+        history.record(1000 + i * 10, make_snapshot(40 + i, 1000 + i))
+
+    assert history.size_bytes == size_bytes
+    result = history.query()
+    assert result["resolution"] == 10
+    assert result["timestamps"] == [1030, 1040, 1050, 1060, 1070]
+    assert result["temps"] == {
+        "cpu": [None] * 5,
+        "mobo": [43.0, 44.0, 45.0, 46.0, 47.0],
+    }
+    assert result["fans"] == {
+        "hdd": {"rpm": [1003, 1004, 1005, 1006, 1007], "pwm": [100] * 5}
+    }
+    assert result["is_panic"] == [0] * 5
+
+
+def test_history_resolution(history):
+    history.record(1000, make_snapshot(40, 1000))
+    history.record(1005, make_snapshot(None, math.nan, is_panic=True))
+    history.record(1010, make_snapshot(42, 1200))
+
+    result = history.query()
+    assert result["timestamps"] == [1005, 1010]
+    assert result["temps"]["mobo"] == [None, 42.0]
+    assert result["fans"]["hdd"]["rpm"] == [None, 1200]
+    assert result["is_panic"] == [1, 0]
+
+
+def test_history_filters(history):
+    for i in range(5):
+        history.record(1000 + i * 10, make_snapshot(40 + i, 1000 + i))
+
+    result = history.query(since=1010, until=1030, names=["mobo"])
+    assert result["timestamps"] == [1010, 1020, 1030]
+    assert result["temps"] == {"mobo": [41.0, 42.0, 43.0]}
+    assert result["fans"] == {}
+
+    assert history.query(since=2000)["timestamps"] == []
+
+
+def test_history_validation():
+    with pytest.raises(ValueError):
+        History(duration=10, resolution=0, temp_names=[], fan_names=[])
+    with pytest.raises(ValueError):
+        History(duration=5, resolution=10, temp_names=[], fan_names=[])
@@ -1,9 +1,10 @@
 from contextlib import ExitStack
-from unittest.mock import MagicMock, patch, sentinel
+from unittest.mock import MagicMock, call, patch, sentinel
 
 import pytest
 
 import afancontrol.manager
+from afancontrol import temp
 from afancontrol.config import (
     Actions,
     AlertCommands,
@@ -18,7 +19,13 @@ from afancontrol.manager import Manager
 from afancontrol.metrics import Metrics
 from afancontrol.pwmfan import PWMFanNorm, PWMValueNorm
 from afancontrol.report import Report
-from afancontrol.temp import FileTemp, TempCelsius, TempStatus
+from afancontrol.temp import (
+    CommandSource,
+    FileTemp,
+    SourceTemp,
+    TempCelsius,
+    TempStatus,
+)
 from afancontrol.trigger import Triggers
 
 
@@ -58,6 +65,8 @@ def test_manager(report):
                         threshold=AlertCommands(enter_cmd=None, leave_cmd=None),
                     )
                 },
+                command_parallelism=4,
+                command_timeout=5,
             ),
             metrics=mocked_metrics,
         )
@@ -71,8 +80,11 @@ def test_manager(report):
         assert mocked_case_fan.__enter__.call_count == 1
         assert mocked_metrics.__enter__.call_count == 1
         assert mocked_metrics.tick.call_count == 1
+        # The coalesced reports are sent when their window has passed.
+        assert report.flush.call_args_list == [call()]
     assert mocked_case_fan.__exit__.call_count == 1
     assert mocked_metrics.__exit__.call_count == 1
+    assert report.flush.call_args_list == [call(), call(force=True)]
 
 
 @pytest.mark.parametrize(
@@ -245,3 +257,135 @@ def test_fan_speeds(report, temps, mappings, expected_fan_speeds):
         assert expected_fan_speeds == pytest.approx(
             dict(manager._map_temps_to_fan_speeds(temps))
         )
+
+
+def make_source_temps(gpu0_min=30):
+    source = CommandSource(r"sleep 0.3; printf '%s\n' 40 41 42 43")
+    return {
+        TempName("gpu%s" % i): SourceTemp(
+            source,
+            str(i),
+            min=TempCelsius(gpu0_min if i == 0 else 30),
+            max=TempCelsius(50),
+            panic=None,
+            threshold=None,
+        )
+        for i in range(4)
+    }
+
+
+def test_source_executed_once_per_tick(report, sense_exec_shell_command):
+    # A slow command is not executed again by the other temps of a tick.
+    with patch.object(afancontrol.manager, "Triggers", spec=Triggers):
+        manager = Manager(
+            fans={},
+            temps=make_source_temps(),
+            mappings={},
+            report=report,
+            triggers_config=sentinel.some_triggers_config,
+            metrics=MagicMock(spec=Metrics)(),
+        )
+
+    with sense_exec_shell_command(temp) as (mock_exec_shell_command, _):
+        for tick in range(2):
+            statuses = manager._get_temps()
+            assert [s and s.temp for s in statuses.values()] == [40, 41, 42, 43]
+            assert mock_exec_shell_command.call_count == tick + 1
+
+
+def test_source_executed_once_per_tick_after_reload(report, sense_exec_shell_command):
+    metrics = MagicMock(spec=Metrics)()
+    # Not specced: the reload passes the `command_stats` of the triggers.
+    with patch.object(afancontrol.manager, "Triggers"):
+        manager = Manager(
+            fans={},
+            temps=make_source_temps(),
+            mappings={},
+            report=report,
+            triggers_config=sentinel.some_triggers_config,
+            metrics=metrics,
+        )
+        with manager:
+            # Only one of the temps of the shared command is changed.
+            temps = make_source_temps(gpu0_min=35)
+            manager.reload(
+                fans={},
+                temps=temps,
+                mappings={},
+                report=report,
+                triggers_config=sentinel.other_triggers_config,
+                metrics=metrics,
+            )
+            assert manager.temps[TempName("gpu0")] is temps[TempName("gpu0")]
+            assert manager.temps[TempName("gpu1")] is not temps[TempName("gpu1")]
+
+            with sense_exec_shell_command(temp) as (mock_exec_shell_command, _):
+                for tick in range(2):
+                    statuses = manager._get_temps()
+                    assert [s and s.temp for s in statuses.values()] == [
+                        40,
+                        41,
+                        42,
+                        43,
+                    ]
+                    assert mock_exec_shell_command.call_count == tick + 1
+
+
+def test_manager_reload(report):
+    mocked_case_fan = MagicMock(spec=PWMFanNorm)()
+    mocked_metrics = MagicMock(spec=Metrics)()
+    no_commands = AlertCommands(enter_cmd=None, leave_cmd=None)
+
+    def make_config(*temp_names):
+        return dict(
+            temps={name: MagicMock(spec=FileTemp)() for name in temp_names},
+            mappings={
+                MappingName("1"): FansTempsRelation(
+                    temps=list(temp_names),
+                    fans=[FanSpeedModifier(fan=FanName("case"), modifier=0.6)],
+                )
+            },
+            triggers_config=TriggerConfig(
+                global_commands=Actions(panic=no_commands, threshold=no_commands),
+                temp_commands={
+                    name: Actions(panic=no_commands, threshold=no_commands)
+                    for name in temp_names
+                },
+                command_parallelism=4,
+                command_timeout=5,
+            ),
+        )
+
+    manager = Manager(
+        fans={FanName("case"): mocked_case_fan},
+        report=report,
+        metrics=mocked_metrics,
+        **make_config(TempName("mobo"))
+    )
+    with manager:
+        triggers = manager.triggers
+        manager.reload(
+            fans={FanName("case"): mocked_case_fan},
+            report=report,
+            metrics=mocked_metrics,
+            **make_config(TempName("mobo"))
+        )
+        assert manager.triggers is triggers
+
+        new_metrics = MagicMock(spec=Metrics)()
+        manager.reload(
+            fans={FanName("case"): mocked_case_fan},
+            report=report,
+            metrics=new_metrics,
+            **make_config(TempName("mobo"), TempName("hdd"))
+        )
+        assert manager.triggers is not triggers
+        assert sorted(manager.temps) == ["hdd", "mobo"]
+
+        assert mocked_case_fan.__enter__.call_count == 1
+        assert mocked_metrics.__exit__.call_count == 1
+        assert new_metrics.__enter__.call_count == 1
+
+    assert mocked_case_fan.__exit__.call_count == 1
+    assert mocked_metrics.__exit__.call_count == 1
+    assert new_metrics.__exit__.call_count == 1
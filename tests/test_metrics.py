@@ -1,14 +1,22 @@
 import random
+import socket
+import threading
 import types
 from time import sleep
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
 import requests
 
 from afancontrol.config import FanName, TempName
 from afancontrol.fans import Fans
-from afancontrol.metrics import PrometheusMetrics, prometheus_available
+from afancontrol.history import History
+from afancontrol.metrics import (
+    BuiltinMetrics,
+    PrometheusMetrics,
+    UDPMetrics,
+    prometheus_available,
+)
 from afancontrol.pwmfan import PWMFanNorm
 from afancontrol.report import Report
 from afancontrol.temp import TempCelsius, TempStatus
@@ -128,3 +136,431 @@ def test_prometheus_faulty_fans_dont_break_metrics_collection(requests_session):
         assert 'fan_is_failing{fan_name="test"} 0.0' in resp.text
         assert "is_panic 0.0" in resp.text
         assert "is_threshold 0.0" in resp.text
+
+
+@pytest.mark.skipif(
+    not prometheus_available, reason="prometheus_client is not installed"
+)
+def test_prometheus_metrics_are_rendered_from_the_last_tick():
+    mocked_fan = MagicMock(spec=PWMFanNorm)()
+    mocked_triggers = MagicMock(spec=Triggers)()
+    mocked_report = MagicMock(spec=Report)()
+    mocked_triggers.panic_trigger.is_alerting = False
+    mocked_triggers.threshold_trigger.is_alerting = False
+    mocked_fan.pwm_line_start = 100
+    mocked_fan.pwm_line_end = 240
+    mocked_fan.get_speed.return_value = 999
+    fans = Fans(fans={FanName("test"): mocked_fan}, report=mocked_report)
+
+    metrics = PrometheusMetrics("127.0.0.1:0")
+    assert metrics.registry.get_sample_value("fan_rpm", {"fan_name": "test"}) is None
+
+    metrics.tick(
+        temps={TempName("failingtemp"): None}, fans=fans, triggers=mocked_triggers
+    )
+    assert mocked_fan.get_speed.call_count == 1
+
+    # Scrapes don't read the fans, they render the last tick:
+    mocked_fan.get_speed.return_value = 1000
+    for _ in range(2):
+        assert metrics.registry.get_sample_value("fan_rpm", {"fan_name": "test"}) == 999
+        assert (
+            metrics.registry.get_sample_value(
+                "temperature_is_failing", {"temp_name": "failingtemp"}
+            )
+            == 1
+        )
+    assert mocked_fan.get_speed.call_count == 1
+
+    metrics.tick(temps={}, fans=fans, triggers=mocked_triggers)
+    assert metrics.registry.get_sample_value("fan_rpm", {"fan_name": "test"}) == 1000
+    assert (
+        metrics.registry.get_sample_value(
+            "temperature_is_failing", {"temp_name": "failingtemp"}
+        )
+        is None
+    )
+
+
+@pytest.mark.skipif(
+    not prometheus_available, reason="prometheus_client is not installed"
+)
+def test_prometheus_exposition_is_cached_between_ticks(requests_session):
+    mocked_triggers = MagicMock(spec=Triggers)()
+    mocked_report = MagicMock(spec=Report)()
+    mocked_triggers.panic_trigger.is_alerting = False
+    mocked_triggers.threshold_trigger.is_alerting = False
+
+    port = random.randint(20000, 50000)
+    url = "http://127.0.0.1:%s/metrics" % port
+    metrics = PrometheusMetrics("127.0.0.1:%s" % port)
+    exposition_cache = metrics._exposition_cache
+    with metrics, patch.object(
+        exposition_cache, "render", wraps=exposition_cache.render
+    ) as render:
+        resp = requests_session.get(url, headers={"Accept-Encoding": "identity"})
+        assert resp.status_code == 200
+        assert "Content-Encoding" not in resp.headers
+        plain = resp.content
+
+        resp = requests_session.get(url, headers={"Accept-Encoding": "gzip"})
+        assert resp.status_code == 200
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.content == plain  # decompressed by requests
+
+        resp = requests_session.get(url, headers={"Accept-Encoding": "gzip;q=0"})
+        assert "Content-Encoding" not in resp.headers
+        assert render.call_count == 1
+
+        with metrics.measure_tick():
+            metrics.tick(
+                temps={TempName("failingtemp"): None},
+                fans=Fans(fans={}, report=mocked_report),
+                triggers=mocked_triggers,
+            )
+        for _ in range(2):
+            resp = requests_session.get(url)
+            assert 'temperature_is_failing{temp_name="failingtemp"} 1.0' in resp.text
+        assert render.call_count == 2
+
+        # The time since the last tick is not cached, so a stuck loop
+        # is noticed.
+        last_tick = metrics._last_metrics_collect_clock
+        for seconds_ago in (42, 43):
+            with patch.object(metrics, "_clock", return_value=last_tick + seconds_ago):
+                for encoding in ("identity", "gzip"):
+                    resp = requests_session.get(
+                        url, headers={"Accept-Encoding": encoding}
+                    )
+                    assert (
+                        "last_metrics_tick_seconds_ago %s.0" % seconds_ago
+                    ) in resp.text
+        assert render.call_count == 2
+
+        # Filtered scrapes bypass the cache.
+        resp = requests_session.get(url + "?name[]=is_panic")
+        assert resp.text.strip().endswith("is_panic 0.0")
+        assert "temperature_is_failing" not in resp.text
+        assert render.call_count == 3
+
+
+def make_tick_args(mocked_fan):
+    mocked_triggers = MagicMock(spec=Triggers)()
+    mocked_report = MagicMock(spec=Report)()
+    mocked_triggers.panic_trigger.is_alerting = True
+    mocked_triggers.threshold_trigger.is_alerting = False
+    mocked_triggers.dispatcher = None
+
+    mocked_fan.pwm_line_start = 100
+    mocked_fan.pwm_line_end = 240
+    mocked_fan.get_speed.return_value = 999
+    mocked_fan.get_raw.return_value = 142
+    mocked_fan.get = types.MethodType(PWMFanNorm.get, mocked_fan)
+    mocked_fan.pwmfan.max_pwm = 255
+    return dict(
+        temps={
+            TempName("goodtemp"): TempStatus(
+                temp=TempCelsius(74.0),
+                min=TempCelsius(40.0),
+                max=TempCelsius(50.0),
+                panic=TempCelsius(60.0),
+                threshold=None,
+                is_panic=True,
+                is_threshold=False,
+            ),
+            TempName('bad"temp\\'): None,
+        },
+        fans=Fans(fans={FanName("test"): mocked_fan}, report=mocked_report),
+        triggers=mocked_triggers,
+    )
+
+
+def test_builtin_metrics(requests_session):
+    mocked_fan = MagicMock(spec=PWMFanNorm)()
+
+    port = random.randint(20000, 50000)
+    url = "http://127.0.0.1:%s/metrics" % port
+    metrics = BuiltinMetrics("127.0.0.1:%s" % port)
+    with metrics:
+        resp = requests_session.get(url)
+        assert resp.status_code == 200
+        assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "is_threshold 0.0" in resp.text
+
+        with metrics.measure_tick():
+            sleep(0.01)
+            metrics.tick(**make_tick_args(mocked_fan))
+
+        resp = requests_session.get(url)
+        assert resp.status_code == 200
+        assert "# TYPE tick_duration histogram" in resp.text
+        assert 'tick_duration_bucket{le="0.1"} 1.0' in resp.text
+        assert 'tick_duration_bucket{le="+Inf"} 1.0' in resp.text
+        assert "tick_duration_count 1.0" in resp.text
+        assert "tick_duration_sum 0.0" in resp.text
+        assert 'temperature_current{temp_name="bad\\"temp\\\\"} NaN' in resp.text
+        assert 'temperature_current{temp_name="goodtemp"} 74.0' in resp.text
+        assert 'temperature_is_failing{temp_name="bad\\"temp\\\\"} 1.0' in resp.text
+        assert 'fan_rpm{fan_name="test"} 999.0' in resp.text
+        assert 'fan_pwm_normalized{fan_name="test"} 0.556' in resp.text
+        assert "is_panic 1.0" in resp.text
+        assert "last_metrics_tick_seconds_ago 0." in resp.text
+        assert "process_" not in resp.text
+
+        resp = requests_session.get(url + "?name[]=is_panic&name[]=fan_rpm")
+        assert resp.text == (
+            "# HELP fan_rpm Fan speed (in RPM) as reported by the fan\n"
+            "# TYPE fan_rpm gauge\n"
+            'fan_rpm{fan_name="test"} 999.0\n'
+            "# HELP is_panic Is in panic mode\n"
+            "# TYPE is_panic gauge\n"
+            "is_panic 1.0\n"
+        )
+
+    with pytest.raises(IOError):
+        requests_session.get(url)
+
+
+@pytest.mark.skipif(
+    not prometheus_available, reason="prometheus_client is not installed"
+)
+def test_builtin_metrics_match_prometheus_client():
+    mocked_fan = MagicMock(spec=PWMFanNorm)()
+    tick_args = make_tick_args(mocked_fan)
+
+    # The ones which are exposed by `PrometheusMetrics` only or vary in time:
+    ignored = (
+        "process_",
+        "python_",
+        "tick_duration_created",
+        "last_metrics_tick_seconds_ago",
+    )
+
+    def samples(metrics):
+        metrics.tick(**tick_args)
+        lines = metrics._render().decode().splitlines()
+        return [
+            line
+            for line in lines
+            if not (line.split()[2] if line.startswith("#") else line).startswith(
+                ignored
+            )
+        ]
+
+    prometheus_samples = samples(PrometheusMetrics("127.0.0.1:0"))
+    builtin_samples = samples(BuiltinMetrics("127.0.0.1:0"))
+    assert sorted(builtin_samples) == sorted(prometheus_samples)
+
+
+def test_metrics_history_endpoint(requests_session):
+    mocked_fan = MagicMock(spec=PWMFanNorm)()
+    tick_args = make_tick_args(mocked_fan)
+
+    history = History(
+        duration=3600,
+        resolution=1,
+        temp_names=tick_args["temps"].keys(),
+        fan_names=tick_args["fans"].fans.keys(),
+    )
+    port = random.randint(20000, 50000)
+    url = "http://127.0.0.1:%s/history" % port
+    with BuiltinMetrics("127.0.0.1:%s" % port, history=history) as metrics:
+        metrics.tick(**tick_args)
+
+        resp = requests_session.get(url)
+        assert resp.status_code == 200
+        assert resp.headers["Content-Type"] == "application/json"
+        result = resp.json()
+        assert len(result["timestamps"]) == 1
+        assert result["temps"] == {"goodtemp": [74.0], 'bad"temp\\': [None]}
+        assert result["fans"] == {"test": {"rpm": [999], "pwm": [142]}}
+        assert result["is_panic"] == [1]
+
+        resp = requests_session.get(url, params={"since": "-60", "name": "test"})
+        result = resp.json()
+        assert len(result["timestamps"]) == 1
+        assert result["temps"] == {}
+        assert list(result["fans"]) == ["test"]
+
+        resp = requests_session.get(url, params={"until": "-60"})
+        assert resp.json()["timestamps"] == []
+
+        resp = requests_session.get(url, params={"since": "yesterday"})
+        assert resp.status_code == 400
+
+    with BuiltinMetrics("127.0.0.1:%s" % port):
+        resp = requests_session.get(url)
+        assert resp.status_code == 404
+
+
+def test_event_loop_metrics_server(requests_session):
+    mocked_fan = MagicMock(spec=PWMFanNorm)()
+    tick_args = make_tick_args(mocked_fan)
+    history = History(
+        duration=60,
+        resolution=1,
+        temp_names=tick_args["temps"].keys(),
+        fan_names=tick_args["fans"].fans.keys(),
+    )
+    metrics = BuiltinMetrics("127.0.0.1:0", history=history, server="event_loop")
+    with metrics:
+        metrics.tick(**tick_args)
+        port = metrics._http_server.server_address[1]
+        url = "http://127.0.0.1:%s" % port
+
+        resp = requests_session.get(url + "/metrics")
+        assert resp.status_code == 200
+        assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert 'fan_rpm{fan_name="test"} 999.0' in resp.text
+
+        resp = requests_session.get(url + "/metrics?name[]=is_panic")
+        assert resp.text.endswith("is_panic 1.0\n")
+
+        resp = requests_session.head(url + "/metrics")
+        assert resp.status_code == 200
+        assert resp.content == b""
+
+        resp = requests_session.get(url + "/history", params={"name": "test"})
+        assert resp.json()["fans"] == {"test": {"rpm": [999], "pwm": [142]}}
+        resp = requests_session.get(url + "/history", params={"since": "now"})
+        assert resp.status_code == 400
+
+        resp = requests_session.post(url + "/metrics")
+        assert resp.status_code == 405
+
+        # Garbage is dropped without breaking the server.
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.sendall(b"\x00" * 100 + b"\r\n\r\n")
+            assert sock.recv(1024).startswith(b"HTTP/1.1 400 ")
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            sock.shutdown(socket.SHUT_WR)
+            assert sock.recv(1024) == b""
+        assert requests_session.get(url + "/metrics").status_code == 200
+
+    with pytest.raises(IOError):
+        requests_session.get(url + "/metrics")
+
+
+def test_event_loop_metrics_server_unix_socket(temp_path):
+    path = str(temp_path / "afancontrol.sock")
+    with pytest.raises(ValueError, match="event_loop"):
+        BuiltinMetrics("unix:%s" % path)
+
+    metrics = BuiltinMetrics("unix:%s" % path, server="event_loop")
+    with metrics:
+        metrics.tick(**make_tick_args(MagicMock(spec=PWMFanNorm)()))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            sock.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+        head, body = response.split(b"\r\n\r\n", 1)
+        assert head.startswith(b"HTTP/1.1 200 OK\r\n")
+        assert b"Content-Length: %d\r\n" % len(body) in head
+        assert b'fan_rpm{fan_name="test"} 999.0' in body
+    assert not (temp_path / "afancontrol.sock").exists()
+
+
+def test_event_loop_metrics_server_doesnt_spawn_threads():
+    with BuiltinMetrics("127.0.0.1:0", server="event_loop") as metrics:
+        address = metrics._http_server.server_address
+        threads_count = threading.active_count()
+
+        clients = [socket.create_connection(address) for _ in range(50)]
+        try:
+            for sock in clients:
+                sock.sendall(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            for sock in clients:
+                assert sock.recv(1024).startswith(b"HTTP/1.1 200 OK\r\n")
+            assert threading.active_count() == threads_count
+        finally:
+            for sock in clients:
+                sock.close()
+
+
+@pytest.fixture
+def udp_listener():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(1)
+        yield sock
+
+
+def receive_datagrams(sock):
+    datagrams = []
+    try:
+        while True:
+            datagrams.append(sock.recv(65536).decode())
+            sock.settimeout(0.1)
+    except socket.timeout:
+        pass
+    return datagrams
+
+
+def test_udp_metrics_statsd(udp_listener):
+    mocked_fan = MagicMock(spec=PWMFanNorm)()
+    host, port = udp_listener.getsockname()
+    with UDPMetrics("%s:%s" % (host, port)) as metrics:
+        # Same order as in `Manager.tick`:
+        with metrics.measure_tick():
+            pass
+        metrics.tick(**make_tick_args(mocked_fan))
+
+    datagrams = receive_datagrams(udp_listener)
+    assert len(datagrams) == 1
+    assert all(len(datagram) <= 1432 for datagram in datagrams)
+    lines = "\n".join(datagrams).splitlines()
+    assert "afancontrol.temperature_current.goodtemp:74.0|g" in lines
+    assert "afancontrol.temperature_is_failing.bad_temp_:1.0|g" in lines
+    # NaN is not sent:
+    assert not any(
+        line.startswith("afancontrol.temperature_current.bad_temp_") for line in lines
+    )
+    assert "afancontrol.fan_rpm.test:999.0|g" in lines
+    assert "afancontrol.is_panic:1.0|g" in lines
+    assert any(line.startswith("afancontrol.tick_duration:") for line in lines)
+
+
+def test_udp_metrics_influx_batched(udp_listener):
+    mocked_fan = MagicMock(spec=PWMFanNorm)()
+    host, port = udp_listener.getsockname()
+    with UDPMetrics(
+        "%s:%s" % (host, port), protocol="influx", max_datagram_size=200
+    ) as metrics:
+        metrics.tick(**make_tick_args(mocked_fan))
+        assert metrics.datagrams_sent > 1
+        assert metrics.send_errors == 0
+
+    datagrams = receive_datagrams(udp_listener)
+    assert len(datagrams) == metrics.datagrams_sent
+    lines = "\n".join(datagrams).splitlines()
+    assert len(lines) == 4  # 2 temps, 1 fan and the global one.
+    goodtemp = [line for line in lines if "temp_name=goodtemp " in line][0]
+    assert goodtemp.startswith(
+        "afancontrol,temp_name=goodtemp "
+        "temperature_is_failing=0.0,temperature_current=74.0,"
+    )
+    assert "temperature_threshold" not in goodtemp  # NaN
+    assert any(line.startswith('afancontrol,temp_name=bad"temp\\\\ ') for line in lines)
+    assert any(
+        line.startswith(
+            "afancontrol is_panic=1.0,is_threshold=0.0,dispatch_queue_depth=0.0,"
+        )
+        for line in lines
+    )
+
+
+def test_udp_metrics_without_listener():
+    mocked_fan = MagicMock(spec=PWMFanNorm)()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        host, port = sock.getsockname()
+    # Nobody is listening on the port anymore, which must not break the tick.
+    with UDPMetrics("%s:%s" % (host, port)) as metrics:
+        for _ in range(3):
+            metrics.tick(**make_tick_args(mocked_fan))
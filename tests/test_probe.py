@@ -0,0 +1,82 @@
+import pytest
+
+from afancontrol.config import DaemonCLIConfig, parse_config
+from afancontrol.probe import probe
+
+CONFIG = """
+[daemon]
+interval = 5
+
+[actions]
+
+[temp:mobo]
+type = file
+path = %(temp_path)s
+min = 30
+max = 50
+
+[fan: case]
+pwm = %(pwm_path)s
+fan_input = %(fan_input_path)s
+
+[mapping:1]
+fans = case*0.6,
+temps = mobo
+"""
+
+
+@pytest.fixture
+def probe_config(temp_path):
+    paths = dict(
+        temp_path=temp_path / "temp1_input",
+        pwm_path=temp_path / "pwm2",
+        fan_input_path=temp_path / "fan2_input",
+    )
+    paths["temp_path"].write_text("42000")
+    paths["pwm_path"].write_text("100")
+    (temp_path / "pwm2_enable").write_text("2")
+    paths["fan_input_path"].write_text("999")
+    config_path = temp_path / "afancontrol.conf"
+    config_path.write_text(CONFIG % paths)
+    daemon_cli_config = DaemonCLIConfig(
+        pidfile=None, logfile=None, exporter_listen_host=None
+    )
+    return parse_config(config_path, daemon_cli_config), paths
+
+
+def test_probe(probe_config, temp_path, capsys):
+    parsed_config, paths = probe_config
+    assert probe(parsed_config, repeat=3, set_pwm=False) is True
+
+    out = capsys.readouterr().out
+    assert "Probing 1 temps and 1 fans, 3 reads each" in out
+    assert "temp     mobo                 p50=" in out
+    assert "fan      case                 p50=" in out
+    assert "Projected tick duration: p50=" in out
+    assert "errors" not in out
+    # The PWM is not changed without `set_pwm`.
+    assert paths["pwm_path"].read_text() == "100"
+    assert (temp_path / "pwm2_enable").read_text() == "2"
+
+    assert probe(parsed_config, repeat=3, set_pwm=True) is True
+    assert paths["pwm_path"].read_text() == "255"
+    assert (temp_path / "pwm2_enable").read_text() == "0"
+
+
+def test_probe_failing_device(probe_config, capsys):
+    parsed_config, paths = probe_config
+    paths["temp_path"].unlink()
+    assert probe(parsed_config, repeat=2, set_pwm=False) is False
+
+    out = capsys.readouterr().out
+    assert "temp     mobo                 errors=2/2 (last: FileNotFoundError" in out
+    assert "1 device(s) have failed" in out
+
+
+def test_probe_slow_tick(probe_config, capsys):
+    parsed_config, paths = probe_config
+    parsed_config = parsed_config._replace(
+        daemon=parsed_config.daemon._replace(interval=0)
+    )
+    assert probe(parsed_config, repeat=1, set_pwm=False) is False
+    assert "exceeds the interval" in capsys.readouterr().out
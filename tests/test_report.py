@@ -1,4 +1,6 @@
-from unittest.mock import call
+from unittest.mock import call, patch
+
+import pytest
 
 from afancontrol import report
 from afancontrol.report import Report
@@ -18,3 +20,61 @@ def test_report_success(sense_exec_shell_command):
 def test_report_fail_does_not_raise():
     r = Report("false")
     r.report("reason here", "message\nthere")
+
+
+@pytest.fixture
+def clock():
+    with patch.object(Report, "_clock", return_value=1000.0) as mocked_clock:
+        yield mocked_clock
+
+
+def test_report_coalescing(sense_exec_shell_command, clock):
+    r = Report(r"printf '@%s' '%REASON%' '%MESSAGE%'", coalesce_window=30)
+
+    with sense_exec_shell_command(report) as (mock_exec_shell_command, get_stdout):
+        r.report("fan stopped: a", "a")
+        clock.return_value = 1010.0
+        r.report("fan stopped: b", "b")
+        r.flush()
+        assert mock_exec_shell_command.call_count == 0
+
+        # The panic is not held.
+        r.report("Entered PANIC MODE", "panic", urgent=True)
+        assert ["@Entered PANIC MODE@panic"] == get_stdout()
+
+        clock.return_value = 1030.0
+        r.flush()
+        assert [
+            "@fan stopped: a (and 1 more)@[fan stopped: a]\na\n\n" "[fan stopped: b]\nb"
+        ] == get_stdout()
+        assert r.sent == 2
+        assert r.coalesced == 1
+
+        r.report("fan started: a", "a")
+        r.flush(force=True)
+        assert ["@fan started: a@a"] == get_stdout()
+
+
+def test_report_rate_limit(sense_exec_shell_command, clock):
+    r = Report(r"printf '@%s' '%REASON%' '%MESSAGE%'", rate_limit=600)
+
+    with sense_exec_shell_command(report) as (mock_exec_shell_command, get_stdout):
+        # A flapping fan:
+        for i in range(3):
+            clock.return_value = 1000.0 + i
+            r.report("fan stopped: a", "stopped")
+            r.report("fan started: a", "started")
+        assert ["@fan stopped: a@stopped", "@fan started: a@started"] == get_stdout()
+        assert r.suppressed == 4
+
+        # The panic is never suppressed.
+        r.report("Entered PANIC MODE", "panic", urgent=True)
+        r.report("Entered PANIC MODE", "panic", urgent=True)
+        assert ["@Entered PANIC MODE@panic"] * 2 == get_stdout()
+
+        clock.return_value = 1600.0
+        r.report("fan stopped: a", "stopped")
+        assert [
+            "@fan stopped: a@stopped\n\n(2 more report(s) with this reason "
+            "have been suppressed since the previous one)"
+        ] == get_stdout()
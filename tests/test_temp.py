@@ -4,10 +4,13 @@ from unittest.mock import patch
 
 import pytest
 
+from afancontrol import temp
 from afancontrol.temp import (
+    CommandSource,
     CommandTemp,
     FileTemp,
     HDDTemp,
+    SourceTemp,
     Temp,
     TempCelsius,
     TempStatus,
@@ -245,3 +248,112 @@ def test_command_temp_without_minmax():
         is_panic=False,
         is_threshold=False,
     )
+
+
+@pytest.mark.parametrize(
+    "format, output, fields",
+    [
+        ("lines", "\n45\n 52 \n", {"0": 45.0, "1": 52.0}),
+        ("csv", "0, 45\n1, 52\n", {"0,1": 45.0, "1,1": 52.0}),
+        (
+            "json",
+            '{"gpu-0": {"temp1": {"temp1_input": 45.0}}, "list": [1, "52"]}',
+            {"gpu-0/temp1/temp1_input": 45.0, "list/1": 52.0},
+        ),
+    ],
+)
+def test_source_temps(sense_exec_shell_command, format, output, fields):
+    source = CommandSource("printf '%%s' '%s'" % output, format=format)
+    temps = {
+        field: SourceTemp(
+            source,
+            field,
+            min=TempCelsius(30.0),
+            max=TempCelsius(50.0),
+            panic=TempCelsius(50.0),
+            threshold=None,
+        )
+        for field in fields
+    }
+    with sense_exec_shell_command(temp) as (mock_exec, _):
+        assert {field: t.get().temp for field, t in temps.items()} == fields
+        # Executed once for all of the temps.
+        assert mock_exec.call_count == 1
+
+        # Until the next tick.
+        temps[next(iter(fields))].get()
+        assert mock_exec.call_count == 1
+        source.invalidate()
+        temps[next(iter(fields))].get()
+        assert mock_exec.call_count == 2
+    print(repr(temps))
+
+
+def test_source_poll_interval(sense_exec_shell_command):
+    source = CommandSource("sleep 0.3; printf 45", poll_interval=0.2)
+    t = SourceTemp(
+        source,
+        "0",
+        min=TempCelsius(30.0),
+        max=TempCelsius(50.0),
+        panic=None,
+        threshold=None,
+    )
+    with sense_exec_shell_command(temp) as (mock_exec, _):
+        t.get()
+        source.invalidate()
+        # The interval is counted from the end of the execution.
+        t.get()
+        assert mock_exec.call_count == 1
+
+        with patch.object(source, "_clock", return_value=1e9):
+            source.invalidate()
+            t.get()
+        assert mock_exec.call_count == 2
+
+
+def test_source_failure(sense_exec_shell_command):
+    source = CommandSource(r"printf '0, 45\n'", format="csv")
+    t = SourceTemp(
+        source,
+        "0,2",
+        min=TempCelsius(30.0),
+        max=TempCelsius(50.0),
+        panic=None,
+        threshold=None,
+    )
+    with sense_exec_shell_command(temp):
+        with pytest.raises(RuntimeError, match="Unable to get the field"):
+            t.get()
+
+    with patch.object(temp, "exec_shell_command") as mock_exec:
+        mock_exec.side_effect = subprocess.CalledProcessError(1, "sensors")
+        source = CommandSource("sensors", format="lines")
+        t = SourceTemp(
+            source,
+            "0",
+            min=TempCelsius(30.0),
+            max=TempCelsius(50.0),
+            panic=None,
+            threshold=None,
+        )
+        for _ in range(2):
+            with pytest.raises(subprocess.CalledProcessError):
+                t.get()
+        # The failure is cached until the next poll.
+        assert mock_exec.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "format, field", [("lines", "first"), ("csv", "1"), ("csv", "a,1"), ("json", "")]
+)
+def test_source_invalid_field(format, field):
+    with pytest.raises(RuntimeError, match="Invalid field"):
+        SourceTemp(
+            CommandSource("sensors", format=format),
+            field,
+            min=TempCelsius(30.0),
+            max=TempCelsius(50.0),
+            panic=None,
+            threshold=None,
+        )
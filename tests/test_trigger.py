@@ -1,3 +1,4 @@
+from timeit import default_timer
 from unittest.mock import MagicMock, call
 
 import pytest
@@ -35,15 +36,15 @@ def test_panic_on_empty_temp(report, sense_exec_shell_command):
             assert t.is_alerting
 
             assert mock_exec_shell_command.call_args_list == [
-                call("printf '@%s' enter")
+                call("printf '@%s' enter", timeout=5)
             ]
             assert ["@enter"] == get_stdout()
             mock_exec_shell_command.reset_mock()
 
         assert not t.is_alerting
         assert mock_exec_shell_command.call_args_list == [
-            call("printf '@%s' mobo leave"),
-            call("printf '@%s' leave"),
+            call("printf '@%s' mobo leave", timeout=5),
+            call("printf '@%s' leave", timeout=5),
         ]
         assert ["@mobo@leave", "@leave"] == get_stdout()
 
@@ -117,8 +118,8 @@ def test_bad_temp(cls, report, sense_exec_shell_command):
             )
             assert t.is_alerting
             assert mock_exec_shell_command.call_args_list == [
-                call("printf '@%s' mobo enter"),
-                call("printf '@%s' enter"),
+                call("printf '@%s' mobo enter", timeout=5),
+                call("printf '@%s' enter", timeout=5),
             ]
             assert ["@mobo@enter", "@enter"] == get_stdout()
             mock_exec_shell_command.reset_mock()
@@ -138,8 +139,8 @@ def test_bad_temp(cls, report, sense_exec_shell_command):
             )
             assert not t.is_alerting
             assert mock_exec_shell_command.call_args_list == [
-                call("printf '@%s' mobo leave"),
-                call("printf '@%s' leave"),
+                call("printf '@%s' mobo leave", timeout=5),
+                call("printf '@%s' leave", timeout=5),
             ]
             assert ["@mobo@leave", "@leave"] == get_stdout()
             mock_exec_shell_command.reset_mock()
@@ -159,6 +160,8 @@ def test_triggers_good_temp(report):
                     threshold=AlertCommands(enter_cmd=None, leave_cmd=None),
                 )
             },
+            command_parallelism=4,
+            command_timeout=5,
         ),
         report=report,
     )
@@ -178,3 +181,46 @@ def test_triggers_good_temp(report):
             }
         )
         assert not t.is_alerting
+
+
+def test_temp_commands_are_executed_in_parallel(report, temp_path):
+    temp_names = [TempName("disk%s" % i) for i in range(4)]
+    t = PanicTrigger(
+        # Fails unless all of the per-temp commands have completed.
+        global_commands=AlertCommands(
+            enter_cmd="test $(ls %s | wc -l) -eq 4" % temp_path, leave_cmd=None
+        ),
+        temp_commands={
+            name: AlertCommands(
+                enter_cmd="sleep 0.3 && touch %s/%s" % (temp_path, name),
+                leave_cmd=None,
+            )
+            for name in temp_names
+        },
+        report=report,
+        command_parallelism=4,
+    )
+    with t:
+        start = default_timer()
+        t.check({name: None for name in temp_names})
+        assert default_timer() - start < 0.3 * len(temp_names)
+
+    assert t.command_stats.executed == 5
+    assert t.command_stats.failed == 0
+    assert t.command_stats.max_duration_seconds >= 0.3
+
+
+def test_trigger_command_timeout(report):
+    t = PanicTrigger(
+        global_commands=AlertCommands(enter_cmd="sleep 10", leave_cmd=None),
+        temp_commands={TempName("mobo"): AlertCommands(None, None)},
+        report=report,
+        command_timeout=1,
+    )
+    with t:
+        start = default_timer()
+        t.check({TempName("mobo"): None})
+        assert default_timer() - start < 5
+
+    assert t.command_stats.executed == 1
+    assert t.command_stats.failed == 1